@@ -0,0 +1,424 @@
+"""DynamoDB export to measurements ingest, driven by the target layer's fields schema.
+
+Reads a DynamoDB S3 export (full export "Item" records or incremental export
+"NewImage" records), takes one DynamoDB attribute per layer field, typed from
+fields.data_type, and builds attributes with to_json(struct(...)). Geometry
+is a POINT from a "lat, lon" string attribute or from two numeric attributes.
+Rows are staged and upserted with glue_loader.
+
+Ship with the job as --extra-py-files s3://.../glue_loader.py,s3://.../dynamodb_ingest.py
+"""
+import json
+import re
+from datetime import date, timedelta
+
+from pyspark import StorageLevel
+from pyspark.sql.functions import (
+    coalesce, col, concat, concat_ws, count as spark_count, lit, regexp_replace,
+    sha2, split, struct, sum as spark_sum, to_json, to_timestamp, transform, trim, when
+)
+from pyspark.sql.types import ArrayType, StructType
+
+from glue_loader import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MERGE_CHUNK_ROWS, MEASUREMENT_MERGE_SQL, MEASUREMENT_REFRESH_SQL,
+    MEASUREMENT_STAGING_COLUMNS, StagedLoader, get_optional_arg, writer_count
+)
+
+DEFAULT_TIMESTAMP_FORMAT = "yyyy-MM-dd'T'HH:mm:ssXXX"
+
+# Small .json.gz export files are grouped into read tasks of about this many bytes
+DEFAULT_GROUP_SIZE = 128 * 1024 * 1024
+
+# Day folders of an incremental export: <base>/2025-11-16/AWSDynamoDB/data/
+EXPORT_DAY_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})/$")
+
+# fields.data_type (the names LambdaCode/field_types.py accepts) -> Spark type of the value put in attributes
+SPARK_TYPES = {
+    'smallint': 'int',
+    'int2': 'int',
+    'integer': 'int',
+    'int': 'int',
+    'int4': 'int',
+    'bigint': 'bigint',
+    'int8': 'bigint',
+    'numeric': 'double',
+    'decimal': 'double',
+    'real': 'float',
+    'float4': 'float',
+    'double precision': 'double',
+    'float8': 'double',
+    'text': 'string',
+    'varchar': 'string',
+    'character varying': 'string',
+    'timestamp': 'string',
+    'date': 'string',
+    'boolean': 'boolean',
+    'bool': 'boolean',
+    # udt names of array columns
+    '_int2': 'array<int>',
+    '_int4': 'array<int>',
+    '_int8': 'array<bigint>',
+    '_numeric': 'array<double>',
+    '_float4': 'array<float>',
+    '_float8': 'array<double>',
+    '_text': 'array<string>',
+    '_varchar': 'array<string>',
+    '_bool': 'array<boolean>',
+    '_timestamp': 'array<string>',
+    '_date': 'array<string>',
+}
+
+
+def spark_type(data_type):
+    """Spark type for a fields.data_type, arrays as array<element>, unknown types as string"""
+    data_type = (data_type or 'text').lower().strip()
+    if data_type in SPARK_TYPES:
+        return SPARK_TYPES[data_type]
+    if data_type.endswith('[]'):
+        return f"array<{SPARK_TYPES.get(data_type[:-2], 'string')}>"
+    print(f" Field type '{data_type}' has no Spark mapping, stored as text")
+    return 'string'
+
+
+def load_config(**defaults):
+    """Job settings from --ARGS, falling back to the defaults the job script passes
+
+        --LAYER_ID          target layer (required)
+        --S3_PATH           export prefix(es), comma separated (the job may discover them instead)
+        --JDBC_URL          jdbc:postgresql://host:5432/db
+        --DB_SECRET_ID      Secrets Manager secret with username/password, or --DB_USER/--DB_PASSWORD
+        --CREATED_BY        users.user_id stamped on the rows
+        --FIELD_MAP         JSON {"field_name": "DynamoDB attribute"}, same name when not listed
+        --LOCATION_ATTR     "lat, lon" string attribute (default location)
+        --LON_ATTR/--LAT_ATTR  numeric coordinate attributes, used instead of LOCATION_ATTR
+        --TIMESTAMP_ATTR    record time attribute (default DATE), --TIMESTAMP_FORMAT its pattern
+        --KEY_ATTRS         attributes that with the record time identify a record (default DEVICE)
+    """
+    def arg(name, key, default=None):
+        return get_optional_arg(name, defaults.get(key, default))
+
+    config = {
+        "layer_id": arg('LAYER_ID', 'layer_id'),
+        "s3_paths": arg('S3_PATH', 's3_paths'),
+        "jdbc_url": arg('JDBC_URL', 'jdbc_url'),
+        "db_secret_id": arg('DB_SECRET_ID', 'db_secret_id'),
+        "db_user": arg('DB_USER', 'db_user'),
+        "db_password": arg('DB_PASSWORD', 'db_password'),
+        "created_by": arg('CREATED_BY', 'created_by'),
+        "field_map": arg('FIELD_MAP', 'field_map', {}),
+        "location_attr": arg('LOCATION_ATTR', 'location_attr', 'location'),
+        "lon_attr": arg('LON_ATTR', 'lon_attr'),
+        "lat_attr": arg('LAT_ATTR', 'lat_attr'),
+        "timestamp_attr": arg('TIMESTAMP_ATTR', 'timestamp_attr', 'DATE'),
+        "timestamp_format": arg('TIMESTAMP_FORMAT', 'timestamp_format', DEFAULT_TIMESTAMP_FORMAT),
+        "key_attrs": arg('KEY_ATTRS', 'key_attrs', 'DEVICE'),
+    }
+    if isinstance(config["field_map"], str):
+        config["field_map"] = json.loads(config["field_map"])
+    for key in ("s3_paths", "key_attrs"):
+        if isinstance(config[key], str) or config[key] is None:
+            config[key] = [value.strip() for value in (config[key] or "").split(",") if value.strip()]
+    if config["db_secret_id"]:
+        import boto3
+        secret = json.loads(boto3.client('secretsmanager').get_secret_value(SecretId=config["db_secret_id"])["SecretString"])
+        config["db_user"], config["db_password"] = secret["username"], secret["password"]
+
+    missing = [name for name in ("layer_id", "jdbc_url", "db_user", "db_password") if not config[name]]
+    if missing:
+        raise ValueError(f"Missing job arguments: {', '.join(missing)}")
+    config["layer_id"] = int(config["layer_id"])
+    config["created_by"] = int(config["created_by"]) if config["created_by"] not in (None, "") else None
+    return config
+
+
+def image_column(df):
+    """NewImage (incremental export) or Item (full export)"""
+    for name in ("NewImage", "Item"):
+        if name in df.columns:
+            return name
+    raise ValueError("Neither 'Item' nor 'NewImage' found in data")
+
+
+def dynamo_value(image, image_type, name, target_type):
+    """Column with a DynamoDB attribute's value as target_type, NULL when no record has it
+
+    Reads the type descriptors the export actually contains (N, S, BOOL, L,
+    SS, NS), so a field missing from the whole export is NULL instead of an
+    analysis error.
+    """
+    field = next((f for f in image_type.fields if f.name == name), None)
+    if field is None or not isinstance(field.dataType, StructType):
+        return lit(None).cast(target_type)
+    descriptors = set(field.dataType.fieldNames())
+    attr = col(image).getField(name)
+
+    candidates = []
+    if target_type.startswith("array<"):
+        if "L" in descriptors:
+            element = field.dataType["L"].dataType
+            element = element.elementType if isinstance(element, ArrayType) else None
+            keys = [k for k in ("S", "N") if isinstance(element, StructType) and k in element.fieldNames()]
+            if keys:
+                candidates.append(transform(
+                    attr.getField("L"), lambda x: coalesce(*[x.getField(k) for k in keys])
+                ).cast(target_type))
+        candidates += [attr.getField(k).cast(target_type) for k in ("SS", "NS") if k in descriptors]
+    elif target_type == "boolean":
+        candidates += [attr.getField(k).cast(target_type) for k in ("BOOL",) if k in descriptors]
+    else:
+        candidates += [attr.getField(k).cast(target_type) for k in ("N", "S") if k in descriptors]
+
+    if not candidates:
+        return lit(None).cast(target_type)
+    return coalesce(*candidates) if len(candidates) > 1 else candidates[0]
+
+
+def parse_export(df, fields, config, srid):
+    """Flag, key and shape DynamoDB export rows for staging
+
+    Adds has_image, is_parsed, is_valid, record_timestamp, record_key,
+    attributes and geom_wkt. Invalid rows are flagged, not filtered, so one
+    pass can count every stage.
+    """
+    image = image_column(df)
+    image_type = df.schema[image].dataType
+    print(f"   Format: {'Incremental Export (NewImage)' if image == 'NewImage' else 'Full Export (Item)'}")
+
+    def value(name, target_type="string"):
+        return dynamo_value(image, image_type, name, target_type)
+
+    # One attribute per layer field, named as the field
+    field_map = config["field_map"]
+    attributes = [
+        value(field_map.get(name, name), spark_type(data_type)).alias(name)
+        for name, data_type in fields
+    ]
+
+    if config["lon_attr"] and config["lat_attr"]:
+        longitude, latitude = value(config["lon_attr"], "double"), value(config["lat_attr"], "double")
+    else:
+        location = regexp_replace(trim(value(config["location_attr"])), " +", "")
+        latitude = split(location, ",").getItem(0).cast("double")
+        longitude = split(location, ",").getItem(1).cast("double")
+
+    # Fix malformed dates like "2025-011-16" → "2025-11-16"
+    timestamp_str = value(config["timestamp_attr"])
+    timestamp_clean = regexp_replace(regexp_replace(timestamp_str, r"-0(\d{2})-", "-$1-"), r"-0(\d{2})T", "-$1T")
+
+    parsed = df.select(
+        col(image).isNotNull().alias("has_image"),
+        to_timestamp(timestamp_clean, config["timestamp_format"]).alias("record_timestamp"),
+        concat_ws("|", *[value(name) for name in config["key_attrs"]]).alias("key_values"),
+        longitude.alias("longitude"),
+        latitude.alias("latitude"),
+        to_json(struct(*attributes)).alias("attributes"),
+    )
+
+    parsed = parsed.withColumn(
+        "is_parsed",
+        col("has_image") & col("longitude").isNotNull() & col("latitude").isNotNull()
+    )
+    is_valid = col("is_parsed")
+    if srid == 4326:
+        is_valid = is_valid & col("latitude").between(-90, 90) & col("longitude").between(-180, 180)
+
+    # Dedup key: same key attributes and record time is the same record across runs
+    # and export types. Without a timestamp there is no identity, such rows are always inserted
+    return parsed.withColumn("is_valid", is_valid).withColumn(
+        "record_key",
+        when(col("record_timestamp").isNotNull(),
+             sha2(concat_ws("|", col("key_values"), col("record_timestamp").cast("string")), 256))
+    ).withColumn(
+        "geom_wkt",
+        concat(lit("POINT("), col("longitude"), lit(" "), col("latitude"), lit(")"))
+    ).withColumn(
+        "layer_id", lit(config["layer_id"])
+    ).withColumn(
+        "created_by", lit(config["created_by"]).cast("integer")
+    )
+
+
+def sql_literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def get_watermark(spark, config, job_name):
+    """Last export day merged by job_name, None before its first run"""
+    loader = StagedLoader(spark, config["jdbc_url"], config["db_user"], config["db_password"])
+    try:
+        row = loader.query_one(f"SELECT watermark FROM ingest_watermarks WHERE job_name = {sql_literal(job_name)}")
+    finally:
+        loader.close()
+    return date.fromisoformat(str(row[0])) if row else None
+
+
+def watermark_sql(job_name, day):
+    """Statement moving the watermark forward to day (never back), for run_ingest final_sql"""
+    # final_sql is str.format-ted with the staging table name
+    job_name = job_name.replace("{", "{{").replace("}", "}}")
+    return f"""
+        INSERT INTO ingest_watermarks (job_name, watermark, updated_at)
+        VALUES ({sql_literal(job_name)}, DATE {sql_literal(day.isoformat())}, NOW())
+        ON CONFLICT (job_name) DO UPDATE
+            SET watermark = GREATEST(ingest_watermarks.watermark, EXCLUDED.watermark), updated_at = NOW()
+    """
+
+
+def discover_export_days(base_path, after, until, data_suffix="AWSDynamoDB/data/", contiguous=False):
+    """[(day, s3 path)] of the export day folders under base_path with after < day <= until
+
+    Stops before the first day folder whose data prefix is still empty (an
+    export in progress), so the watermark never passes it. With contiguous it
+    also stops before the first day without a folder at all; otherwise such
+    days are reported as gaps, a backfill can load them later.
+    """
+    import boto3
+    bucket, _, prefix = base_path[len("s3://"):].partition("/")
+    prefix = prefix.rstrip("/") + "/" if prefix else ""
+    s3 = boto3.client('s3')
+
+    days = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        for common in page.get("CommonPrefixes", []):
+            match = EXPORT_DAY_PATTERN.search(common["Prefix"])
+            if not match:
+                continue
+            day = date.fromisoformat(match.group(1))
+            if (after is None or day > after) and day <= until:
+                days.append((day, common["Prefix"]))
+
+    found = []
+    next_day = after + timedelta(days=1) if after else None
+    for day, day_prefix in sorted(days):
+        if contiguous and next_day and day != next_day:
+            print(f" No export for {next_day}, stopping before it")
+            break
+        next_day = day + timedelta(days=1)
+        if s3.list_objects_v2(Bucket=bucket, Prefix=day_prefix + data_suffix, MaxKeys=1).get("KeyCount", 0):
+            found.append((day, f"s3://{bucket}/{day_prefix}{data_suffix}"))
+        else:
+            print(f" Export {day} has no data files yet, stopping before it")
+            break
+
+    if found and not contiguous:
+        expected = (found[-1][0] - (after or found[0][0] - timedelta(days=1))).days
+        if len(found) < expected:
+            print(f" Warning: {expected - len(found)} day(s) without an export between {after} and {found[-1][0]}")
+    return found
+
+
+def layer_schema(loader, layer_id):
+    """(srid, geom_type, [(field_name, data_type), ...]) of the target layer"""
+    row = loader.query_one(f"SELECT srid, geom_type FROM layers WHERE layer_id = {int(layer_id)}")
+    if row is None:
+        raise ValueError(f"Layer {layer_id} not found")
+    fields = loader.query_all(f"""
+        SELECT field_name, data_type FROM fields
+        WHERE layer_id = {int(layer_id)} ORDER BY field_id
+    """)
+    srid, geom_type = int(row[0] or 4326), (row[1] or "POINT").upper()
+    if geom_type != "POINT":
+        raise ValueError(f"Layer {layer_id} is {geom_type}, the DynamoDB ingest builds POINT geometries")
+    return srid, geom_type, [(str(name), str(data_type)) for name, data_type in fields]
+
+
+def run_final(loader, final_sql):
+    """final_sql of a run that merged nothing, e.g. a watermark over empty exports"""
+    for sql in final_sql:
+        loader.execute(sql.format(staging=loader.staging_table))
+
+
+def run_ingest(glueContext, config, verbose=False, transformation_ctx="read_from_s3_dynamodb", final_sql=()):
+    """Read config["s3_paths"], stage and upsert into measurements, returns the counts
+
+    final_sql statements commit in the same transaction as the last merge
+    chunk, or on their own when there is nothing to merge.
+    """
+    if not config["s3_paths"]:
+        raise ValueError("No S3 path to read")
+    spark = glueContext.spark_session
+    # measurements.timestamp is UTC without zone, and record keys must not depend on the worker zone
+    spark.conf.set("spark.sql.session.timeZone", "UTC")
+
+    # Writers sized to the RDS instance (--RDS_INSTANCE_CLASS db.m5.xlarge) or set with --WRITE_PARTITIONS
+    loader = StagedLoader(
+        spark, config["jdbc_url"], config["db_user"], config["db_password"],
+        writers=writer_count(get_optional_arg('RDS_INSTANCE_CLASS'), get_optional_arg('WRITE_PARTITIONS')),
+        batch_size=int(get_optional_arg('WRITE_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+        merge_chunk_rows=int(get_optional_arg('MERGE_CHUNK_ROWS', DEFAULT_MERGE_CHUNK_ROWS)),
+        run_id=get_optional_arg('JOB_RUN_ID')
+    )
+    counts = {"records": 0, "parsed": 0, "valid": 0, "merged": 0}
+    df_parsed = None
+
+    try:
+        srid, _, fields = layer_schema(loader, config["layer_id"])
+        print(f" Layer {config['layer_id']}: {len(fields)} fields, SRID {srid}")
+        print(f" Reading DynamoDB export from: {', '.join(config['s3_paths'])}")
+
+        dyf = glueContext.create_dynamic_frame.from_options(
+            connection_type="s3",
+            connection_options={
+                "paths": config["s3_paths"],
+                "recurse": True,
+                "compressionType": "gzip",
+                # Many small files (one catch-up run reads every missed day) become
+                # evenly sized tasks instead of one task per file
+                "groupFiles": "inPartition",
+                "groupSize": str(get_optional_arg('GROUP_SIZE', DEFAULT_GROUP_SIZE)),
+            },
+            format="json",
+            transformation_ctx=transformation_ctx
+        )
+        # Nothing below is evaluated until the counts: the export is read and parsed once,
+        # persisted, and the counts and the JDBC write both run from that copy
+        df = dyf.toDF()
+
+        # Empty export: no columns to parse
+        if not df.columns:
+            print(" No data found.")
+            run_final(loader, final_sql)
+            return counts
+
+        if verbose:
+            df.printSchema()
+
+        df_parsed = parse_export(df, fields, config, srid).persist(StorageLevel.MEMORY_AND_DISK)
+        if verbose:
+            df_parsed.select("record_timestamp", "record_key", "geom_wkt", "attributes").show(5, truncate=False)
+
+        row = df_parsed.agg(
+            spark_count(lit(1)).alias("records"),
+            spark_sum(when(col("is_parsed"), 1).otherwise(0)).alias("parsed"),
+            spark_sum(when(col("is_valid"), 1).otherwise(0)).alias("valid")
+        ).first()
+        counts.update(records=row["records"], parsed=row["parsed"] or 0, valid=row["valid"] or 0)
+        print(f" Read {counts['records']} records, parsed {counts['parsed']}, valid coordinates {counts['valid']}")
+
+        if counts["valid"] == 0:
+            print(" No valid records.")
+            run_final(loader, final_sql)
+            return counts
+
+        # Per-run UNLOGGED staging table, concurrent runs never share it
+        loader.create_staging(MEASUREMENT_STAGING_COLUMNS)
+        loader.write(df_parsed.filter(col("is_valid")).select(
+            "layer_id", "attributes", "geom_wkt", "created_by", "record_key", "record_timestamp"
+        ))
+
+        # Upsert in stage_id chunks on (layer_id, record_key, timestamp): a rerun over the
+        # same export only touches records whose content changed
+        counts["merged"] = loader.merge(MEASUREMENT_MERGE_SQL, final_sql, srid=srid)
+
+        # Cache versions and rollups only move when rows did
+        if counts["merged"] > 0:
+            loader.execute(MEASUREMENT_REFRESH_SQL.format(staging=loader.staging_table))
+            print(" Rollup days marked dirty")
+        print(f" Inserted or updated {counts['merged']} records in measurements table")
+        return counts
+
+    finally:
+        # Drops the staging table
+        loader.close()
+        if df_parsed is not None:
+            df_parsed.unpersist()
@@ -0,0 +1,218 @@
+"""Staged PostgreSQL loader shared by the Glue ingest jobs.
+
+Each run writes into its own UNLOGGED staging table (no WAL, no clash with a
+concurrent run), from WRITE_PARTITIONS parallel JDBC writers with
+reWriteBatchedInserts, then merges into measurements in chunks of
+MERGE_CHUNK_ROWS rows, each chunk its own short transaction.
+
+Ship with the job as --extra-py-files s3://.../glue_loader.py
+"""
+import re
+import sys
+import uuid
+
+from awsglue.utils import getResolvedOptions
+
+# Parallel writers per RDS instance size: about 2 per vCPU, leaving room for the API
+WRITERS_BY_INSTANCE_SIZE = {
+    "micro": 2, "small": 2, "medium": 4, "large": 4,
+    "xlarge": 8, "2xlarge": 16, "4xlarge": 32,
+}
+DEFAULT_WRITERS = 4
+MAX_WRITERS = 32
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_MERGE_CHUNK_ROWS = 50000
+
+# Staging layout of the measurement jobs. record_key identifies the source record
+# (device + record time), record_timestamp becomes measurements.timestamp
+MEASUREMENT_STAGING_COLUMNS = """
+    layer_id INTEGER,
+    attributes TEXT,
+    geom_wkt TEXT,
+    created_by INTEGER,
+    record_key TEXT,
+    record_timestamp TIMESTAMP
+"""
+
+# Upsert of one stage_id chunk, merge(MEASUREMENT_MERGE_SQL, srid=...): a record seen before is updated only when its
+# attributes or geometry changed, so re-running an export adds no rows. The
+# last staged copy of a record wins within a chunk (ON CONFLICT cannot touch a
+# row twice in one statement)
+MEASUREMENT_MERGE_SQL = """
+    INSERT INTO measurements (layer_id, attributes, geom, created_by, record_key, timestamp)
+    SELECT DISTINCT ON (layer_id, COALESCE(record_key, stage_id::text), COALESCE(record_timestamp, NOW()::timestamp))
+        layer_id,
+        attributes::jsonb,
+        ST_SetSRID(ST_GeomFromText(geom_wkt), {srid}),
+        created_by,
+        record_key,
+        COALESCE(record_timestamp, NOW()::timestamp)
+    FROM {staging}
+    WHERE stage_id > {lo} AND stage_id <= {hi}
+      AND geom_wkt IS NOT NULL
+      AND attributes IS NOT NULL
+    ORDER BY layer_id, COALESCE(record_key, stage_id::text), COALESCE(record_timestamp, NOW()::timestamp), stage_id DESC
+    ON CONFLICT (layer_id, record_key, timestamp) DO UPDATE
+        SET attributes = EXCLUDED.attributes, geom = EXCLUDED.geom
+        WHERE measurements.attributes IS DISTINCT FROM EXCLUDED.attributes
+           OR measurements.geom::text IS DISTINCT FROM EXCLUDED.geom::text
+"""
+
+# After a merge that changed rows: invalidate cached responses of the staged layers
+# and mark the days the records fall on dirty; refreshRollups recomputes them in
+# short per-day transactions instead of this job holding one over every layer
+MEASUREMENT_REFRESH_SQL = """
+    UPDATE layers SET data_version = data_version + 1
+    WHERE layer_id IN (SELECT DISTINCT layer_id FROM {staging});
+    SELECT mark_rollups_dirty(layer_id, day, day)
+    FROM (
+        SELECT DISTINCT layer_id, COALESCE(record_timestamp, NOW()::timestamp)::date::timestamp AS day
+        FROM {staging}
+    ) touched;
+"""
+
+
+def get_optional_arg(name, default=None):
+    """Glue job argument --NAME, default when it was not passed"""
+    if f"--{name}" not in sys.argv:
+        return default
+    return getResolvedOptions(sys.argv, [name])[name]
+
+
+def writer_count(instance_class=None, override=None):
+    """Parallel JDBC writers: explicit override, else sized from e.g. db.m5.xlarge"""
+    if override:
+        return max(1, min(int(override), MAX_WRITERS))
+    if instance_class:
+        size = instance_class.rsplit(".", 1)[-1]
+        return WRITERS_BY_INSTANCE_SIZE.get(size, DEFAULT_WRITERS)
+    return DEFAULT_WRITERS
+
+
+class StagedLoader:
+    """Per-run staging table in PostgreSQL, filled by Spark and merged in chunks"""
+
+    def __init__(self, spark, jdbc_url, user, password, writers=DEFAULT_WRITERS,
+                 batch_size=DEFAULT_BATCH_SIZE, merge_chunk_rows=DEFAULT_MERGE_CHUNK_ROWS, run_id=None):
+        self.spark = spark
+        self.jdbc_url = jdbc_url
+        self.user = user
+        self.password = password
+        self.writers = writers
+        self.batch_size = batch_size
+        self.merge_chunk_rows = merge_chunk_rows
+        run_id = re.sub(r"[^a-z0-9]", "", (run_id or uuid.uuid4().hex).lower())[-24:]
+        self.staging_table = f"glue_staging_{run_id}"
+        self._conn = None
+        self._staged = False
+
+    def connection(self):
+        """Driver-side JDBC connection through py4j, reused for DDL and merges"""
+        if self._conn is None:
+            from py4j.java_gateway import java_import
+            java_import(self.spark._jvm, "java.sql.DriverManager")
+            self._conn = self.spark._jvm.DriverManager.getConnection(self.jdbc_url, self.user, self.password)
+        return self._conn
+
+    def execute(self, sql):
+        """Run one statement, returns the update count (-1 for queries)"""
+        stmt = self.connection().createStatement()
+        try:
+            if stmt.execute(sql):
+                return -1
+            return stmt.getUpdateCount()
+        finally:
+            stmt.close()
+
+    def query_one(self, sql):
+        rows = self.query_all(sql)
+        return rows[0] if rows else None
+
+    def query_all(self, sql):
+        """Rows of a (small) query as lists"""
+        stmt = self.connection().createStatement()
+        try:
+            rs = stmt.executeQuery(sql)
+            columns = rs.getMetaData().getColumnCount()
+            rows = []
+            while rs.next():
+                rows.append([rs.getObject(i + 1) for i in range(columns)])
+            return rows
+        finally:
+            stmt.close()
+
+    def create_staging(self, columns_sql):
+        """CREATE UNLOGGED TABLE with a stage_id the merge chunks on"""
+        self.execute(f"DROP TABLE IF EXISTS {self.staging_table}")
+        self.execute(f"""
+            CREATE UNLOGGED TABLE {self.staging_table} (
+                stage_id BIGSERIAL PRIMARY KEY,
+                {columns_sql}
+            )
+        """)
+        self._staged = True
+        print(f" Staging table {self.staging_table} created")
+
+    def write(self, df):
+        """Append df to the staging table from self.writers parallel JDBC connections"""
+        separator = "&" if "?" in self.jdbc_url else "?"
+        df.repartition(self.writers).write \
+            .mode("append") \
+            .option("numPartitions", self.writers) \
+            .option("batchsize", self.batch_size) \
+            .jdbc(
+                url=f"{self.jdbc_url}{separator}reWriteBatchedInserts=true",
+                table=self.staging_table,
+                properties={
+                    "user": self.user,
+                    "password": self.password,
+                    "driver": "org.postgresql.Driver",
+                    "isolationLevel": "NONE",
+                }
+            )
+        print(f" Wrote staging table with {self.writers} parallel writers")
+
+    def merge(self, merge_sql, final_sql=(), **params):
+        """Run merge_sql over stage_id ranges, committing after each chunk
+
+        merge_sql is formatted with {staging}, {lo}, {hi} and params, and must
+        filter on stage_id > {lo} AND stage_id <= {hi}. final_sql statements
+        run in the transaction of the last chunk, so they commit together with
+        it. Returns the total update count.
+        """
+        lo, hi = self.query_one(f"SELECT COALESCE(MIN(stage_id) - 1, 0), COALESCE(MAX(stage_id), 0) FROM {self.staging_table}")
+        lo, hi = int(lo), int(hi)
+        conn = self.connection()
+        conn.setAutoCommit(False)
+        total = 0
+        try:
+            start = lo
+            while True:
+                end = min(start + self.merge_chunk_rows, hi)
+                total += max(self.execute(merge_sql.format(staging=self.staging_table, lo=start, hi=end, **params)), 0)
+                if end >= hi:
+                    for sql in final_sql:
+                        self.execute(sql.format(staging=self.staging_table, **params))
+                    conn.commit()
+                    break
+                conn.commit()
+                start = end
+            print(f" Merged {total} rows from {self.staging_table} in chunks of {self.merge_chunk_rows}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.setAutoCommit(True)
+        return total
+
+    def close(self):
+        """Drop the staging table (if one was created) and close the connection"""
+        if self._conn is None:
+            return
+        try:
+            if self._staged:
+                self.execute(f"DROP TABLE IF EXISTS {self.staging_table}")
+        finally:
+            self._conn.close()
+            self._conn = None
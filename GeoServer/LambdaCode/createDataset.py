@@ -1,7 +1,10 @@
 import os
 import json
-import psycopg2
-import requests
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import geoserver
+import metadata_cache
 
 # --- Config --- #
 RDS_HOST = os.environ['RDS_HOST']
@@ -10,9 +13,15 @@ RDS_DB = os.environ['RDS_DB']
 RDS_USER = os.environ['RDS_USER']
 RDS_PASS = os.environ['RDS_PASS']
 
-GEOSERVER_URL = os.environ['GEOSERVER_URL']  
-GEOSERVER_USER = os.environ['GEOSERVER_USER']
-GEOSERVER_PASS = os.environ['GEOSERVER_PASS']
+
+def create_workspace(workspace_name):
+    """POST the dataset workspace to GeoServer"""
+    headers = {"Content-Type": "application/json"}
+    return geoserver.post(
+        "/rest/workspaces",
+        headers=headers,
+        json={"workspace": {"name": workspace_name}}
+    )
 
 
 def lambda_handler(event, context):
@@ -33,54 +42,48 @@ def lambda_handler(event, context):
     if not dataset_name or not owner_id:
         return {"statusCode": 400, "body": json.dumps({"message" : "Missing required fields"})}
 
-    # Insert dataset into RDS
-    try:
-        conn = psycopg2.connect(
-            host=RDS_HOST,
-            port=RDS_PORT,
-            database=RDS_DB,
-            user=RDS_USER,
-            password=RDS_PASS
-        )
-        cur = conn.cursor()
-        insert_sql = """
-        INSERT INTO datasets (name, description, owner_id, is_active)
-        VALUES (%s, %s, %s, TRUE)
-        RETURNING dataset_id;
-        """
-        cur.execute(insert_sql, (dataset_name, dataset_desc, owner_id))
-        dataset_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
-        print(f"Inserted dataset_id={dataset_id}")
-    except Exception as e:
-        print("Error inserting dataset:", e)
-        return {
-            "statusCode" : 500,
-            "body" : json.dumps({
-                "message" : f"DB insert error {e}"
-            })
-        }
-
-    # Create workspace in GeoServer
     workspace_name = dataset_name.lower().replace(" ", "_")
-    workspace_payload = {
-        "workspace": {"name": workspace_name}
-    }
+
+    # The workspace POST runs while the dataset row is inserted. The row is only
+    # committed once GeoServer accepted the workspace, so a clash leaves no orphan.
+    insert_sql = """
+    INSERT INTO datasets (name, description, owner_id, is_active)
+    VALUES (%s, %s, %s, TRUE)
+    RETURNING dataset_id;
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        workspace_future = executor.submit(create_workspace, workspace_name)
+        try:
+            with db.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(insert_sql, (dataset_name, dataset_desc, owner_id))
+                    dataset_id = cur.fetchone()[0]
+                    workspace_created = workspace_future.exception() is None and \
+                        workspace_future.result().status_code in [200, 201]
+                    if not workspace_created:
+                        conn.rollback()
+        except Exception as e:
+            print("Error inserting dataset:", e)
+            # Undo the workspace made for a dataset that was never stored
+            try:
+                if workspace_future.result().status_code in [200, 201]:
+                    geoserver.request("DELETE", f"/rest/workspaces/{workspace_name}",
+                                      op="DELETE /rest/workspaces/{workspace}")
+            except Exception as cleanup_error:
+                print("Error removing GeoServer workspace:", cleanup_error)
+            return {
+                "statusCode" : 500,
+                "body" : json.dumps({
+                    "message" : f"DB insert error {e}"
+                })
+            }
 
     try:
-        url_workspace = f"{GEOSERVER_URL}/rest/workspaces"
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(
-            url_workspace,
-            auth=(GEOSERVER_USER, GEOSERVER_PASS),
-            headers=headers,
-            json=workspace_payload,
-            timeout=30
-        )
+        response = workspace_future.result()
         if response.status_code in [200, 201]:
+            print(f"Inserted dataset_id={dataset_id}")
             print(f"Workspace '{workspace_name}' created successfully in GeoServer")
+            metadata_cache.invalidate_dataset(dataset_id)
         elif response.status_code == 409:
             print(f"Workspace '{workspace_name}' already exists")
             return {
@@ -108,27 +111,39 @@ def lambda_handler(event, context):
                     {"@key": "database", "$": RDS_DB},
                     {"@key": "user", "$": RDS_USER},
                     {"@key": "passwd", "$": RDS_PASS},
-                    {"@key": "dbtype", "$": "postgis"}
+                    {"@key": "dbtype", "$": "postgis"},
+                    # Typed layer tables key on id; without this GeoServer hides it and
+                    # the id tiebreak getFeatures appends to paged sorts fails
+                    {"@key": "Expose primary keys", "$": "true"}
                 ]
             }
         }
     }
 
     try:
-        url_store = f"{GEOSERVER_URL}/rest/workspaces/{workspace_name}/datastores"
+        url_store = f"/rest/workspaces/{workspace_name}/datastores"
         headers = {"Content-Type": "application/json"}
-        response_store = requests.post(
+        response_store = geoserver.post(
             url_store,
-            auth=(GEOSERVER_USER, GEOSERVER_PASS),
             headers=headers,
             json=store_payload,
-            timeout=30
+            op="POST /rest/workspaces/{workspace}/datastores"
         )
 
         if response_store.status_code in [200, 201]:
             print(f"Datastore '{store_name}' created successfully in workspace '{workspace_name}'")
         elif response_store.status_code == 409:
-            print(f"Datastore '{store_name}' already exists")
+            print(f"Datastore '{store_name}' already exists, updating its connection parameters")
+            response_store = geoserver.request(
+                "PUT",
+                f"{url_store}/{store_name}",
+                headers=headers,
+                json=store_payload,
+                op="PUT /rest/workspaces/{workspace}/datastores/{datastore}"
+            )
+            if response_store.status_code not in [200, 201]:
+                print("GeoServer datastore response:", response_store.status_code, response_store.text)
+                return {"statusCode": 500, "body": json.dumps({"message" : f"GeoServer datastore error: {response_store.text}"})}
         else:
             print("GeoServer datastore response:", response_store.status_code, response_store.text)
             return {"statusCode": 500, "body": json.dumps({"message" : f"GeoServer datastore error: {response_store.text}"})}
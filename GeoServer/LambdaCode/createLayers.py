@@ -0,0 +1,126 @@
+import json
+import os
+
+import db
+import metadata_cache
+from layer_provisioning import parse_layer, insert_layers, publish_layers, publish_error
+
+# Upper bound on layers per request, all of them share one transaction
+MAX_BULK_LAYERS = int(os.environ.get('MAX_BULK_LAYERS', 200))
+
+
+def lambda_handler(event, context):
+    """
+    POST /datasets/{dataset_id}/layers/bulk
+
+    Example Event JSON:
+    {
+        "layers": [
+            {
+                "layer_name": "noise_measurements",
+                "title": "Noise Measurements",
+                "geom_type": "POINT",
+                "fields": [
+                    {"field_name": "noise_level", "data_type": "numeric", "unit": "dB", "indexed": true}
+                ]
+            },
+            {
+                "layer_name": "air_quality",
+                "storage_mode": "typed",
+                "fields": [
+                    {"field_name": "pm25", "data_type": "numeric", "unit": "µg/m³"}
+                ]
+            }
+        ]
+    }
+
+    Every layer definition takes the same keys as createLayer. Layers and
+    fields are created in one transaction (all or nothing), then the
+    featuretypes are published with PUBLISH_CONCURRENCY requests in flight.
+    Returns 201 when everything was published, 207 with the per-layer report
+    when some featuretypes failed (those layers exist in the DB and can be
+    re-published).
+    """
+    path_params = event.get('pathParameters') or {}
+    dataset_id = path_params.get("dataset_id")
+
+    body = event.get("body")
+    if isinstance(body, str):
+        body = json.loads(body)
+    elif not body:
+        body = {}
+
+    definitions = body.get("layers") or []
+    if not definitions:
+        return {"statusCode": 400, "body": json.dumps({"message": "layers is required"})}
+    if len(definitions) > MAX_BULK_LAYERS:
+        return {"statusCode": 400, "body": json.dumps({"message": f"At most {MAX_BULK_LAYERS} layers per request"})}
+
+    # Validate every definition up front, nothing is written if one is invalid
+    layers = []
+    errors = []
+    seen = set()
+    for index, definition in enumerate(definitions):
+        try:
+            layer = parse_layer(definition)
+        except ValueError as e:
+            errors.append({"index": index, "layer_name": definition.get("layer_name"), "error": str(e)})
+            continue
+        if layer["name"] in seen:
+            errors.append({"index": index, "layer_name": layer["layer_name"], "error": "Duplicate layer_name in request"})
+            continue
+        seen.add(layer["name"])
+        layers.append(layer)
+    if errors:
+        return {"statusCode": 400, "body": json.dumps({"message": "Invalid layer definitions", "errors": errors})}
+
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                workspace = insert_layers(cur, dataset_id, layers)
+                if workspace is None:
+                    return {"statusCode": 404, "body": json.dumps({"message": f"Dataset ID {dataset_id} not found"})}
+        print(f"Created {len(layers)} layers, "
+              f"{sum(len(layer['fields']) for layer in layers)} fields in dataset {dataset_id}")
+    except Exception as e:
+        return {"statusCode": 500, "body": json.dumps({"message": f"DB error: {e}"})}
+
+    for layer in layers:
+        metadata_cache.invalidate_layer(layer["layer_id"])
+
+    report = []
+    for index, (layer, published) in enumerate(zip(layers, publish_layers(workspace, layers))):
+        layer_errors = {kind: publish_error(result) for kind, result in published.items()}
+        layer_errors = {kind: error for kind, error in layer_errors.items() if error}
+        report.append({
+            "index": index,
+            "layer_id": layer["layer_id"],
+            "layer_name": layer["name"],
+            "view_name": f"{layer['name']}_view",
+            "storage_mode": layer["storage_mode"],
+            "fields": len(layer["fields"]),
+            "indexes": layer["indexes"],
+            "status": "failed" if layer_errors else "published",
+            "errors": layer_errors,
+        })
+
+    failed = sum(1 for entry in report if entry["status"] == "failed")
+    print("Bulk layer creation completed:", {
+        "dataset_id": dataset_id,
+        "workspace": workspace,
+        "layers": len(report),
+        "failed": failed
+    })
+
+    return {
+        "statusCode": 207 if failed else 201,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({
+            "dataset_id": int(dataset_id),
+            "workspace": workspace,
+            "created": len(report),
+            "published": len(report) - failed,
+            "failed": failed,
+            "layers": report
+        })
+    }
@@ -0,0 +1,102 @@
+import os
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+# RDS connection (RDS_* with DB_* fallback for the older handlers)
+RDS_HOST = os.environ.get('RDS_HOST') or os.environ.get('DB_HOST')
+RDS_PORT = int(os.environ.get('RDS_PORT') or os.environ.get('DB_PORT') or 5432)
+RDS_DB = os.environ.get('RDS_DB') or os.environ.get('DB_NAME')
+RDS_USER = os.environ.get('RDS_USER') or os.environ.get('DB_USER')
+RDS_PASS = os.environ.get('RDS_PASS') or os.environ.get('DB_PASSWORD')
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 4))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+
+# Connections idle longer than this (seconds) are pinged before being reused
+DB_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_HEALTHCHECK_INTERVAL', 30))
+
+# Module level so the pool survives across warm Lambda invocations
+_pool = None
+_last_used = {}
+
+
+def get_pool():
+    """Create the connection pool on first use and return it"""
+    global _pool
+    if _pool is None or _pool.closed:
+        _pool = pool.ThreadedConnectionPool(
+            DB_POOL_MIN, DB_POOL_MAX,
+            host=RDS_HOST, port=RDS_PORT, database=RDS_DB,
+            user=RDS_USER, password=RDS_PASS,
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+        )
+        print(f"DB pool created (min={DB_POOL_MIN}, max={DB_POOL_MAX})")
+    return _pool
+
+
+def _is_healthy(conn):
+    """Check a pooled connection, pinging it only if it sat idle for a while"""
+    if conn.closed:
+        return False
+    idle = time.monotonic() - _last_used.get(id(conn), 0)
+    if idle < DB_HEALTHCHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def _discard(conn):
+    _last_used.pop(id(conn), None)
+    get_pool().putconn(conn, close=True)
+
+
+def _checkout(retries=2):
+    """Borrow a healthy connection, replacing stale sockets as needed"""
+    for attempt in range(retries + 1):
+        conn = get_pool().getconn()
+        if _is_healthy(conn):
+            return conn
+        print(f"Discarding stale DB connection (attempt {attempt + 1})")
+        _discard(conn)
+    raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for one unit of work
+
+    Commits when the block exits normally, rolls back on error and always
+    hands the connection back to the pool. Broken connections are closed
+    instead of being returned.
+
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+    """
+    conn = _checkout()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            if not conn.closed:
+                conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            pass
+        raise
+    finally:
+        if conn.closed:
+            _discard(conn)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+            get_pool().putconn(conn)
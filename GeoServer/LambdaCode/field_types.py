@@ -0,0 +1,67 @@
+"""Field data types a layer schema may declare.
+
+One table for every module that looks at fields.data_type: validators (value
+checks), layer_provisioning (which types a layer may use), layer_sql
+(expression indexes) and getTiles (numeric attributes). refresh_layer_rollups
+in init.sql lists NUMERIC_TYPES again, keep the two in sync.
+"""
+
+# Canonical type -> (Python type of a valid value, expression indexable, numeric)
+# Indexable: the cast from text is IMMUTABLE, so (attributes->>'f')::type can back an
+# expression index. timestamp/date casts depend on DateStyle/TimeZone and are rejected by CREATE INDEX.
+SCALAR_TYPES = {
+    'smallint': (int, True, True),
+    'integer': (int, True, True),
+    'bigint': (int, True, True),
+    'numeric': (float, True, True),
+    'real': (float, True, True),
+    'double precision': (float, True, True),
+    'text': (str, True, False),
+    'varchar': (str, True, False),
+    'boolean': (bool, True, False),
+    'timestamp': (str, False, False),
+    'date': (str, False, False),
+}
+
+# Other names PostgreSQL accepts for the same types
+TYPE_ALIASES = {
+    'int2': 'smallint',
+    'int': 'integer',
+    'int4': 'integer',
+    'int8': 'bigint',
+    'decimal': 'numeric',
+    'float4': 'real',
+    'float8': 'double precision',
+    'character varying': 'varchar',
+    'bool': 'boolean',
+}
+
+# Scalar names, canonical and aliases, each also valid as an array: 'name[]'
+# or the udt name of its array type ('_int4', '_float8', ...)
+_SCALAR_NAMES = {name: name for name in SCALAR_TYPES}
+_SCALAR_NAMES.update(TYPE_ALIASES)
+_UDT_NAMES = {
+    'smallint': 'int2', 'integer': 'int4', 'bigint': 'int8', 'numeric': 'numeric',
+    'real': 'float4', 'double precision': 'float8', 'text': 'text', 'varchar': 'varchar',
+    'boolean': 'bool', 'timestamp': 'timestamp', 'date': 'date',
+}
+
+# data_type (lower case) -> Python type of a valid value, list for arrays
+DATA_TYPE_MAP = {name: SCALAR_TYPES[canonical][0] for name, canonical in _SCALAR_NAMES.items()}
+# Array data_type -> Python type of its elements
+ARRAY_ELEMENT_TYPE_MAP = {f"{name}[]": SCALAR_TYPES[canonical][0] for name, canonical in _SCALAR_NAMES.items()}
+ARRAY_ELEMENT_TYPE_MAP.update({f"_{udt}": SCALAR_TYPES[canonical][0] for canonical, udt in _UDT_NAMES.items()})
+DATA_TYPE_MAP.update({name: list for name in ARRAY_ELEMENT_TYPE_MAP})
+
+INDEXABLE_TYPES = frozenset(name for name, canonical in _SCALAR_NAMES.items() if SCALAR_TYPES[canonical][1])
+NUMERIC_TYPES = frozenset(name for name, canonical in _SCALAR_NAMES.items() if SCALAR_TYPES[canonical][2])
+
+
+def canonical_type(data_type):
+    """Canonical scalar type of a data_type, element type for arrays, None when unknown"""
+    data_type = data_type.lower()
+    if data_type.endswith('[]'):
+        data_type = data_type[:-2]
+    elif data_type.startswith('_'):
+        return next((canonical for canonical, udt in _UDT_NAMES.items() if f"_{udt}" == data_type), None)
+    return _SCALAR_NAMES.get(data_type)
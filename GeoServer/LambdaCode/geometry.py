@@ -0,0 +1,213 @@
+"""Geometry encoders: GML 3 (posList), WKT and (E)WKB.
+
+Coordinates are GeoJSON-style nesting (point -> [x, y], line -> [[x, y], ...],
+polygon -> [exterior, hole, ...], MULTI* -> list of members). Any point
+sequence may also be an (N, 2) NumPy array or a flat x,y,x,y buffer
+(array('d'), memoryview, 1-D ndarray). Each point sequence is packed once into
+a flat float64 buffer, so every encoder is linear in the vertex count.
+"""
+import struct
+import sys
+from array import array
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the array module covers the same path
+    np = None
+
+# OGC WKB geometry type codes, plus the PostGIS EWKB flag for an embedded SRID
+WKB_TYPE_CODES = {
+    'POINT': 1,
+    'LINESTRING': 2,
+    'POLYGON': 3,
+    'MULTIPOINT': 4,
+    'MULTILINESTRING': 5,
+    'MULTIPOLYGON': 6,
+}
+EWKB_SRID_FLAG = 0x20000000
+
+_FLAT_BUFFERS = (array, memoryview, bytes, bytearray)
+
+
+def flat_xy(points, close=False):
+    """Pack a point sequence into a flat little-endian float64 buffer of x,y pairs
+
+    Returns a 1-D ndarray when numpy is available, otherwise array('d').
+    Extra dimensions (z, m) are dropped. close=True appends the first point
+    when a ring is not closed.
+    """
+    if np is not None:
+        if isinstance(points, _FLAT_BUFFERS):
+            flat = np.frombuffer(points, dtype='<f8') if not isinstance(points, array) else np.asarray(points, dtype='<f8')
+            xy = flat.reshape(-1, 2)
+        else:
+            xy = np.asarray(points, dtype='<f8')
+            if xy.ndim == 1:
+                xy = xy.reshape(-1, 2)
+            elif xy.ndim != 2 or xy.shape[1] < 2:
+                raise ValueError("Coordinates must be [x, y] pairs")
+            xy = xy[:, :2]
+        if close and len(xy) and (xy[0] != xy[-1]).any():
+            xy = np.vstack([xy, xy[:1]])
+        return np.ascontiguousarray(xy).reshape(-1)
+
+    if isinstance(points, _FLAT_BUFFERS):
+        flat = array('d', points if isinstance(points, array) else bytes(points))
+        if sys.byteorder == 'big' and not isinstance(points, array):
+            flat.byteswap()
+    else:
+        try:
+            points = list(points)
+            if set(map(len, points)) <= {2}:
+                flat = array('d', chain.from_iterable(points))
+            else:
+                # 3D/4D or ragged points, keep x and y of each
+                flat = array('d', chain.from_iterable((p[0], p[1]) for p in points))
+        except (IndexError, TypeError):
+            raise ValueError("Coordinates must be [x, y] pairs")
+    if len(flat) % 2:
+        raise ValueError("Flat coordinate buffers need an even number of values")
+    if close and len(flat) and (flat[0] != flat[-2] or flat[1] != flat[-1]):
+        flat.extend(flat[:2])
+    return flat
+
+
+def _little_endian_bytes(flat):
+    if np is not None:
+        return flat.astype('<f8', copy=False).tobytes()
+    if sys.byteorder == 'big':
+        flat = array('d', flat)
+        flat.byteswap()
+    return flat.tobytes()
+
+
+def _values(flat):
+    return flat.tolist()
+
+
+def _pos_list(flat):
+    """'x1 y1 x2 y2 ...' in one join"""
+    return " ".join(map(repr, _values(flat)))
+
+
+def _wkt_points(flat):
+    """'x1 y1, x2 y2, ...'"""
+    values = _values(flat)
+    return ", ".join(f"{x!r} {y!r}" for x, y in zip(values[0::2], values[1::2]))
+
+
+def _rings(polygon):
+    if not len(polygon):
+        raise ValueError("Polygon needs an exterior ring")
+    return [flat_xy(ring, close=True) for ring in polygon]
+
+
+# ---- GML 3 -----------------------------------------------------------------
+
+def _gml_ring(tag, flat):
+    return f"<gml:{tag}><gml:LinearRing><gml:posList>{_pos_list(flat)}</gml:posList></gml:LinearRing></gml:{tag}>"
+
+
+def _gml_polygon(polygon, srs=""):
+    rings = _rings(polygon)
+    parts = [f"<gml:Polygon{srs}>", _gml_ring("exterior", rings[0])]
+    parts.extend(_gml_ring("interior", ring) for ring in rings[1:])
+    parts.append("</gml:Polygon>")
+    return "".join(parts)
+
+
+def _gml_line(line, srs=""):
+    return f"<gml:LineString{srs}><gml:posList>{_pos_list(flat_xy(line))}</gml:posList></gml:LineString>"
+
+
+def _gml_point(point, srs=""):
+    return f"<gml:Point{srs}><gml:pos>{_pos_list(flat_xy([point]))}</gml:pos></gml:Point>"
+
+
+def to_gml(geom_type, coords, srid):
+    """GML 3.1.1 geometry element, holes become <gml:interior> rings"""
+    geom_type = geom_type.upper()
+    srs = f' srsName="EPSG:{srid}"'
+    if geom_type == 'POINT':
+        return _gml_point(coords, srs)
+    if geom_type == 'LINESTRING':
+        return _gml_line(coords, srs)
+    if geom_type == 'POLYGON':
+        return _gml_polygon(coords, srs)
+    if geom_type == 'MULTIPOINT':
+        members = "".join(f"<gml:pointMember>{_gml_point(p)}</gml:pointMember>" for p in coords)
+        return f"<gml:MultiPoint{srs}>{members}</gml:MultiPoint>"
+    if geom_type == 'MULTILINESTRING':
+        members = "".join(f"<gml:lineStringMember>{_gml_line(line)}</gml:lineStringMember>" for line in coords)
+        return f"<gml:MultiLineString{srs}>{members}</gml:MultiLineString>"
+    if geom_type == 'MULTIPOLYGON':
+        members = "".join(f"<gml:polygonMember>{_gml_polygon(p)}</gml:polygonMember>" for p in coords)
+        return f"<gml:MultiPolygon{srs}>{members}</gml:MultiPolygon>"
+    raise ValueError(f"Unsupported geometry type: {geom_type}")
+
+
+# ---- WKT -------------------------------------------------------------------
+
+def _wkt_body(geom_type, coords):
+    if geom_type == 'POINT':
+        return f"({_wkt_points(flat_xy([coords]))})"
+    if geom_type == 'LINESTRING':
+        return f"({_wkt_points(flat_xy(coords))})"
+    if geom_type == 'POLYGON':
+        return "(" + ", ".join(f"({_wkt_points(ring)})" for ring in _rings(coords)) + ")"
+    member_type = geom_type[len('MULTI'):]
+    return "(" + ", ".join(_wkt_body(member_type, member) for member in coords) + ")"
+
+
+def to_wkt(geom_type, coords):
+    geom_type = geom_type.upper()
+    if geom_type not in WKB_TYPE_CODES:
+        raise ValueError(f"Unsupported geometry type: {geom_type}")
+    return f"{geom_type} {_wkt_body(geom_type, coords)}"
+
+
+# ---- WKB -------------------------------------------------------------------
+
+def _wkb_points(parts, flat):
+    parts.append(struct.pack('<I', len(flat) // 2))
+    parts.append(_little_endian_bytes(flat))
+
+
+def _wkb_geometry(parts, geom_type, coords, srid=None):
+    type_code = WKB_TYPE_CODES[geom_type]
+    if srid is not None:
+        parts.append(struct.pack('<BII', 1, type_code | EWKB_SRID_FLAG, int(srid)))
+    else:
+        parts.append(struct.pack('<BI', 1, type_code))
+
+    if geom_type == 'POINT':
+        parts.append(_little_endian_bytes(flat_xy([coords])))
+    elif geom_type == 'LINESTRING':
+        _wkb_points(parts, flat_xy(coords))
+    elif geom_type == 'POLYGON':
+        rings = _rings(coords)
+        parts.append(struct.pack('<I', len(rings)))
+        for ring in rings:
+            _wkb_points(parts, ring)
+    else:
+        # MULTI* members are plain WKB geometries of the single type
+        member_type = geom_type[len('MULTI'):]
+        parts.append(struct.pack('<I', len(coords)))
+        for member in coords:
+            _wkb_geometry(parts, member_type, member)
+
+
+def to_wkb(geom_type, coords, srid=None):
+    """Little-endian WKB, or PostGIS EWKB when srid is given"""
+    geom_type = geom_type.upper()
+    if geom_type not in WKB_TYPE_CODES:
+        raise ValueError(f"Unsupported geometry type: {geom_type}")
+    parts = []
+    _wkb_geometry(parts, geom_type, coords, srid)
+    return b"".join(parts)
+
+
+def to_ewkb_hex(geom_type, coords, srid):
+    """Hex EWKB with SRID, the text form COPY accepts for a geometry column"""
+    return to_wkb(geom_type, coords, srid).hex()
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# GeoServer connection (GEOSERVER_PASS with GEOSERVER_PASSWORD fallback)
+GEOSERVER_URL = os.environ.get('GEOSERVER_URL')
+GEOSERVER_USER = os.environ.get('GEOSERVER_USER')
+GEOSERVER_PASS = os.environ.get('GEOSERVER_PASS') or os.environ.get('GEOSERVER_PASSWORD')
+
+GEOSERVER_CONNECT_TIMEOUT = float(os.environ.get('GEOSERVER_CONNECT_TIMEOUT', 5))
+GEOSERVER_READ_TIMEOUT = float(os.environ.get('GEOSERVER_READ_TIMEOUT', 30))
+GEOSERVER_RETRIES = int(os.environ.get('GEOSERVER_RETRIES', 3))
+GEOSERVER_BACKOFF = float(os.environ.get('GEOSERVER_BACKOFF', 0.5))
+GEOSERVER_POOL_SIZE = int(os.environ.get('GEOSERVER_POOL_SIZE', 10))
+
+# Only gateway errors are retried: GeoServer did not process the request
+RETRY_STATUS_CODES = (502, 503)
+
+# Latency samples kept per operation for percentile reporting
+METRICS_WINDOW = 500
+
+# One geoserver_call JSON line per request, off by default (latency_stats() reports the same per container)
+GEOSERVER_CALL_METRICS = os.environ.get('GEOSERVER_CALL_METRICS', 'false').lower() == 'true'
+
+# Module level so keep-alive connections survive across warm Lambda invocations
+_session = None
+_session_lock = threading.Lock()
+_metrics = {}
+
+
+def get_session():
+    """Create the pooled, authenticated session on first use and return it"""
+    global _session
+    if _session is None:
+        # Handlers publish from worker threads, build the session only once
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=GEOSERVER_RETRIES,
+                    connect=GEOSERVER_RETRIES,
+                    read=0,
+                    status_forcelist=RETRY_STATUS_CODES,
+                    allowed_methods=None,  # retry POST/PUT too, 502/503 means nothing was applied
+                    backoff_factor=GEOSERVER_BACKOFF,
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(
+                    max_retries=retry,
+                    pool_connections=GEOSERVER_POOL_SIZE,
+                    pool_maxsize=GEOSERVER_POOL_SIZE
+                )
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                if GEOSERVER_USER:
+                    session.auth = (GEOSERVER_USER, GEOSERVER_PASS)
+                _session = session
+    return _session
+
+
+def _record(op, status, elapsed_ms):
+    stats = _metrics.get(op)
+    if stats is None:
+        stats = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0,
+                 "samples": deque(maxlen=METRICS_WINDOW)}
+        _metrics[op] = stats
+    stats["count"] += 1
+    stats["total_ms"] += elapsed_ms
+    stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+    stats["samples"].append(elapsed_ms)
+    if status is None or status >= 400:
+        stats["errors"] += 1
+
+    # One structured line per call, easy to turn into a CloudWatch metric filter
+    if GEOSERVER_CALL_METRICS:
+        print(json.dumps({"metric": "geoserver_call", "op": op, "status": status,
+                          "latency_ms": round(elapsed_ms, 1)}))
+
+
+def request(method, path, op=None, timeout=None, **kwargs):
+    """Send a request to GeoServer through the shared session
+
+    path is relative to GEOSERVER_URL (absolute URLs are used as-is). The
+    elapsed time is recorded under op (default "METHOD path") and attached
+    to the response as response.latency_ms.
+    """
+    url = path if path.startswith("http") else f"{GEOSERVER_URL}{path}"
+    op = op or f"{method.upper()} {path.split('?')[0]}"
+    if timeout is None:
+        timeout = (GEOSERVER_CONNECT_TIMEOUT, GEOSERVER_READ_TIMEOUT)
+
+    status = None
+    start = time.perf_counter()
+    try:
+        response = get_session().request(method, url, timeout=timeout, **kwargs)
+        status = response.status_code
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _record(op, status, elapsed_ms)
+
+    response.latency_ms = elapsed_ms
+    return response
+
+
+def get(path, **kwargs):
+    return request("GET", path, **kwargs)
+
+
+def post(path, **kwargs):
+    return request("POST", path, **kwargs)
+
+
+def latency_stats():
+    """Per-operation call counts, errors and latency percentiles for this container"""
+    report = {}
+    for op, stats in _metrics.items():
+        samples = sorted(stats["samples"])
+        report[op] = {
+            "count": stats["count"],
+            "errors": stats["errors"],
+            "mean_ms": round(stats["total_ms"] / stats["count"], 1),
+            "p50_ms": round(samples[len(samples) // 2], 1),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1),
+            "max_ms": round(stats["max_ms"], 1),
+        }
+    return report
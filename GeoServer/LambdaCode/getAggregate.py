@@ -0,0 +1,224 @@
+import json
+import math
+import os
+from datetime import datetime, timezone
+
+import db
+import metadata_cache
+import response_cache
+import responses
+
+# Cell sizes refresh_layer_rollups builds (SQL default 0.001, 0.01, 0.1), no other size has rows
+CELL_SIZES = [float(v) for v in os.environ.get('ROLLUP_CELL_SIZES', '0.001,0.01,0.1').split(',')]
+# Smallest size refresh_layer_rollups accepts, smaller cells could overflow the BIGINT cell index
+MIN_CELL_SIZE = 1e-9
+if min(CELL_SIZES) < MIN_CELL_SIZE:
+    raise ValueError(f"ROLLUP_CELL_SIZES must all be at least {MIN_CELL_SIZE}")
+DEFAULT_CELL_SIZE = float(os.environ.get('ROLLUP_DEFAULT_CELL_SIZE', 0.01))
+MAX_AGGREGATE_ROWS = int(os.environ.get('MAX_AGGREGATE_ROWS', 50000))
+# Dirty days a request may recompute before reading (0 serves rollups as they are), refreshRollups does the rest
+ROLLUP_REFRESH_DAYS = int(os.environ.get('ROLLUP_REFRESH_DAYS', 3))
+RESOLUTIONS = ['hour', 'day']
+FORMATS = ['json', 'geojson']
+
+
+def parse_time(value, name):
+    """ISO 8601 timestamp -> naive UTC datetime (measurements.timestamp has no zone)"""
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 timestamp")
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def parse_query(query_params):
+    """Validate resolution, cell_size, time window, bbox, fields and format"""
+    query = {
+        "resolution": query_params.get("resolution", "day"),
+        "cell_size": DEFAULT_CELL_SIZE,
+        "start": None,
+        "end": None,
+        "bbox": None,
+        "fields": None,
+        "format": query_params.get("format", "json"),
+    }
+    if query["resolution"] not in RESOLUTIONS:
+        raise ValueError(f"resolution must be one of {RESOLUTIONS}")
+    if query["format"] not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+
+    if query_params.get("cell_size"):
+        try:
+            query["cell_size"] = float(query_params["cell_size"])
+        except ValueError:
+            raise ValueError("cell_size must be a number")
+        if query["cell_size"] <= 0:
+            raise ValueError("cell_size must be greater than 0")
+        if query["cell_size"] not in CELL_SIZES:
+            raise ValueError(f"cell_size must be one of {CELL_SIZES}")
+
+    if query_params.get("start"):
+        query["start"] = parse_time(query_params["start"], "start")
+    if query_params.get("end"):
+        query["end"] = parse_time(query_params["end"], "end")
+
+    if query_params.get("bbox"):
+        try:
+            bbox = [float(v) for v in query_params["bbox"].split(",")]
+        except ValueError:
+            bbox = []
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be minx,miny,maxx,maxy")
+        query["bbox"] = bbox
+
+    if query_params.get("fields"):
+        query["fields"] = [f.strip() for f in query_params["fields"].split(",") if f.strip()]
+
+    return query
+
+
+def build_aggregate_query(layer_id, query):
+    """SQL + params reading rollup rows, bbox is matched on cell coordinates"""
+    size = query["cell_size"]
+    sql = """
+        SELECT bucket_start, cell_x, cell_y, count, stats
+        FROM measurement_rollups
+        WHERE layer_id = %s AND resolution = %s AND cell_size = %s
+    """
+    params = [layer_id, query["resolution"], size]
+    if query["start"]:
+        sql += " AND bucket_start >= %s"
+        params.append(query["start"])
+    if query["end"]:
+        sql += " AND bucket_start < %s"
+        params.append(query["end"])
+    if query["bbox"]:
+        minx, miny, maxx, maxy = query["bbox"]
+        sql += " AND cell_x BETWEEN %s AND %s AND cell_y BETWEEN %s AND %s"
+        params += [math.floor(minx / size), math.floor(maxx / size),
+                   math.floor(miny / size), math.floor(maxy / size)]
+    sql += " ORDER BY bucket_start, cell_x, cell_y LIMIT %s"
+    params.append(MAX_AGGREGATE_ROWS + 1)
+    return sql, params
+
+
+def to_cell(row, query):
+    bucket_start, cell_x, cell_y, count, stats = row
+    size = query["cell_size"]
+    if query["fields"]:
+        stats = {name: value for name, value in stats.items() if name in query["fields"]}
+    return {
+        "bucket_start": bucket_start.isoformat(),
+        "cell": [cell_x, cell_y],
+        "bounds": [round(v, 10) for v in (cell_x * size, cell_y * size, (cell_x + 1) * size, (cell_y + 1) * size)],
+        "count": count,
+        "stats": stats,
+    }
+
+
+def to_feature(cell):
+    """Grid cell as a GeoJSON polygon, stats flattened to field_stat properties"""
+    minx, miny, maxx, maxy = cell["bounds"]
+    properties = {"bucket_start": cell["bucket_start"], "count": cell["count"]}
+    for field_name, field_stats in cell["stats"].items():
+        for stat, value in field_stats.items():
+            properties[f"{field_name}_{stat}"] = value
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]]
+        },
+        "properties": properties,
+    }
+
+
+def lambda_handler(event, context):
+    """
+    GET /layers/{layer_id}/aggregate
+
+    Query parameters (all optional):
+        resolution=hour|day             time bucket (default day)
+        cell_size                       grid size in layer CRS units, one of ROLLUP_CELL_SIZES
+                                        (default ROLLUP_DEFAULT_CELL_SIZE)
+        start, end                      ISO 8601 window on bucket_start
+        bbox=minx,miny,maxx,maxy        in the layer CRS
+        fields=a,b                      numeric fields whose stats are returned
+        format=json|geojson             geojson returns the cells as polygons
+    """
+    try:
+        path_params = event.get("pathParameters") or {}
+        query_params = event.get("queryStringParameters") or {}
+        layer_id = path_params.get("layer_id")
+
+        if not layer_id:
+            return {"statusCode": 400, "body": "Missing layer_id"}
+
+        layer_meta = metadata_cache.get_layer(layer_id)
+        if not layer_meta:
+            return {"statusCode": 404, "body": f"Layer {layer_id} not found"}
+
+        try:
+            query = parse_query(query_params)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        # Rollups only change when data_version does, so the response cache applies as is
+        cache_key = response_cache.make_key(
+            "aggregate", layer_id, query,
+            response_cache.layer_version(layer_id), responses.negotiate_encoding(event)
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        sql, params = build_aggregate_query(layer_id, query)
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                # The most recent days touched since the last refresh are recomputed before reading
+                cur.execute("SELECT refresh_dirty_rollups(%s, %s);", (layer_id, ROLLUP_REFRESH_DAYS))
+                refreshed = cur.fetchone()[0]
+                if refreshed:
+                    print(f"Refreshed {refreshed} dirty rollup day(s) of layer {layer_id}")
+                cur.execute("SELECT count(*) FROM rollup_dirty WHERE layer_id = %s;", (layer_id,))
+                pending = cur.fetchone()[0]
+                cur.execute(sql, params)
+                rows = cur.fetchall()
+
+        truncated = len(rows) > MAX_AGGREGATE_ROWS
+        cells = [to_cell(row, query) for row in rows[:MAX_AGGREGATE_ROWS]]
+
+        if query["format"] == "geojson":
+            body = {
+                "type": "FeatureCollection",
+                "features": [to_feature(cell) for cell in cells],
+                "truncated": truncated,
+                "pending_days": pending,
+            }
+            content_type = "application/geo+json"
+        else:
+            body = {
+                "layer_id": int(layer_id),
+                "resolution": query["resolution"],
+                "cell_size": query["cell_size"],
+                "srid": layer_meta["srid"],
+                "count": len(cells),
+                "truncated": truncated,
+                "pending_days": pending,
+                "cells": cells,
+            }
+            content_type = "application/json"
+
+        result = responses.build_response(event, [json.dumps(body)], content_type=content_type)
+        # Refreshing pending days does not bump data_version, a cached copy would outlive them
+        if pending:
+            return result
+        return response_cache.put(cache_key, result)
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
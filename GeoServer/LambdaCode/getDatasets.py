@@ -1,13 +1,7 @@
-import os
 import json
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
-RDS_HOST = os.environ['RDS_HOST']
-RDS_PORT = int(os.environ.get('RDS_PORT', 5432))
-RDS_DB = os.environ['RDS_DB']
-RDS_USER = os.environ['RDS_USER']
-RDS_PASS = os.environ['RDS_PASS']
+import db
 
 def lambda_handler(event, context):
     try:
@@ -17,15 +11,6 @@ def lambda_handler(event, context):
         user_id = query_params.get('user_id', None)
         dataset_id = path_params.get('dataset_id', None)
 
-        conn = psycopg2.connect(
-            host=RDS_HOST,
-            port=RDS_PORT,
-            database=RDS_DB,
-            user=RDS_USER,
-            password=RDS_PASS
-        )
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
         sql = """
             SELECT d.dataset_id, d.name, d.description, 
                    u.username AS owner, d.source, d.created_at 
@@ -42,11 +27,10 @@ def lambda_handler(event, context):
             sql += " AND d.dataset_id = %s"
             params.append(dataset_id)
 
-        cursor.execute(sql, tuple(params))
-        dataset_rows = cursor.fetchall()
-
-        cursor.close()
-        conn.close()
+        with db.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(sql, tuple(params))
+                dataset_rows = cursor.fetchall()
 
         return {
             "statusCode": 200,
@@ -1,18 +1,350 @@
-import os
+import base64
+import hashlib
 import json
-import psycopg2
-import requests
+import os
+import re
+from datetime import datetime, timezone
+
+import db
+import geoserver
+import metadata_cache
+import response_cache
+import responses
+from layer_sql import generate_field_sql
+
+MAX_PAGE_SIZE = 10000
+
+# "geoserver" (WFS GetFeature) or "postgis" (GeoJSON encoded in the database)
+READ_ENGINE = os.environ.get("READ_ENGINE", "geoserver")
+READ_ENGINES = ["geoserver", "postgis"]
+JSON_FORMATS = ["application/json", "json", "application/geo+json"]
+
+# Rows fetched per round trip from the server-side cursor
+POSTGIS_FETCH_SIZE = int(os.environ.get("POSTGIS_FETCH_SIZE", 2000))
+
+# Columns every {layer}_view exposes besides the layer fields
+VIEW_COLUMNS = ["id", "geom", "timestamp"]
+
+NUMBER_RETURNED = re.compile(rb'numberReturned["\s]*[:=]\s*"?(\d+)')
+NUMBER_MATCHED = re.compile(rb'numberMatched["\s]*[:=]\s*"?(\d+)')
+
+
+def parse_bbox(value):
+    """'minx,miny,maxx,maxy' in the layer CRS -> tuple of 4 floats"""
+    try:
+        parts = [float(v) for v in value.split(",")]
+    except ValueError:
+        parts = []
+    if len(parts) != 4:
+        raise ValueError("bbox must be minx,miny,maxx,maxy")
+    minx, miny, maxx, maxy = parts
+    if minx > maxx or miny > maxy:
+        raise ValueError("bbox min values must not exceed max values")
+    return minx, miny, maxx, maxy
+
+
+def parse_time(value, name):
+    """ISO 8601 timestamp -> ECQL literal (UTC, 'Z' suffix)"""
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 timestamp")
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_query(query_params, layer_meta):
+    """Validate paging, bbox, time window, projection and sort parameters
+
+    Raises ValueError with a client-facing message on bad input.
+    """
+    columns = VIEW_COLUMNS + list(layer_meta["fields"])
+
+    query = {
+        "cql_filter": query_params.get("CQL_FILTER"),
+        "output_format": query_params.get("outputFormat", "application/json"),
+        "limit": None,
+        "offset": 0,
+        "bbox": None,
+        "start": None,
+        "end": None,
+        "properties": None,
+        "sort": [],
+    }
+
+    if query_params.get("limit"):
+        try:
+            query["limit"] = int(query_params["limit"])
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if not 1 <= query["limit"] <= MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    if query_params.get("bbox"):
+        query["bbox"] = parse_bbox(query_params["bbox"])
+
+    if query_params.get("start"):
+        query["start"] = parse_time(query_params["start"], "start")
+    if query_params.get("end"):
+        query["end"] = parse_time(query_params["end"], "end")
+
+    if query_params.get("properties"):
+        properties = [p.strip() for p in query_params["properties"].split(",") if p.strip()]
+        unknown = [p for p in properties if p not in columns]
+        if unknown:
+            raise ValueError(f"Unknown properties: {', '.join(unknown)}")
+        # Geometry is always returned so the features can be drawn
+        if "geom" not in properties:
+            properties.append("geom")
+        query["properties"] = properties
+
+    if query_params.get("sort"):
+        for item in query_params["sort"].split(","):
+            name, _, direction = item.strip().partition(":")
+            direction = (direction or "asc").upper()
+            if name not in columns or direction not in ("ASC", "DESC"):
+                raise ValueError("sort must look like field[:asc|desc],...")
+            query["sort"].append((name, direction))
+
+    # Paging needs a total order; measure_id only grows, so earlier pages stay put
+    if query["limit"] is not None and "id" not in [name for name, _ in query["sort"]]:
+        query["sort"].append(("id", "ASC"))
+
+    if query_params.get("cursor"):
+        if query["limit"] is None:
+            raise ValueError("cursor requires limit")
+        query["offset"] = decode_cursor(query_params["cursor"], query)
+
+    return query
+
+
+def query_fingerprint(query):
+    """Short hash of everything that selects rows, so cursors can't cross queries"""
+    key = json.dumps([query["cql_filter"], query["bbox"], query["start"], query["end"], query["sort"]])
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def encode_cursor(query, offset):
+    raw = json.dumps({"offset": offset, "q": query_fingerprint(query)}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor, query):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        offset = int(data["offset"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("cursor is not valid")
+    if data.get("q") != query_fingerprint(query) or offset < 0:
+        raise ValueError("cursor does not belong to this query")
+    return offset
+
 
-RDS_HOST = os.environ.get("RDS_HOST")
-RDS_PORT = os.environ.get("RDS_PORT", 5432)
-RDS_DB = os.environ.get("RDS_DB")
-RDS_USER = os.environ.get("RDS_USER")
-RDS_PASS = os.environ.get("RDS_PASS")
+def build_cql(query):
+    """Combine the client CQL_FILTER with bbox and time window into one ECQL filter
+
+    BBOX is expressed in ECQL (layer CRS, x/y order) because GeoServer rejects
+    the bbox parameter together with CQL_FILTER and WFS 2.0 bbox axis order
+    depends on the CRS.
+    """
+    clauses = []
+    if query["cql_filter"]:
+        clauses.append(f"({query['cql_filter']})")
+    if query["bbox"]:
+        minx, miny, maxx, maxy = query["bbox"]
+        clauses.append(f"BBOX(geom, {minx}, {miny}, {maxx}, {maxy})")
+    if query["start"] and query["end"]:
+        clauses.append(f"timestamp DURING {query['start']}/{query['end']}")
+    elif query["start"]:
+        clauses.append(f"timestamp AFTER {query['start']}")
+    elif query["end"]:
+        clauses.append(f"timestamp BEFORE {query['end']}")
+    return " AND ".join(clauses) or None
+
+
+def build_wfs_params(query, workspace, layer):
+    """Translate a parsed query into WFS 2.0 GetFeature parameters"""
+    params = {
+        "service": "WFS",
+        "version": "2.0.0",
+        "request": "GetFeature",
+        "typeNames": f"{workspace}:{layer}_view",
+        "outputFormat": query["output_format"],
+    }
+    if query["limit"] is not None:
+        params["count"] = query["limit"]
+        params["startIndex"] = query["offset"]
+    if query["properties"]:
+        params["propertyName"] = ",".join(query["properties"])
+    if query["sort"]:
+        params["sortBy"] = ",".join(f"{name} {direction}" for name, direction in query["sort"])
+    cql = build_cql(query)
+    if cql:
+        params["CQL_FILTER"] = cql
+    return params
+
+
+class PageSniffer:
+    """Pass chunks through while keeping the head and tail for numberReturned/numberMatched"""
+
+    EDGE_BYTES = 4096
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.head = b""
+        self.tail = b""
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if len(self.head) < self.EDGE_BYTES:
+                self.head += chunk[:self.EDGE_BYTES - len(self.head)]
+            self.tail = (self.tail + chunk)[-self.EDGE_BYTES:]
+            yield chunk
+
+    def find(self, pattern):
+        match = pattern.search(self.head) or pattern.search(self.tail)
+        return int(match.group(1)) if match else None
+
+
+def next_cursor(query, sniffer):
+    """Cursor for the following page, or None when this page was the last"""
+    if query["limit"] is None:
+        return None
+    returned = sniffer.find(NUMBER_RETURNED)
+    matched = sniffer.find(NUMBER_MATCHED)
+    if returned is None:
+        returned = query["limit"]
+    if matched is not None:
+        has_more = query["offset"] + returned < matched
+    else:
+        has_more = returned >= query["limit"]
+    return encode_cursor(query, query["offset"] + returned) if has_more else None
+
+
+def add_cursor_header(result, query, sniffer):
+    """Expose the next page cursor, if any, as X-Next-Cursor"""
+    cursor = next_cursor(query, sniffer)
+    if cursor:
+        result["headers"]["X-Next-Cursor"] = cursor
+        result["headers"]["Access-Control-Expose-Headers"] = "X-Next-Cursor"
+    return result
+
+
+def build_postgis_query(layer_id, layer_meta, query, view_name):
+    """SQL + params returning one GeoJSON Feature (text) per row
+
+    Columns are projected with the same generate_field_sql expressions as the
+    GeoServer {layer}_view, so both engines return the same properties.
+    """
+    fields = layer_meta["fields"]
+    sort_names = [name for name, _ in query["sort"]]
+    wanted = query["properties"] or (list(fields) + ["timestamp"])
+
+    columns = ["measure_id AS id"]
+    hidden = ["id", "geom"]
+    for name, data_type in fields.items():
+        if name in wanted or name in sort_names:
+            columns.append(generate_field_sql(name, data_type))
+            if name not in wanted:
+                hidden.append(name.lower())
+    columns.append("geom")
+    if "timestamp" in wanted or "timestamp" in sort_names:
+        columns.append("timestamp")
+        if "timestamp" not in wanted:
+            hidden.append("timestamp")
+
+    where = ["layer_id = %s"]
+    where_params = [layer_id]
+    if query["bbox"]:
+        where.append("geom && ST_MakeEnvelope(%s, %s, %s, %s, %s)")
+        where_params.extend(list(query["bbox"]) + [layer_meta["srid"]])
+    if query["start"]:
+        where.append("timestamp > %s")
+        where_params.append(query["start"])
+    if query["end"]:
+        where.append("timestamp < %s")
+        where_params.append(query["end"])
+
+    inner_order = outer_order = ""
+    if query["sort"]:
+        inner_order = "ORDER BY " + ", ".join(f"{name} {direction}" for name, direction in query["sort"])
+        outer_order = "ORDER BY " + ", ".join(f"p.{name} {direction}" for name, direction in query["sort"])
+
+    page = ""
+    page_params = []
+    if query["limit"] is not None:
+        page = "LIMIT %s OFFSET %s"
+        page_params = [query["limit"], query["offset"]]
+
+    column_sql = ",\n                   ".join(columns)
+    sql = f"""
+        SELECT json_build_object(
+                   'type', 'Feature',
+                   'id', %s || '.' || p.id,
+                   'geometry', ST_AsGeoJSON(p.geom)::json,
+                   'geometry_name', 'geom',
+                   'properties', to_jsonb(p) - %s::text[]
+               )::text
+        FROM (
+            SELECT {column_sql}
+            FROM measurements
+            WHERE {" AND ".join(where)}
+            {inner_order}
+            {page}
+        ) p
+        {outer_order}
+    """
+    return sql, [view_name, hidden] + where_params + page_params
+
+
+def postgis_features(layer_id, layer_meta, query, view_name):
+    """Yield a GeoJSON FeatureCollection built by PostGIS, fetched in batches"""
+    sql, params = build_postgis_query(layer_id, layer_meta, query, view_name)
+    with db.connection() as conn:
+        with conn.cursor(name="get_features") as cur:
+            cur.itersize = POSTGIS_FETCH_SIZE
+            cur.execute(sql, params)
+
+            yield b'{"type":"FeatureCollection","features":['
+            returned = 0
+            while True:
+                rows = cur.fetchmany(POSTGIS_FETCH_SIZE)
+                if not rows:
+                    break
+                chunk = ",".join(row[0] for row in rows)
+                yield ((b"," if returned else b"") + chunk.encode("utf-8"))
+                returned += len(rows)
+            yield f'],"numberReturned":{returned}}}'.encode("utf-8")
+
+
+def choose_engine(query_params, query):
+    """Requested read engine, falling back to GeoServer when PostGIS can't serve the query"""
+    engine = (query_params.get("engine") or READ_ENGINE).lower()
+    if engine not in READ_ENGINES:
+        raise ValueError(f"engine must be one of {READ_ENGINES}")
+    if engine == "postgis":
+        if query["cql_filter"]:
+            print("CQL_FILTER given, reading through GeoServer")
+            return "geoserver"
+        if query["output_format"].lower() not in JSON_FORMATS:
+            print(f"outputFormat {query['output_format']} given, reading through GeoServer")
+            return "geoserver"
+    return engine
 
-GEOSERVER_URL = os.environ.get("GEOSERVER_URL")
 
 # === MAIN HANDLER ===
 def lambda_handler(event, context):
+    """
+    Query parameters (all optional):
+        CQL_FILTER, outputFormat        passed through to GeoServer
+        limit, cursor                   page size and the X-Next-Cursor of the previous page
+        bbox=minx,miny,maxx,maxy        in the layer CRS
+        start, end                      ISO 8601 time window on the measurement timestamp
+        properties=a,b                  property projection (geom is always included)
+        sort=field[:asc|desc],...       ordering, id is appended when paging
+        engine=geoserver|postgis        postgis skips GeoServer for JSON reads without CQL_FILTER
+    """
     try:
         # Extract path and query parameters
         path_params = event.get("pathParameters") or {}
@@ -20,56 +352,65 @@ def lambda_handler(event, context):
 
         dataset_id = path_params.get("dataset_id")
         layer_id = path_params.get("layer_id")
-        cql_filter = query_params.get("CQL_FILTER")
-        outputFormat = query_params.get("outputFormat", 'application/json')
 
         if not dataset_id or not layer_id:
             return {"statusCode": 400, "body": "Missing dataset_id or layer_id"}
 
-        # Connect to RDS 
-        with psycopg2.connect(
-            host=RDS_HOST, port=RDS_PORT, database=RDS_DB,
-            user=RDS_USER, password=RDS_PASS
-        ) as conn:
-            with conn.cursor() as cur:
-                # Get dataset name 
-                cur.execute("SELECT name FROM datasets WHERE dataset_id = %s;", (dataset_id,))
-                dataset_row = cur.fetchone()
-                if not dataset_row:
-                    return {"statusCode": 404, "body": f"Dataset {dataset_id} not found"}
-                dataset_name = dataset_row[0]
-
-                # Get layer name 
-                cur.execute("SELECT name FROM layers WHERE layer_id = %s;", (layer_id,))
-                layer_row = cur.fetchone()
-                if not layer_row:
-                    return {"statusCode": 404, "body": f"Layer {layer_id} not found"}
-                layer_name = layer_row[0]
-
-        # Normalize names 
+        # Dataset and layer names come from the metadata cache
+        dataset_name = metadata_cache.get_dataset_name(dataset_id)
+        if not dataset_name:
+            return {"statusCode": 404, "body": f"Dataset {dataset_id} not found"}
+
+        layer_meta = metadata_cache.get_layer(layer_id)
+        if not layer_meta:
+            return {"statusCode": 404, "body": f"Layer {layer_id} not found"}
+        layer_name = layer_meta["name"]
+
+        try:
+            query = parse_query(query_params, layer_meta)
+            engine = choose_engine(query_params, query)
+        except ValueError as e:
+            return {"statusCode": 400, "body": json.dumps({"error": str(e)})}
+
+        # Normalize names
         workspace = dataset_name.lower().replace(" ", "_")
         layer = layer_name.lower().replace(" ", "_")
 
-        # Construct GeoServer WFS URL 
-        wfs_url = (
-            f"{GEOSERVER_URL}/{workspace}/ows?service=WFS&version=1.0.0&request=GetFeature&typeName={workspace}:{layer}_view&outputFormat={outputFormat}")
-        print(f"Constructed WFS URL: {wfs_url}")
+        # Identical queries against an unchanged layer are served from the response cache
+        cache_key = response_cache.make_key(
+            "features", layer_id, [engine, query],
+            response_cache.layer_version(layer_id), responses.negotiate_encoding(event)
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        # Add CQL_FILTER if provided 
-        params = {}
-        if cql_filter:
-            params["CQL_FILTER"] = cql_filter
+        if engine == "postgis":
+            sniffer = PageSniffer(postgis_features(layer_id, layer_meta, query, f"{layer}_view"))
+            result = responses.build_response(event, sniffer, content_type="application/json")
+            return response_cache.put(cache_key, add_cursor_header(result, query, sniffer))
 
-        # Send request to GeoServer 
-        response = requests.get(wfs_url, params=params, timeout=10)
-        response.raise_for_status()  # raise error if not 2xx
+        # Construct GeoServer WFS request
+        wfs_url = f"/{workspace}/ows"
+        params = build_wfs_params(query, workspace, layer)
+        print(f"WFS request: {wfs_url} {params}")
 
-       
-        return {
-            "statusCode": 200,
-            "headers": {"Content-Type": "application/json"},
-            "body": response.text
-        }
+        # Send request to GeoServer, body is streamed and compressed chunk by chunk
+        response = geoserver.get(wfs_url, params=params, stream=True, op="WFS GetFeature")
+        try:
+            response.raise_for_status()  # raise error if not 2xx
+
+            sniffer = PageSniffer(response.iter_content(chunk_size=responses.STREAM_CHUNK_SIZE))
+            result = responses.build_response(
+                event,
+                sniffer,
+                content_type=response.headers.get("Content-Type", "application/json"),
+                headers={"Server-Timing": f"geoserver;dur={response.latency_ms:.1f}"}
+            )
+        finally:
+            response.close()
+
+        return response_cache.put(cache_key, add_cursor_header(result, query, sniffer))
 
     except Exception as e:
         return {
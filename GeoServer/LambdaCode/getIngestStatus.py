@@ -0,0 +1,39 @@
+import json
+import uuid
+
+import ingest_queue
+
+
+def lambda_handler(event, context):
+    """
+    GET /ingest/{ticket}
+
+    Progress of an async insertFeatures request (write_mode "async"):
+    status is queued, processing, done, partial or failed. The queue depth and
+    throttled flag tell clients whether to slow down.
+    """
+    try:
+        path_params = event.get("pathParameters") or {}
+        ticket = path_params.get("ticket")
+
+        try:
+            ticket = uuid.UUID(ticket or "")
+        except ValueError:
+            return {"statusCode": 400, "body": json.dumps({"error": "ticket must be a UUID"})}
+
+        status = ingest_queue.get_ticket(ticket)
+        if status is None:
+            return {"statusCode": 404, "body": json.dumps({"error": f"Ticket {ticket} not found"})}
+
+        status.update(ingest_queue.backpressure())
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps(status)
+        }
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
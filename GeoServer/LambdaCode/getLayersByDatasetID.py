@@ -1,60 +1,98 @@
-import os
+import base64
 import json
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
-# RDS config 
-RDS_HOST = os.environ['RDS_HOST']
-RDS_PORT = os.environ.get('RDS_PORT', 5432)
-RDS_DB = os.environ['RDS_DB']
-RDS_USER = os.environ['RDS_USER']
-RDS_PASS = os.environ['RDS_PASS']
+import db
+
+MAX_LIMIT = 1000
+
+# Fields aggregated per layer in the same round trip as the layers themselves
+SCHEMA_SQL = """
+    SELECT l.layer_id, l.name, l.geom_type, l.srid, l.description, l.created_at,
+           COALESCE(
+               json_agg(
+                   json_build_object(
+                       'field_name', f.field_name,
+                       'data_type', f.data_type,
+                       'unit', f.unit,
+                       'description', f.description,
+                       'indexed', f.indexed
+                   ) ORDER BY f.field_id
+               ) FILTER (WHERE f.field_id IS NOT NULL),
+               '[]'::json
+           ) AS schema
+    FROM layers l
+    LEFT JOIN fields f ON f.layer_id = l.layer_id
+    WHERE l.dataset_id = %s AND l.layer_id > %s
+    GROUP BY l.layer_id
+    ORDER BY l.layer_id
+    LIMIT %s
+"""
+
+NO_SCHEMA_SQL = """
+    SELECT layer_id, name, geom_type, srid, description, created_at
+    FROM layers
+    WHERE dataset_id = %s AND layer_id > %s
+    ORDER BY layer_id
+    LIMIT %s
+"""
+
+
+def encode_cursor(last_layer_id):
+    """Opaque keyset cursor pointing after the given layer_id"""
+    raw = json.dumps({"after": last_layer_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode())
+    return int(json.loads(raw)["after"])
+
 
 def lambda_handler(event, context):
     try:
         # รับ dataset_id จาก path param
-        dataset_id = event.get('pathParameters', {}).get('dataset_id')
+        dataset_id = (event.get('pathParameters') or {}).get('dataset_id')
         if not dataset_id:
             return {
                 "statusCode": 400,
                 "body": json.dumps({"error": "dataset_id path parameter is required"})
             }
 
-        # Connect to RDS Postgres 
-        conn = psycopg2.connect(
-            host=RDS_HOST,
-            port=RDS_PORT,
-            database=RDS_DB,
-            user=RDS_USER,
-            password=RDS_PASS
-        )
-
-        
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-        # Query layers 
-        cursor.execute("""
-            SELECT layer_id, name, geom_type, srid, description, created_at
-            FROM layers
-            WHERE dataset_id = %s
-            ORDER BY layer_id
-        """, (dataset_id,))
-        layers_rows = cursor.fetchall()
+        query_params = event.get('queryStringParameters') or {}
+        include_schema = str(query_params.get('include_schema', 'true')).lower() != 'false'
+        try:
+            limit = int(query_params['limit']) if 'limit' in query_params else None
+            after = decode_cursor(query_params['cursor']) if query_params.get('cursor') else 0
+        except (ValueError, KeyError, TypeError):
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": "limit must be an integer and cursor must come from next_cursor"})
+            }
+        if limit is not None and not 1 <= limit <= MAX_LIMIT:
+            return {
+                "statusCode": 400,
+                "body": json.dumps({"error": f"limit must be between 1 and {MAX_LIMIT}"})
+            }
 
-        layers = []
+        # Without limit all layers are returned (LIMIT NULL); otherwise fetch one extra row to detect a next page
+        sql_limit = limit + 1 if limit is not None else None
 
-        for layer in layers_rows:
-            layer_id = layer['layer_id']
+        with db.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(
+                    SCHEMA_SQL if include_schema else NO_SCHEMA_SQL,
+                    (dataset_id, after, sql_limit)
+                )
+                layers_rows = cursor.fetchall()
 
-            # Query fields 
-            cursor.execute("""
-                SELECT field_name, data_type, unit, description
-                FROM fields
-                WHERE layer_id = %s
-                ORDER BY field_id
-            """, (layer_id,))
-            fields_rows = cursor.fetchall()
+        next_cursor = None
+        if limit is not None and len(layers_rows) > limit:
+            layers_rows = layers_rows[:limit]
+            next_cursor = encode_cursor(layers_rows[-1]['layer_id'])
 
+        layers = []
+        for layer in layers_rows:
             layer_dict = {
                 "layer_id": layer['layer_id'],
                 "name": layer['name'],
@@ -64,18 +102,16 @@ def lambda_handler(event, context):
                 },
                 "description": layer['description'],
                 "timestamp": layer['created_at'].isoformat(),
-                "schema": fields_rows  # list ของ dict จาก RealDictCursor
             }
+            if include_schema:
+                layer_dict["schema"] = layer['schema']  # json_agg ของ fields เรียงตาม field_id
 
             layers.append(layer_dict)
 
-        cursor.close()
-        conn.close()
-
         return {
             "statusCode": 200,
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"count" : len(layers),"layers": layers})
+            "body": json.dumps({"count" : len(layers), "layers": layers, "next_cursor": next_cursor})
         }
 
     except Exception as e:
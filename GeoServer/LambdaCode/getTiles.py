@@ -0,0 +1,128 @@
+import json
+import os
+
+import db
+import metadata_cache
+import response_cache
+import responses
+from field_types import NUMERIC_TYPES
+from layer_sql import generate_field_sql, is_array_type
+
+MVT_EXTENT = int(os.environ.get('MVT_EXTENT', 4096))
+MVT_BUFFER = int(os.environ.get('MVT_BUFFER', 64))
+MVT_MAX_ZOOM = int(os.environ.get('MVT_MAX_ZOOM', 22))
+
+# Hard cap on features per tile so tiles stay bounded in size
+MVT_MAX_FEATURES = int(os.environ.get('MVT_MAX_FEATURES', 50000))
+
+# Attribute thinning: no attributes below MVT_ATTRIBUTE_MIN_ZOOM, only numeric
+# scalars below MVT_FULL_ATTRIBUTE_ZOOM, every field from there on
+MVT_ATTRIBUTE_MIN_ZOOM = int(os.environ.get('MVT_ATTRIBUTE_MIN_ZOOM', 8))
+MVT_FULL_ATTRIBUTE_ZOOM = int(os.environ.get('MVT_FULL_ATTRIBUTE_ZOOM', 14))
+
+TILE_CACHE_SECONDS = int(os.environ.get('TILE_CACHE_SECONDS', 300))
+
+MVT_CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+def tile_fields(fields, z):
+    """Fields carried as tile properties at zoom z"""
+    if z < MVT_ATTRIBUTE_MIN_ZOOM:
+        return []
+    if z < MVT_FULL_ATTRIBUTE_ZOOM:
+        return [
+            (name, data_type) for name, data_type in fields.items()
+            if not is_array_type(data_type) and data_type.lower() in NUMERIC_TYPES
+        ]
+    return list(fields.items())
+
+
+def build_tile_query(layer_id, layer_meta, z, x, y, view_name):
+    """SQL + params producing one MVT tile for a layer (same layer_id filter as the view)"""
+    columns = [generate_field_sql(name, data_type) for name, data_type in tile_fields(layer_meta["fields"], z)]
+    if z >= MVT_FULL_ATTRIBUTE_ZOOM:
+        columns.append("timestamp::text AS timestamp")
+    column_sql = "".join(f",\n                   {column}" for column in columns)
+
+    sql = f"""
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%s, %s, %s) AS env
+        ),
+        mvtgeom AS (
+            SELECT ST_AsMVTGeom(ST_Transform(m.geom, 3857), bounds.env, %s, %s, true) AS geom,
+                   m.measure_id AS id{column_sql}
+            FROM measurements m, bounds
+            WHERE m.layer_id = %s
+              AND m.geom && ST_Transform(bounds.env, %s)
+            LIMIT %s
+        )
+        SELECT ST_AsMVT(mvtgeom, %s, %s, 'geom', 'id')
+        FROM mvtgeom
+        WHERE geom IS NOT NULL
+    """
+    params = [z, x, y, MVT_EXTENT, MVT_BUFFER, layer_id, layer_meta["srid"],
+              MVT_MAX_FEATURES, view_name, MVT_EXTENT]
+    return sql, params
+
+
+def parse_tile(path_params):
+    """z/x/y path parameters (y may carry the .mvt suffix) -> ints, or ValueError"""
+    y = str(path_params.get("y", ""))
+    if y.endswith(".mvt") or y.endswith(".pbf"):
+        y = y[:-4]
+    z, x, y = int(path_params.get("z")), int(path_params.get("x")), int(y)
+    if not 0 <= z <= MVT_MAX_ZOOM:
+        raise ValueError(f"z must be between 0 and {MVT_MAX_ZOOM}")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"x and y must be between 0 and {2 ** z - 1} at zoom {z}")
+    return z, x, y
+
+
+def lambda_handler(event, context):
+    """GET /datasets/{dataset_id}/layers/{layer_id}/tiles/{z}/{x}/{y}.mvt"""
+    try:
+        path_params = event.get("pathParameters") or {}
+        dataset_id = path_params.get("dataset_id")
+        layer_id = path_params.get("layer_id")
+
+        if not dataset_id or not layer_id:
+            return {"statusCode": 400, "body": "Missing dataset_id or layer_id"}
+
+        try:
+            z, x, y = parse_tile(path_params)
+        except (TypeError, ValueError) as e:
+            return {"statusCode": 400, "body": json.dumps({"error": f"Invalid tile coordinates: {e}"})}
+
+        layer_meta = metadata_cache.get_layer(layer_id)
+        if not layer_meta or str(layer_meta["dataset_id"]) != str(dataset_id):
+            return {"statusCode": 404, "body": f"Layer {layer_id} not found in dataset {dataset_id}"}
+
+        cache_key = response_cache.make_key(
+            "tile", layer_id, [z, x, y],
+            response_cache.layer_version(layer_id), responses.negotiate_encoding(event)
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        view_name = f"{layer_meta['name'].lower().replace(' ', '_')}_view"
+        sql, params = build_tile_query(layer_id, layer_meta, z, x, y, view_name)
+
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                row = cur.fetchone()
+        tile = bytes(row[0]) if row and row[0] is not None else b""
+
+        headers = {"Cache-Control": f"public, max-age={TILE_CACHE_SECONDS}"}
+        if not tile:
+            return {"statusCode": 204, "headers": headers, "body": ""}
+
+        result = responses.build_response(event, [tile], content_type=MVT_CONTENT_TYPE, headers=headers)
+        return response_cache.put(cache_key, result)
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
@@ -0,0 +1,216 @@
+import json
+import os
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+import db
+import ingest_queue
+import measurement_writer
+
+# Write-behind buffer: flush once it holds this many rows or its oldest message is this old
+INGEST_FLUSH_ROWS = int(os.environ.get('INGEST_FLUSH_ROWS', 5000))
+INGEST_FLUSH_SECONDS = float(os.environ.get('INGEST_FLUSH_SECONDS', 5))
+
+# Polling mode: SQS long poll per receive, and time kept free before the Lambda timeout
+INGEST_RECEIVE_WAIT = int(os.environ.get('INGEST_RECEIVE_WAIT', 1))
+INGEST_SHUTDOWN_MARGIN = float(os.environ.get('INGEST_SHUTDOWN_MARGIN', 10))
+
+# Lost connections, deadlocks and serialization failures (TransactionRollbackError is an
+# OperationalError) say nothing about the rows: redeliver instead of failing the ticket
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class WriteBehindBuffer:
+    """Received messages waiting for one COPY"""
+
+    def __init__(self, max_rows=INGEST_FLUSH_ROWS, max_age=INGEST_FLUSH_SECONDS):
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.messages = []
+        self.rows = 0
+        self.started = None
+
+    def add(self, receipt, message):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.messages.append((receipt, message))
+        self.rows += len(message["rows"])
+
+    def due(self):
+        if not self.messages:
+            return False
+        return self.rows >= self.max_rows or time.monotonic() - self.started >= self.max_age
+
+    def take(self):
+        messages = self.messages
+        self.messages, self.rows, self.started = [], 0, None
+        return messages
+
+
+def claim_parts(cur, messages):
+    """Messages not applied yet, recorded as applied in the caller's transaction
+
+    Messages from older producers carry no part and are always applied.
+    """
+    parts = {(m["ticket"], m["part"]) for m in messages if m.get("part") is not None}
+    claimed = set()
+    if parts:
+        claimed = set(execute_values(cur, """
+            INSERT INTO ingest_ticket_parts (ticket_id, part) VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING ticket_id::text, part
+        """, sorted(parts), template="(%s::uuid, %s)", fetch=True))
+    fresh = []
+    for message in messages:
+        part = message.get("part")
+        if part is None:
+            fresh.append(message)
+        elif (message["ticket"], part) in claimed:
+            claimed.discard((message["ticket"], part))
+            fresh.append(message)
+    return fresh
+
+
+def write_messages(cur, messages):
+    """COPY the rows of every message at once, then bump layers and tickets in the same transaction
+
+    Messages an earlier delivery already applied are skipped, so redelivery
+    neither writes nor counts their rows again.
+    """
+    messages = claim_parts(cur, messages)
+    rows = []
+    per_ticket = {}
+    for message in messages:
+        for row in message["rows"]:
+            # [attributes, ewkb] from older producers, [attributes, ewkb, record_key, timestamp] now
+            attributes, ewkb, record_key, ts = (list(row) + [None, None])[:4]
+            ts = measurement_writer.parse_timestamp(ts) if ts else None
+            rows.append((message["layer_id"], attributes, ewkb, record_key, ts))
+        per_ticket[message["ticket"]] = per_ticket.get(message["ticket"], 0) + len(message["rows"])
+
+    if not rows:
+        return
+    # Same bookkeeping as a synchronous insert: cache version and dirty rollup days per layer
+    measurement_writer.write_measurements(cur, rows)
+    execute_values(cur, """
+        UPDATE ingest_tickets t SET inserted = t.inserted + v.rows, updated_at = NOW()
+        FROM (VALUES %s) AS v(ticket_id, rows)
+        WHERE t.ticket_id = v.ticket_id::uuid
+    """, list(per_ticket.items()))
+
+
+def record_failure(message, error):
+    """Count a message's rows as failed on its ticket, once per message"""
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            if not claim_parts(cur, [message]):
+                return
+            cur.execute("""
+                UPDATE ingest_tickets SET failed = failed + %s, error = %s, updated_at = NOW()
+                WHERE ticket_id = %s;
+            """, (len(message["rows"]), str(error), message["ticket"]))
+
+
+def flush(messages):
+    """Write buffered messages in one transaction
+
+    When the batch fails on its data each message is retried on its own, so
+    one bad row only fails its own message. Transient database errors send the
+    whole batch back to the queue, which retries and eventually dead-letters it.
+    Returns (done, retry): receipts that can be deleted (written, or recorded
+    as failed on their ticket) and receipts that should be delivered again.
+    """
+    if not messages:
+        return [], []
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                write_messages(cur, [message for _, message in messages])
+        print(f"Flushed {sum(len(m['rows']) for _, m in messages)} rows from {len(messages)} message(s)")
+        return [receipt for receipt, _ in messages], []
+    except Exception as e:
+        print(f"Flush of {len(messages)} message(s) failed: {e}")
+        if isinstance(e, TRANSIENT_ERRORS):
+            return [], [receipt for receipt, _ in messages]
+        if len(messages) > 1:
+            done, retry = [], []
+            for item in messages:
+                item_done, item_retry = flush([item])
+                done += item_done
+                retry += item_retry
+            return done, retry
+
+        receipt, message = messages[0]
+        try:
+            record_failure(message, e)
+            return [receipt], []
+        except Exception as record_error:
+            # DB unreachable, let the queue deliver it again (and eventually dead-letter it)
+            print(f"Could not record failure of ticket {message['ticket']}: {record_error}")
+            return [], [receipt]
+
+
+def drain(queue, deadline):
+    """Receive into the write-behind buffer and flush by size or age until deadline or an empty queue
+
+    Stops after a flush that handed messages back: the database is failing, and
+    receiving again would only fetch the same messages and fail them again.
+    """
+    buffer = WriteBehindBuffer()
+    totals = {"messages": 0, "completed": 0, "retried": 0}
+
+    def flush_buffer():
+        done, retry = flush(buffer.take())
+        queue.delete(done)
+        queue.release(retry)
+        totals["completed"] += len(done)
+        totals["retried"] += len(retry)
+        return bool(retry)
+
+    while time.monotonic() < deadline:
+        received = queue.receive(ingest_queue.SQS_BATCH_SIZE, INGEST_RECEIVE_WAIT)
+        for receipt, body in received:
+            buffer.add(receipt, ingest_queue.decode_message(body))
+        totals["messages"] += len(received)
+        if not received:
+            break
+        if buffer.due() and flush_buffer():
+            break
+    flush_buffer()
+    return totals
+
+
+def lambda_handler(event, context):
+    """
+    SQS event source mapping (batch size / batching window do the size and age flush):
+        {"Records": [{"messageId": "...", "body": "{\"ticket\": ..., \"rows\": [...]}"}, ...]}
+    Enable ReportBatchItemFailures, messages that could not be written are returned for redelivery.
+
+    Scheduled or manual invocation ({}): polls the queue (SQS or the in-process
+    stand-in) until it is empty or the Lambda is about to time out.
+    """
+    event = event or {}
+
+    if "Records" in event:
+        buffer = WriteBehindBuffer()
+        retry = []
+        for record in event["Records"]:
+            buffer.add(record["messageId"], ingest_queue.decode_message(record["body"]))
+            if buffer.rows >= buffer.max_rows:
+                retry += flush(buffer.take())[1]
+        retry += flush(buffer.take())[1]
+        return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in retry]}
+
+    if ingest_queue.get_queue() is None:
+        return {"statusCode": 500, "body": json.dumps({"error": "No ingest queue configured (INGEST_QUEUE_URL)"})}
+
+    remaining = context.get_remaining_time_in_millis() / 1000 if context else 60
+    deadline = time.monotonic() + max(remaining - INGEST_SHUTDOWN_MARGIN, 1)
+    totals = drain(ingest_queue.get_queue(), deadline)
+    print(f"Ingest consumer: {totals}")
+    return {
+        "statusCode": 200,
+        "body": json.dumps(dict(totals, **ingest_queue.backpressure()))
+    }
@@ -0,0 +1,314 @@
+"""Queue between insertFeatures (write_mode "async") and ingestConsumer.
+
+SQS when INGEST_QUEUE_URL is set (boto3 is in the Lambda runtime). The
+in-process queue only works when producer and consumer share a process, so it
+is used only when selected with INGEST_QUEUE_BACKEND=memory (tests, local
+runs). With neither, async ingest is disabled. Message body:
+
+    {"ticket": "<uuid>", "layer_id": 1, "part": 0, "rows": [[attributes, ewkb_hex, record_key, timestamp], ...]}
+
+part numbers the messages of a ticket, the consumer applies each (ticket, part) once.
+
+Tickets live in the ingest_tickets table so any container can report them.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+import db
+
+INGEST_QUEUE_URL = os.environ.get('INGEST_QUEUE_URL')
+# "memory" selects the in-process stand-in, never use it where producer and consumer are separate Lambdas
+INGEST_QUEUE_BACKEND = os.environ.get('INGEST_QUEUE_BACKEND', 'sqs').lower()
+
+# SQS caps a message (and a SendMessageBatch call) at 256 KiB
+INGEST_MESSAGE_MAX_BYTES = int(os.environ.get('INGEST_MESSAGE_MAX_BYTES', 240 * 1024))
+
+# Backpressure: above this many queued messages producers get 503 + Retry-After
+INGEST_QUEUE_MAX_DEPTH = int(os.environ.get('INGEST_QUEUE_MAX_DEPTH', 10000))
+INGEST_RETRY_AFTER = int(os.environ.get('INGEST_RETRY_AFTER', 30))
+
+# SQS depth is approximate anyway, don't ask for it on every request
+DEPTH_CACHE_SECONDS = float(os.environ.get('INGEST_DEPTH_CACHE_SECONDS', 5))
+
+SQS_BATCH_SIZE = 10
+
+
+class QueueSendError(Exception):
+    """Sending stopped part way, sent holds the indexes of the bodies that were queued"""
+
+    def __init__(self, error, sent):
+        super().__init__(str(error))
+        self.sent = sent
+
+
+class MemoryQueue:
+    """In-process stand-in with SQS semantics: received messages stay in flight until deleted"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._messages = deque()
+        self._in_flight = OrderedDict()
+        self._lock = threading.Lock()
+
+    def send(self, bodies):
+        with self._lock:
+            self._messages.extend(bodies)
+
+    def receive(self, max_messages=SQS_BATCH_SIZE, wait_seconds=0):
+        """[(receipt, body), ...], empty when the queue is drained"""
+        received = []
+        with self._lock:
+            while self._messages and len(received) < max_messages:
+                receipt = uuid.uuid4().hex
+                body = self._messages.popleft()
+                self._in_flight[receipt] = body
+                received.append((receipt, body))
+        return received
+
+    def delete(self, receipts):
+        with self._lock:
+            for receipt in receipts:
+                self._in_flight.pop(receipt, None)
+
+    def release(self, receipts):
+        """Make in-flight messages visible again (what an SQS visibility timeout does)"""
+        with self._lock:
+            for receipt in receipts:
+                body = self._in_flight.pop(receipt, None)
+                if body is not None:
+                    self._messages.appendleft(body)
+
+    def depth(self):
+        with self._lock:
+            return len(self._messages) + len(self._in_flight)
+
+
+class SQSQueue:
+    """Standard SQS queue, at-least-once delivery"""
+
+    name = "sqs"
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+        self._depth = (0, 0.0)
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client('sqs')
+        return self._client
+
+    def send(self, bodies):
+        """Send in batches of up to 10 messages whose total size stays under the per-call limit
+
+        Stops at the first failure and raises QueueSendError with the bodies already queued.
+        """
+        sent = []
+        batch, size = [], 0
+        try:
+            for i, body in enumerate(bodies):
+                if batch and (len(batch) == SQS_BATCH_SIZE or size + len(body) > INGEST_MESSAGE_MAX_BYTES):
+                    self._send_batch(batch, sent)
+                    batch, size = [], 0
+                batch.append((i, body))
+                size += len(body)
+            if batch:
+                self._send_batch(batch, sent)
+        except Exception as e:
+            raise QueueSendError(e, sent) from e
+
+    def _send_batch(self, batch, sent):
+        response = self.client.send_message_batch(
+            QueueUrl=self.url,
+            Entries=[{"Id": str(i), "MessageBody": body} for i, body in batch]
+        )
+        sent.extend(int(entry["Id"]) for entry in response.get("Successful", []))
+        if response.get("Failed"):
+            raise RuntimeError(f"SQS rejected {len(response['Failed'])} message(s): {response['Failed'][0]}")
+
+    def receive(self, max_messages=SQS_BATCH_SIZE, wait_seconds=0):
+        response = self.client.receive_message(
+            QueueUrl=self.url,
+            MaxNumberOfMessages=min(max_messages, SQS_BATCH_SIZE),
+            WaitTimeSeconds=wait_seconds
+        )
+        return [(m["ReceiptHandle"], m["Body"]) for m in response.get("Messages", [])]
+
+    def delete(self, receipts):
+        receipts = list(receipts)
+        for start in range(0, len(receipts), SQS_BATCH_SIZE):
+            self.client.delete_message_batch(
+                QueueUrl=self.url,
+                Entries=[{"Id": str(i), "ReceiptHandle": r}
+                         for i, r in enumerate(receipts[start:start + SQS_BATCH_SIZE])]
+            )
+
+    def release(self, receipts):
+        receipts = list(receipts)
+        for start in range(0, len(receipts), SQS_BATCH_SIZE):
+            self.client.change_message_visibility_batch(
+                QueueUrl=self.url,
+                Entries=[{"Id": str(i), "ReceiptHandle": r, "VisibilityTimeout": 0}
+                         for i, r in enumerate(receipts[start:start + SQS_BATCH_SIZE])]
+            )
+
+    def depth(self):
+        depth, checked_at = self._depth
+        if time.monotonic() - checked_at > DEPTH_CACHE_SECONDS:
+            attributes = self.client.get_queue_attributes(
+                QueueUrl=self.url,
+                AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"]
+            )["Attributes"]
+            depth = int(attributes["ApproximateNumberOfMessages"]) + int(attributes["ApproximateNumberOfMessagesNotVisible"])
+            self._depth = (depth, time.monotonic())
+        return depth
+
+
+if INGEST_QUEUE_BACKEND == 'memory':
+    _queue = MemoryQueue()
+elif INGEST_QUEUE_URL:
+    _queue = SQSQueue(INGEST_QUEUE_URL)
+else:
+    _queue = None
+
+
+def get_queue():
+    """The configured queue, None when async ingest is not configured"""
+    return _queue
+
+
+def backpressure():
+    """Queue depth and whether producers should back off"""
+    if _queue is None:
+        return {"queue": None, "queue_depth": 0, "max_depth": INGEST_QUEUE_MAX_DEPTH, "throttled": False}
+    depth = _queue.depth()
+    return {
+        "queue": _queue.name,
+        "queue_depth": depth,
+        "max_depth": INGEST_QUEUE_MAX_DEPTH,
+        "throttled": depth >= INGEST_QUEUE_MAX_DEPTH,
+    }
+
+
+def encode_messages(ticket, layer_id, rows):
+    """Split (attributes, ewkb_hex, record_key, timestamp) rows into message bodies under INGEST_MESSAGE_MAX_BYTES
+
+    A row that does not fit in a message on its own raises ValueError.
+    """
+    def header(part):
+        return json.dumps({"ticket": str(ticket), "layer_id": int(layer_id), "part": part, "rows": []})[:-2]
+
+    budget = INGEST_MESSAGE_MAX_BYTES - len(header(2 ** 31 - 1)) - 2
+    bodies, chunk, size = [], [], 0
+    for row in rows:
+        encoded = json.dumps(row)
+        if len(encoded) + 1 > budget:
+            raise ValueError(f"Feature of {len(encoded)} bytes does not fit in an ingest message")
+        if chunk and size + len(encoded) + 1 > budget:
+            bodies.append(header(len(bodies)) + ",".join(chunk) + "]}")
+            chunk, size = [], 0
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        bodies.append(header(len(bodies)) + ",".join(chunk) + "]}")
+    return bodies
+
+
+def decode_message(body):
+    return json.loads(body)
+
+
+def create_ticket(ticket, layer_id, accepted):
+    """Commit the ingest_tickets row of features about to be queued"""
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO ingest_tickets (ticket_id, layer_id, accepted) VALUES (%s, %s, %s);",
+                (str(ticket), layer_id, accepted)
+            )
+
+
+def fail_ticket(ticket, error, failed):
+    """Count features of a ticket that could not be queued as failed"""
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE ingest_tickets SET failed = failed + %s, error = %s, updated_at = NOW()
+                WHERE ticket_id = %s;
+            """, (failed, str(error), str(ticket)))
+
+
+def ticket_state(accepted, inserted, failed):
+    """queued, processing, done, partial (some rows failed) or failed"""
+    if inserted + failed < accepted:
+        return "queued" if inserted + failed == 0 else "processing"
+    if not failed:
+        return "done"
+    return "partial" if inserted else "failed"
+
+
+def get_ticket(ticket):
+    """Ticket status dict, None when it does not exist"""
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT ticket_id, layer_id, accepted, inserted, failed, error, created_at, updated_at
+                FROM ingest_tickets WHERE ticket_id = %s;
+            """, (str(ticket),))
+            row = cur.fetchone()
+    if not row:
+        return None
+    ticket_id, layer_id, accepted, inserted, failed, error, created_at, updated_at = row
+    return {
+        "ticket": str(ticket_id),
+        "layer_id": layer_id,
+        "status": ticket_state(accepted, inserted, failed),
+        "accepted": accepted,
+        "inserted": inserted,
+        "failed": failed,
+        "error": error,
+        "created_at": created_at.isoformat(),
+        "updated_at": updated_at.isoformat(),
+    }
+
+
+def enqueue(layer_id, rows):
+    """Create a ticket and queue (attributes, ewkb_hex, record_key, timestamp) rows under it
+
+    Returns (ticket id, indexes of the rows that could not be queued). A row
+    too large for a message raises ValueError before anything is written.
+    Rows whose message was not sent are counted failed on the ticket; when
+    none was sent the error is re-raised.
+    """
+    ticket = uuid.uuid4()
+    # Rows without a timestamp get one fixed now, so the content key measurement_writer
+    # gives them is the same on every delivery and a redelivered message upserts onto its rows
+    received = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    rows = [(attributes, ewkb, record_key, ts or received) for attributes, ewkb, record_key, ts in rows]
+    bodies = encode_messages(ticket, layer_id, rows)
+    # Committed before sending, the consumer may pick the messages up right away
+    create_ticket(ticket, layer_id, len(rows))
+    try:
+        _queue.send(bodies)
+    except Exception as e:
+        sent = set(getattr(e, "sent", ()))
+        unsent, start = [], 0
+        for i, body in enumerate(bodies):
+            count = len(decode_message(body)["rows"])
+            if i not in sent:
+                unsent.extend(range(start, start + count))
+            start += count
+        fail_ticket(ticket, e, len(unsent))
+        if not sent:
+            raise
+        print(f"Ticket {ticket}: {len(unsent)}/{len(rows)} rows not queued: {e}")
+        return ticket, unsent
+    return ticket, []
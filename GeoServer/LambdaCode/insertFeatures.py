@@ -1,234 +1,442 @@
 import json
 import os
-import psycopg2
-import requests
 from xml.sax.saxutils import escape
 import xml.etree.ElementTree as ET
 
-# RDS connection
-DB_HOST = os.environ['DB_HOST']
-DB_NAME = os.environ['DB_NAME']
-DB_USER = os.environ['DB_USER']
-DB_PASSWORD = os.environ['DB_PASSWORD']
-DB_PORT = os.environ.get('DB_PORT', 5432)
+import db
+import geometry
+import geoserver
+import ingest_queue
+import measurement_writer
+import metadata_cache
+import response_cache
+from validators import LayerValidator
 
 # GeoServer connection
 GEOSERVER_URL = os.environ['GEOSERVER_URL']
-GEOSERVER_USER = os.environ['GEOSERVER_USER']
-GEOSERVER_PASSWORD = os.environ['GEOSERVER_PASSWORD']
-
-DATA_TYPE_MAP = {
-    'integer': int,
-    'bigint': int,
-    'numeric': float,
-    'real': float,
-    'double precision': float,
-    'text': str,
-    'varchar': str,
-    'timestamp': str,
-    'boolean': bool,
-    # Array types
-    'integer[]': list,
-    'bigint[]': list,
-    'numeric[]': list,
-    'real[]': list,
-    'double precision[]': list,
-    'text[]': list,
-    'varchar[]': list,
-    'character varying[]': list,
-    '_int4': list,  
-    '_int8': list,
-    '_text': list,
-    '_varchar': list,
-}
 
-# Map array types to element types
-ARRAY_ELEMENT_TYPE_MAP = {
-    'integer[]': int,
-    'bigint[]': int,
-    'numeric[]': float,
-    'real[]': float,
-    'double precision[]': float,
-    'text[]': str,
-    'varchar[]': str,
-    'character varying[]': str,
-    '_int4': int,
-    '_int8': int,
-    '_text': str,
-    '_varchar': str,
+# Max <wfs:Insert> elements per Transaction in batch mode
+WFS_BATCH_SIZE = int(os.environ.get('WFS_BATCH_SIZE', 100))
+
+# Layers that always use the direct COPY write path (comma separated layer ids)
+COPY_WRITE_LAYERS = {
+    layer.strip() for layer in os.environ.get('COPY_WRITE_LAYERS', '').split(',') if layer.strip()
 }
+WRITE_MODES = ['wfs', 'copy', 'async']
 
 VALID_GEOM_TYPES = ['POINT', 'LINESTRING', 'POLYGON', 
                     'MULTIPOINT', 'MULTILINESTRING', 'MULTIPOLYGON']
 
+
 def to_pascal_case(s):
     # แปลง string เป็น PascalCase สำหรับ GML element
     return "".join(word.capitalize() for word in s.lower().split("_"))
 
-def is_array_type(data_type):
-    """Check if data_type is an array type"""
-    data_type_lower = data_type.lower()
-    return data_type_lower.endswith('[]') or data_type_lower.startswith('_')
+def copy_features(layer_id, rows):
+    """Stream validated (data, ewkb_hex, record_key, timestamp) rows into measurements with COPY FROM STDIN
+
+    Rows are upserted, on their content when they have no record_key. Returns how many rows were inserted or changed.
+    """
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            # Cache version and dirty rollups are bumped in the same transaction as the rows
+            return measurement_writer.write_measurements(
+                cur, [(int(layer_id), data, ewkb, record_key, ts) for data, ewkb, record_key, ts in rows]
+            )
+
+
+def record_ingest(cur, layer_id):
+    """Bump the layer data_version (response cache) and mark today's rollups dirty"""
+    response_cache.bump_layer_version(cur, [layer_id])
+    cur.execute("SELECT mark_rollups_dirty(%s, NOW()::timestamp, NOW()::timestamp);", (layer_id,))
+
+
+def record_wfs_ingest(layer_id):
+    """Invalidate cached responses and rollups of a layer after a WFS-T insert"""
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                record_ingest(cur, layer_id)
+    except Exception as e:
+        # The rows are already committed by GeoServer; stale entries expire with RESPONSE_CACHE_TTL
+        print(f"Failed to bump data_version of layer {layer_id}: {e}")
+
+
+def resolve_write_mode(layer_id, requested):
+    """Pick the write path: explicit request value, else per-layer config, else WFS-T"""
+    if requested:
+        return requested.lower()
+    if str(layer_id) in COPY_WRITE_LAYERS:
+        return 'copy'
+    return 'wfs'
 
-def validate_array_elements(array_value, element_type, field_name):
-    """Validate all elements in array match expected type"""
+
+def validate_geom(geom, geom_type_db, srid_db):
+    """Validate a geometry object against the layer geometry type and SRID"""
     errors = []
-    if not isinstance(array_value, list):
-        errors.append(f"Field '{field_name}' expects array (list), got {type(array_value).__name__}")
+    if not isinstance(geom, dict):
+        errors.append("Geometry must be an object with 'type' and 'coordinates'")
         return errors
-    
-    for idx, elem in enumerate(array_value):
-        if elem is None:
-            continue  # NULL values allowed in arrays
-        
-        if element_type == int:
-            if not isinstance(elem, int):
-                # Allow float 
-                if isinstance(elem, float) and elem.is_integer():
-                    continue
-                errors.append(f"Field '{field_name}[{idx}]' expects int, got {type(elem).__name__}: {elem}")
-        elif element_type == float:
-            if not isinstance(elem, (int, float)):
-                errors.append(f"Field '{field_name}[{idx}]' expects number, got {type(elem).__name__}: {elem}")
-        elif element_type == str:
-            if not isinstance(elem, str):
-                errors.append(f"Field '{field_name}[{idx}]' expects string, got {type(elem).__name__}: {elem}")
-        else:
-            if not isinstance(elem, element_type):
-                errors.append(f"Field '{field_name}[{idx}]' expects {element_type.__name__}, got {type(elem).__name__}: {elem}")
-    
+    if geom_type_db.upper() not in VALID_GEOM_TYPES:
+        errors.append(f"Layer geom_type '{geom_type_db}' not supported")
+    if geom.get("type", "").upper() != geom_type_db.upper():
+        errors.append(f"Geometry type mismatch: expected '{geom_type_db}', got '{geom.get('type')}'")
+    if "srid" in geom and geom["srid"] != srid_db:
+        errors.append(f"SRID mismatch: expected {srid_db}, got {geom['srid']}")
     return errors
 
-def serialize_coords(geom_type, coords):
-    geom_type = geom_type.upper()
-    print("Geom Type from serialize function", geom_type)
 
-    if geom_type == "POINT":
-        # [x, y]
-        return f"{coords[0]},{coords[1]}"
+def normalize_feature(feature):
+    """Return (data, geom) from either {data, geom} or a GeoJSON Feature"""
+    if not isinstance(feature, dict):
+        return None, None
+    data = feature.get('data')
+    if data is None:
+        data = feature.get('properties')
+    geom = feature.get('geom')
+    if geom is None:
+        geom = feature.get('geometry')
+    return data, geom
+
+
+def feature_identity(feature):
+    """(record_key, timestamp) of a feature, (None, None) when it has neither
+
+    record_id makes re-sending a feature update
+    the stored row instead of adding another. The feature timestamp is part
+    of that key, so a record_id needs one. Without a record_id the writer keys
+    the row by its content (measurement_writer.content_key), so the same
+    feature sent again with its timestamp is not stored twice.
+    """
+    if not isinstance(feature, dict):
+        return None, None
+    record_id = feature.get('record_id')
+    ts = feature.get('timestamp')
+    ts = measurement_writer.parse_timestamp(ts) if ts is not None else None
+    if record_id is not None:
+        if isinstance(record_id, (dict, list, bool)) or str(record_id) == "":
+            raise ValueError("record_id must be a string or a number")
+        if ts is None:
+            raise ValueError("record_id requires a timestamp")
+        record_id = str(record_id)
+    return record_id, ts
+
+
+def build_insert(workspace_name, layer_name_xml, layer_id, data, geom_gml_xml):
+    """Build one <wfs:Insert> element for a feature, geometry already encoded as GML"""
+    attributes_json = json.dumps(data)
+
+    return f"""
+  <wfs:Insert>
+    <{workspace_name}:{layer_name_xml}>
+      <{workspace_name}:layer_id>{layer_id}</{workspace_name}:layer_id>
+      <{workspace_name}:attributes>{escape(attributes_json)}</{workspace_name}:attributes>
+      <{workspace_name}:geom>
+        {geom_gml_xml}
+      </{workspace_name}:geom>
+    </{workspace_name}:{layer_name_xml}>
+  </wfs:Insert>"""
+
+
+def build_transaction(workspace_name, layer_name_xml, inserts):
+    """Wrap <wfs:Insert> elements in a single WFS-T Transaction document"""
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<wfs:Transaction service="WFS" version="1.1.0"
+    xmlns:wfs="http://www.opengis.net/wfs"
+    xmlns:gml="http://www.opengis.net/gml"
+    xmlns:{workspace_name}="http://{workspace_name}"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="http://www.opengis.net/wfs
+        http://schemas.opengis.net/wfs/1.1.0/wfs.xsd
+        http://www.opengis.net/gml
+        http://schemas.opengis.net/gml/3.1.1/base/gml.xsd
+        {GEOSERVER_URL}/wfs/DescribeFeatureType?typename={workspace_name}:{layer_name_xml}">
+{"".join(inserts)}
+</wfs:Transaction>"""
+
+
+def send_transaction(xml_data):
+    """POST a WFS-T Transaction and return the inserted FeatureIds in order
 
-    elif geom_type == "LINESTRING":
-        return " ".join(f"{x},{y}" for x, y in coords)
+    Returns (fids, error). fids is None when GeoServer rejected the transaction.
+    """
+    response = geoserver.post(
+        '/wfs',
+        data=xml_data,
+        headers={"Content-Type": "text/xml"},
+        op="WFS Transaction"
+    )
 
-    elif geom_type == "POLYGON":
-        rings = []
-        
-        for ring in coords:
-            rings.append(" ".join(f"{x} {y}" for x, y in ring))
-        return rings[0]
+    try:
+        root = ET.fromstring(response.text)
+    except ET.ParseError:
+        return None, f"Insert failed: {response.text}"
 
-    elif geom_type == "MULTIPOINT":
-        # coords = [[x1, y1], [x2, y2], ...]
-        return " ".join(f"{x} {y}" for x, y in coords)
+    ns = {
+        "wfs": "http://www.opengis.net/wfs",
+        "ogc": "http://www.opengis.net/ogc"
+    }
 
+    # WFS 1.1 reports InsertResults/Feature/FeatureId, WFS 1.0 InsertResult/FeatureId
+    fids = [elem.get("fid") for elem in root.findall(".//wfs:InsertResults/wfs:Feature/ogc:FeatureId", ns)]
+    if not fids:
+        fids = [elem.get("fid") for elem in root.findall(".//wfs:InsertResult/ogc:FeatureId", ns)]
+    if not fids:
+        return None, f"Insert failed: {response.text}"
+    return fids, None
 
-    elif geom_type == "MULTILINESTRING":
-        lines = []
-        for line in coords:
-            lines.append(" ".join(f"{x} {y}" for x, y in line))
-        return " ".join(lines)
 
+def get_layer_context(layer_id):
+    """Compiled LayerValidator plus (name, geom_type, srid, dataset_id, dataset_name) for a layer
 
-    else:
-        raise ValueError(f"Unsupported geometry type: {geom_type}")
-
-def generate_gml(geom_type, coords, srid):
-    print("Geom Type from generate function", geom_type)
-    
-    
-    if geom_type == "POINT":
-        return f"""
-    <gml:Point srsName="EPSG:{srid}">
-        <gml:coordinates>{serialize_coords(geom_type, coords)}</gml:coordinates>
-    </gml:Point>
+    Served from metadata_cache, so a warm container needs no metadata query
+    and no validator compilation.
+    """
+    layer = metadata_cache.get_layer(layer_id)
+    if layer is None:
+        return LayerValidator(layer_id, {}), None
+    layer_row = (layer["name"], layer["geom_type"], layer["srid"],
+                 layer["dataset_id"], layer["dataset_name"])
+    return layer["validator"], layer_row
+
+
+def validate_features(layer_id, features):
+    """Validate features against the layer schema in one pass
+
+    Returns (error_response, layer_row, results, valid): error_response is set
+    when the layer or dataset is missing, results holds the per-feature errors
+    and valid the (index, data, geom, identity) of features that passed, identity
+    being the (record_key, timestamp) from feature_identity.
+    """
+    validator, layer_row = get_layer_context(layer_id)
+
+    if not layer_row:
+        return {"statusCode": 404, "body": json.dumps({"error": f"Layer {layer_id} not found"})}, None, None, None
+
+    layer_name_db, geom_type_db, srid_db, dataset_id, dataset_name = layer_row
+    if not dataset_name:
+        return {"statusCode": 400, "body": json.dumps({"error": f"Dataset {dataset_id} not found"})}, None, None, None
+
+    # Validate every feature against the same compiled schema, attributes in one pass
+    normalized = [normalize_feature(feature) for feature in features]
+    attribute_errors = validator.validate_many(
+        data if isinstance(data, dict) else {} for data, _ in normalized
+    )
+
+    results = [None] * len(features)
+    valid = []
+    for idx, (data, geom) in enumerate(normalized):
+        if not isinstance(data, dict) or not data or not geom:
+            results[idx] = {"index": idx, "success": False, "errors": ["data and geom are required"]}
+            continue
+        errors = attribute_errors[idx] + validate_geom(geom, geom_type_db, srid_db)
+        try:
+            identity = feature_identity(features[idx])
+        except ValueError as e:
+            errors.append(str(e))
+        if errors:
+            results[idx] = {"index": idx, "success": False, "errors": errors}
+            continue
+        valid.append((idx, data, geom, identity))
+
+    return None, layer_row, results, valid
+
+
+def encode_ewkb_rows(valid, srid_db, results):
+    """(index, data, ewkb_hex, record_key, timestamp) of valid features, bad coordinates fail only that feature"""
+    rows = []
+    for idx, data, geom, (record_key, ts) in valid:
+        try:
+            rows.append((idx, data, geometry.to_ewkb_hex(geom["type"], geom.get("coordinates"), srid_db), record_key, ts))
+        except (TypeError, ValueError, IndexError) as e:
+            results[idx] = {"index": idx, "success": False, "errors": [f"Invalid coordinates: {e}"]}
+    return rows
+
+
+def enqueue_batch(layer_id, features):
+    """Validate and queue features for ingestConsumer, answers 202 with a ticket
+
+    Nothing is written here: the consumer COPYs the queued rows in
+    micro-batches. 503 with Retry-After when the queue is over its depth limit
+    or nothing could be queued.
     """
-    
-    elif geom_type == "LINESTRING":
-        return f"""
-    <gml:LineString srsName="EPSG:{srid}">
-        <gml:coordinates decimal="." cs="," ts=" ">{serialize_coords(geom_type, coords)}</gml:coordinates>
-    </gml:LineString>
-        """
-        
-    elif geom_type == "POLYGON":
-        return f"""
-    <gml:Polygon srsName="EPSG:{srid}">
-        <gml:exterior>
-            <gml:LinearRing>
-                <gml:posList>
-                    {serialize_coords(geom_type, coords)}
-                </gml:posList>
-            </gml:LinearRing>
-        </gml:exterior>
-    </gml:Polygon>
+    if ingest_queue.get_queue() is None:
+        return {
+            "statusCode": 503,
+            "body": json.dumps({"error": "Async ingest is not configured (INGEST_QUEUE_URL), use write_mode 'copy' or 'wfs'"})
+        }
+    pressure = ingest_queue.backpressure()
+    if pressure["throttled"]:
+        return {
+            "statusCode": 503,
+            "headers": {"Retry-After": str(ingest_queue.INGEST_RETRY_AFTER)},
+            "body": json.dumps(dict(pressure, error="Ingest queue is full, retry later"))
+        }
+
+    error_response, layer_row, results, valid = validate_features(layer_id, features)
+    if error_response:
+        return error_response
+
+    rows = encode_ewkb_rows(valid, layer_row[2], results)
+    rejected = len(features) - len(rows)
+    if not rows:
+        return {
+            "statusCode": 400,
+            "body": json.dumps({"success": False, "accepted": 0, "rejected": rejected, "results": results})
+        }
+
+    try:
+        ticket, unsent = ingest_queue.enqueue(layer_id, [
+            (data, ewkb, record_key, ts.isoformat() if ts else None)
+            for _, data, ewkb, record_key, ts in rows
+        ])
+    except ValueError as e:
+        return {"statusCode": 413, "body": json.dumps({"error": str(e)})}
+    except Exception as e:
+        print(f"Enqueue failed for layer {layer_id}: {e}")
+        return {
+            "statusCode": 503,
+            "headers": {"Retry-After": str(ingest_queue.INGEST_RETRY_AFTER)},
+            "body": json.dumps({"error": f"Ingest queue error: {e}"})
+        }
+
+    # A partial send still answers 202: the unsent rows are failed on the ticket,
+    # and a client retry would queue the sent ones twice
+    unsent = {rows[i][0] for i in unsent}
+    for row in rows:
+        if row[0] in unsent:
+            results[row[0]] = {"index": row[0], "success": False, "error": "Could not be queued"}
+        else:
+            results[row[0]] = {"index": row[0], "success": True, "queued": True}
+    print(f"Queued {len(rows) - len(unsent)}/{len(features)} features of layer {layer_id}, ticket {ticket}")
+
+    return {
+        "statusCode": 202,
+        "headers": {"Location": f"/ingest/{ticket}"},
+        "body": json.dumps(dict(
+            pressure,
+            ticket=str(ticket),
+            status="queued",
+            status_url=f"/ingest/{ticket}",
+            accepted=len(rows),
+            rejected=rejected,
+            failed=len(unsent),
+            results=results
+        ))
+    }
+
+
+def insert_batch(layer_id, features, batch_size, write_mode='wfs'):
+    """Validate a list of features once and insert them in chunked WFS-T Transactions
+
+    With write_mode='copy' the valid features bypass GeoServer and are streamed
+    straight into measurements with a single COPY. Features with a record_id
+    or timestamp always take that path, WFS-T can neither upsert nor set the
+    timestamp.
     """
-    elif geom_type == "MULTIPOINT":
-        gml_data = f'<gml:MultiPoint srsName="EPSG:{srid}">\n'
-        
-        for point in coords:
-            gml_data += f"""
-                <gml:pointMember>
-                    <gml:Point>
-                    <gml:pos>{point[0]} {point[1]}</gml:pos>
-                    </gml:Point>
-                </gml:pointMember>\n"""
-        gml_data += "</gml:MultiPoint>"
-        return gml_data
-        
-    elif geom_type == 'MULTILINESTRING':
-        # coordinates = [
-        #     [[170.0, 45.0], [180.0, 45.0]],
-        #     [[-180.0, 45.0], [-170.0, 45.0]]
-        # ]
-        
-        gml_data = f"""
-            <gml:MultiLineString srsName="EPSG:{srid}">\n   
-        """
-        for elm in coords:
-            line = ""
-            for x, y in elm:
-                line += f"{x} {y} "
-                print("line", line.strip())
-            gml_data += f"""
-                <gml:lineStringMember>
-                    <gml:LineString>
-                        <gml:posList>
-                        {line.strip()}
-                        </gml:posList>
-                    </gml:LineString>
-                </gml:lineStringMember>\n
-            """
-        gml_data += "</gml:MultiLineString>"
-        return gml_data
-    
-    elif geom_type == 'MULTIPOLYGON':
-        
-        
-        gml_data = f'<gml:MultiPolygon srsName="EPSG:{srid}">\n'
-
-        for polygon in coords:               
-            for ring in polygon:             
-                coord_str = ""
-                for x, y in ring:           
-                    coord_str += f"{x},{y} "
-
-                gml_data += f"""
-                <gml:polygonMember>
-                    <gml:Polygon>
-                        <gml:outerBoundaryIs>
-                            <gml:LinearRing>
-                                <gml:coordinates>{coord_str.strip()}</gml:coordinates>
-                            </gml:LinearRing>
-                        </gml:outerBoundaryIs>
-                    </gml:Polygon>
-                </gml:polygonMember>
-                """
-
-        gml_data += "</gml:MultiPolygon>"
-        return gml_data
+    error_response, layer_row, results, valid = validate_features(layer_id, features)
+    if error_response:
+        return error_response
+
+    if write_mode == 'wfs' and any(identity != (None, None) for _, _, _, identity in valid):
+        write_mode = 'copy'
+
+    layer_name_db, geom_type_db, srid_db, dataset_id, dataset_name = layer_row
+    workspace_name = dataset_name.lower().replace(" ", "_")
+    layer_name_xml = layer_name_db.lower().replace(" ", "_")
+
+    print(f"Batch insert layer {layer_id}: {len(valid)}/{len(features)} valid, mode {write_mode}, chunk size {batch_size}")
+    print("Metadata cache", metadata_cache.stats())
+
+    if write_mode == 'copy':
+        rows = encode_ewkb_rows(valid, srid_db, results)
+        if rows:
+            try:
+                copy_features(layer_id, [row[1:] for row in rows])
+                for row in rows:
+                    results[row[0]] = {"index": row[0], "success": True}
+            except Exception as e:
+                for row in rows:
+                    results[row[0]] = {"index": row[0], "success": False, "errors": [f"COPY error: {e}"]}
+        chunks = []
+    else:
+        # Geometry is encoded once per feature, bad coordinates fail only that feature
+        encoded = []
+        for idx, data, geom, _ in valid:
+            try:
+                encoded.append((idx, data, geometry.to_gml(geom["type"], geom.get("coordinates"), srid_db)))
+            except (TypeError, ValueError, IndexError) as e:
+                results[idx] = {"index": idx, "success": False, "errors": [f"Invalid coordinates: {e}"]}
+        chunks = [encoded[start:start + batch_size] for start in range(0, len(encoded), batch_size)]
+
+    # Send valid features, many <wfs:Insert> per Transaction
+    for chunk in chunks:
+        inserts = [
+            build_insert(workspace_name, layer_name_xml, layer_id, data, geom_gml)
+            for _, data, geom_gml in chunk
+        ]
+        xml_data = build_transaction(workspace_name, layer_name_xml, inserts)
+
+        try:
+            fids, error = send_transaction(xml_data)
+        except Exception as e:
+            fids, error = None, f"GeoServer request error: {e}"
+
+        if fids is not None and len(fids) != len(chunk):
+            error = f"Insert failed: expected {len(chunk)} FeatureIds, got {len(fids)}"
+            fids = None
+
+        for pos, (idx, _, _) in enumerate(chunk):
+            if fids is not None:
+                results[idx] = {"index": idx, "success": True, "fid": fids[pos]}
+            else:
+                results[idx] = {"index": idx, "success": False, "errors": [error]}
+
+    inserted = sum(1 for r in results if r["success"])
+    failed = len(results) - inserted
+    if inserted and chunks:
+        record_wfs_ingest(layer_id)
+
+    if failed == 0:
+        status_code = 200
+    elif inserted > 0:
+        status_code = 207
+    elif not valid:
+        status_code = 400
+    else:
+        status_code = 500
+
+    return {
+        "statusCode": status_code,
+        "body": json.dumps({
+            "success": failed == 0,
+            "inserted": inserted,
+            "failed": failed,
+            "results": results
+        })
+    }
 
 
 def lambda_handler(event, context):
+    """
+    Single feature:
+    {"data": {"noise_level": 68.5}, "geom": {"type": "POINT", "coordinates": [100.5, 13.7]}}
+
+    Optional per feature: "record_id" with its "timestamp" (ISO 8601). Sending the same record again updates it instead
+    of adding a duplicate row.
+
+    Batch (GeoJSON FeatureCollection style):
+    {
+        "batch_size": 200,
+        "write_mode": "copy",   # optional: "wfs" (default), "copy" to bypass GeoServer,
+                                # or "async" to queue for ingestConsumer (202 + ticket, see getIngestStatus)
+        "features": [
+            {"type": "Feature", "properties": {"noise_level": 68.5},
+             "geometry": {"type": "Point", "coordinates": [100.5, 13.7]}},
+            ...
+        ]
+    }
+    """
     try:
         path_params = event.get('pathParameters') or {}
         layer_id = path_params.get("layer_id")
@@ -236,157 +444,75 @@ def lambda_handler(event, context):
         body = event.get('body')
         if body:
             body = json.loads(body)
-        print("body", body)
+        body = body or {}
+
+        write_mode = resolve_write_mode(layer_id, body.get('write_mode'))
+        if write_mode not in WRITE_MODES:
+            return {"statusCode": 400, "body": json.dumps({"error": f"write_mode must be one of {WRITE_MODES}"})}
+
+        features = body.get('features')
+        if features is not None:
+            if not layer_id or not isinstance(features, list) or not features:
+                return {"statusCode": 400, "body": json.dumps({"error": "layer_id and a non-empty features array are required"})}
+            batch_size = int(body.get('batch_size', WFS_BATCH_SIZE))
+            if batch_size < 1:
+                return {"statusCode": 400, "body": json.dumps({"error": "batch_size must be a positive integer"})}
+            if write_mode == 'async':
+                return enqueue_batch(layer_id, features)
+            return insert_batch(layer_id, features, batch_size, write_mode)
 
         data = body.get('data', {})
-        print("data", data)
         geom = body.get('geom')  # {"type":"POINT","coordinates":[lon,lat]}
-        print("geom", geom)
-        
+
         if not layer_id or not data or not geom:
             return {"statusCode": 400, "body": json.dumps({"error": "layer_id, data, and geom are required"})}
 
-        # Connect to RDS
-        conn = psycopg2.connect(
-            host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASSWORD, port=DB_PORT
-        )
-        cur = conn.cursor()
+        feature = {"data": data, "geom": geom, "record_id": body.get('record_id'), "timestamp": body.get('timestamp')}
+        if write_mode == 'async':
+            return enqueue_batch(layer_id, [feature])
+        if write_mode == 'copy' or feature["record_id"] is not None or feature["timestamp"] is not None:
+            return insert_batch(layer_id, [feature], WFS_BATCH_SIZE, 'copy')
 
         # Validate fields
-        cur.execute("SELECT field_name, data_type FROM fields WHERE layer_id = %s", (layer_id,))
-        rows = cur.fetchall()
-        db_fields = {row[0]: row[1] for row in rows}
-
-        errors = []
-        for key, value in data.items():
-            if key not in db_fields:
-                errors.append(f"Field '{key}' not defined for layer {layer_id}")
-                continue
-            
-            expected_type = db_fields[key].lower()
-            
-            # Check if it an array type
-            if is_array_type(expected_type):
-                py_type = DATA_TYPE_MAP.get(expected_type)
-                if not py_type:
-                    errors.append(f"Unknown array type '{expected_type}' for field '{key}'")
-                    continue
-                
-                # Validateb list
-                if not isinstance(value, list):
-                    errors.append(f"Field '{key}' expects array (list), got {type(value).__name__}")
-                    continue
-                
-                # Validate array elements
-                element_type = ARRAY_ELEMENT_TYPE_MAP.get(expected_type)
-                if element_type:
-                    element_errors = validate_array_elements(value, element_type, key)
-                    errors.extend(element_errors)
-            else:
-                # Non-array type validation 
-                py_type = DATA_TYPE_MAP.get(expected_type)
-                if not py_type:
-                    errors.append(f"Unknown DB type '{expected_type}' for field '{key}'")
-                    continue
-                
-                # numeric accept int or float
-                if expected_type == "numeric":
-                    if not isinstance(value, (int, float)):
-                        errors.append(f"Field '{key}' expects {expected_type}, got {type(value).__name__}")
-                elif not isinstance(value, py_type):
-                    # allow float with integer value for int fields
-                    if py_type == int and isinstance(value, float) and value.is_integer():
-                        continue
-                    errors.append(f"Field '{key}' expects {expected_type}, got {type(value).__name__}")
+        validator, layer_row = get_layer_context(layer_id)
+
+        errors = validator.validate(data)
 
         # Validate geom
-        cur.execute("SELECT name, geom_type, srid, dataset_id FROM layers WHERE layer_id = %s", (layer_id,))
-        layer_row = cur.fetchone()
         if not layer_row:
             errors.append(f"Layer {layer_id} not found")
         else:
-            layer_name_db, geom_type_db, srid_db, dataset_id = layer_row
-            if geom_type_db.upper() not in VALID_GEOM_TYPES:
-                errors.append(f"Layer geom_type '{geom_type_db}' not supported")
-            if geom.get("type", "").upper() != geom_type_db.upper():
-                errors.append(f"Geometry type mismatch: expected '{geom_type_db}', got '{geom.get('type')}'")
-            if "srid" in geom and geom["srid"] != srid_db:
-                errors.append(f"SRID mismatch: expected {srid_db}, got {geom['srid']}")
+            layer_name_db, geom_type_db, srid_db, dataset_id, dataset_name = layer_row
+            errors.extend(validate_geom(geom, geom_type_db, srid_db))
 
         if errors:
-            cur.close()
-            conn.close()
             return {"statusCode": 400, "body": json.dumps({"valid": False, "errors": errors})}
 
-        # query dataset name
-        cur.execute("SELECT name FROM datasets WHERE dataset_id = %s", (dataset_id,))
-        dataset_row = cur.fetchone()
-        if not dataset_row:
-            cur.close()
-            conn.close()
+        if not dataset_name:
             return {"statusCode": 400, "body": json.dumps({"error": f"Dataset {dataset_id} not found"})}
 
-        dataset_name = dataset_row[0]
         workspace_name = dataset_name.lower().replace(" ", "_")
         layer_name_xml = layer_name_db.lower().replace(" ", "_")  
 
         # สร้าง XML WFS-T Insert
-        geom_type_gml = to_pascal_case(geom["type"])
-        attributes_json = json.dumps(data)
-
-        geom_gml_xml = generate_gml(geom["type"], geom.get("coordinates"), srid_db)
-        print(geom_gml_xml)
-
-        xml_data = f"""<?xml version="1.0" encoding="UTF-8"?>
-<wfs:Transaction service="WFS" version="1.0.0"
-    xmlns:wfs="http://www.opengis.net/wfs"
-    xmlns:gml="http://www.opengis.net/gml"
-    xmlns:{workspace_name}="http://{workspace_name}"
-    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-    xsi:schemaLocation="http://www.opengis.net/wfs
-        http://schemas.opengis.net/wfs/1.0.0/wfs.xsd
-        http://www.opengis.net/gml
-        http://schemas.opengis.net/gml/3.1.1/base/gml.xsd
-        {GEOSERVER_URL}/wfs/DescribeFeatureType?typename={workspace_name}:{layer_name_xml}">
-
-  <wfs:Insert>
-    <{workspace_name}:{layer_name_xml}>
-      <{workspace_name}:layer_id>{layer_id}</{workspace_name}:layer_id>
-      <{workspace_name}:attributes>{escape(attributes_json)}</{workspace_name}:attributes>
-      <{workspace_name}:geom>
-        {geom_gml_xml}
-      </{workspace_name}:geom>
-    </{workspace_name}:{layer_name_xml}>
-  </wfs:Insert>
-</wfs:Transaction>"""
-
-        cur.close()
-        conn.close()
+        try:
+            geom_gml = geometry.to_gml(geom["type"], geom.get("coordinates"), srid_db)
+        except (TypeError, ValueError, IndexError) as e:
+            return {"statusCode": 400, "body": json.dumps({"valid": False, "errors": [f"Invalid coordinates: {e}"]})}
+        insert_xml = build_insert(workspace_name, layer_name_xml, layer_id, data, geom_gml)
+        xml_data = build_transaction(workspace_name, layer_name_xml, [insert_xml])
         print(workspace_name, layer_name_xml)
 
         # ส่งไป GeoServer
-        response = requests.post(
-            f'{GEOSERVER_URL}/wfs',
-            data=xml_data,
-            headers={"Content-Type": "text/xml"},
-            auth=(GEOSERVER_USER, GEOSERVER_PASSWORD)
-        )
-        
-        root = ET.fromstring(response.text)
-        ns = {
-            "wfs": "http://www.opengis.net/wfs",
-            "ogc": "http://www.opengis.net/ogc"
-        }
-
-        feature_id_elem = root.find(".//wfs:InsertResult/ogc:FeatureId", ns)
+        fids, error = send_transaction(xml_data)
 
-        if feature_id_elem is not None:
-            fid = feature_id_elem.get("fid")
+        if fids:
             success = True
             message = f"Feature inserted successfully"
+            record_wfs_ingest(layer_id)
         else:
             success = False
-            message = f"Insert failed: {response.text}"
+            message = error
 
         result = {
             "success": success,
@@ -402,4 +528,4 @@ def lambda_handler(event, context):
         import traceback
         print(f"Error: {str(e)}")
         print(traceback.format_exc())
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
\ No newline at end of file
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
@@ -0,0 +1,241 @@
+"""Layer provisioning shared by createLayer and the bulk createLayers endpoint.
+
+The DB side (layer rows, partitions, fields, indexes, typed tables) runs on the
+caller's cursor, so every layer of a request commits or rolls back together.
+GeoServer featuretypes are published after the commit, in parallel.
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extras import execute_values
+
+import geoserver
+from field_types import DATA_TYPE_MAP
+from geometry import WKB_TYPE_CODES
+from layer_sql import (STORAGE_MODES, build_typed_table, build_view_select, field_index_sql,
+                       is_array_type, is_indexable_type, typed_table_name)
+
+# Monthly measurement partitions created ahead of time for a new layer
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 2))
+
+# Featuretype POSTs in flight at once, GeoServer serializes catalog writes anyway
+PUBLISH_CONCURRENCY = int(os.environ.get('PUBLISH_CONCURRENCY', 8))
+
+PUBLISHED_STATUS_CODES = [200, 201, 202]
+
+# Field names, types, geom_type and srid end up unquoted in view, index, table and trigger DDL
+FIELD_NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]{0,62}$')
+# Columns every layer view already has
+RESERVED_FIELD_NAMES = {'id', 'geom', 'timestamp'}
+
+
+def normalize_name(name):
+    return name.lower().replace(" ", "_")
+
+
+def parse_layer(body):
+    """Layer definition with defaults applied, ValueError when it is invalid"""
+    layer_name = body.get("layer_name")
+    fields = body.get("fields") or []
+    storage_mode = body.get("storage_mode", "jsonb")
+
+    if not layer_name:
+        raise ValueError("layer_name is required")
+
+    if storage_mode not in STORAGE_MODES:
+        raise ValueError(f"storage_mode must be one of {STORAGE_MODES}")
+    if storage_mode == "typed" and not fields:
+        raise ValueError("storage_mode 'typed' needs a field schema, use 'jsonb' for schemaless layers")
+
+    geom_type = str(body.get("geom_type", "POINT")).upper()
+    if geom_type not in WKB_TYPE_CODES:
+        raise ValueError(f"geom_type must be one of {list(WKB_TYPE_CODES)}")
+    try:
+        srid = int(body.get("srid", 4326))
+    except (TypeError, ValueError):
+        raise ValueError("srid must be an integer")
+
+    # Validate fields
+    seen = set()
+    for f in fields:
+        if "field_name" not in f or "data_type" not in f:
+            raise ValueError("Each field must have 'field_name' and 'data_type'")
+        if not isinstance(f["field_name"], str) or not FIELD_NAME_PATTERN.match(f["field_name"]):
+            raise ValueError(f"Field name {f['field_name']!r} must be letters, digits and underscores "
+                             f"(up to 63, not starting with a digit)")
+        # Unquoted identifiers fold to lower case, Temp and temp would be the same column
+        if f["field_name"].lower() in RESERVED_FIELD_NAMES or f["field_name"].lower() in seen:
+            raise ValueError(f"Field name '{f['field_name']}' is reserved or used twice")
+        seen.add(f["field_name"].lower())
+        if not isinstance(f["data_type"], str) or f["data_type"].lower() not in DATA_TYPE_MAP:
+            raise ValueError(f"Field '{f['field_name']}' data_type must be one of {list(DATA_TYPE_MAP)}")
+        if f.get("indexed") and (is_array_type(f["data_type"]) or not is_indexable_type(f["data_type"])):
+            raise ValueError(f"Field '{f['field_name']}' of type {f['data_type']} cannot be indexed")
+
+    if not fields:
+        raise ValueError("No fields defined for this layer")
+
+    return {
+        "layer_name": layer_name,
+        "name": normalize_name(layer_name),
+        "title": body.get("title", layer_name),
+        "srid": srid,
+        "geom_type": geom_type,
+        "storage_mode": storage_mode,
+        "fields": fields,
+        "field_rows": [(f["field_name"], f["data_type"]) for f in fields],
+    }
+
+
+def insert_layers(cur, dataset_id, layers):
+    """Create the DB side of parsed layers of one dataset
+
+    Layers and fields are inserted with one execute_values each, then the
+    partitions, expression indexes and typed tables of every layer go out as
+    one batch. Sets layer_id, indexes and view_sql on each layer and returns
+    the dataset workspace name, or None (nothing inserted) when the dataset
+    does not exist.
+    """
+    rows = execute_values(cur, """
+        INSERT INTO layers (dataset_id, name, geom_type, srid, description, storage_mode)
+        SELECT d.dataset_id, v.name, v.geom_type, v.srid, v.description, v.storage_mode
+        FROM (VALUES %s) AS v(dataset_id, name, geom_type, srid, description, storage_mode)
+        JOIN datasets d ON d.dataset_id = v.dataset_id
+        RETURNING layer_id, name, (SELECT name FROM datasets WHERE dataset_id = layers.dataset_id)
+    """, [
+        (dataset_id, layer["name"], layer["geom_type"], layer["srid"], layer["title"], layer["storage_mode"])
+        for layer in layers
+    ], template="(%s::int, %s, %s, %s::int, %s, %s)", page_size=len(layers), fetch=True)
+    if not rows:
+        return None
+
+    # RETURNING order is not guaranteed, names are unique within a request
+    layer_ids = {name: layer_id for layer_id, name, _ in rows}
+    workspace = normalize_name(rows[0][2])
+    for layer in layers:
+        layer["layer_id"] = layer_ids[layer["name"]]
+        layer["view_sql"] = build_view_select(layer["layer_id"], layer["field_rows"])
+        layer["indexes"] = []
+
+    execute_values(cur, """
+        INSERT INTO fields (layer_id, field_name, data_type, unit, description, indexed)
+        VALUES %s
+    """, [
+        (layer["layer_id"], f["field_name"], f["data_type"], f.get("unit"), f.get("description"), bool(f.get("indexed")))
+        for layer in layers for f in layer["fields"]
+    ], page_size=1000)
+
+    # measurements_l{layer_id} + monthly partitions first, indexes and triggers attach to them
+    statements = [cur.mogrify(
+        "SELECT maintain_layer_partitions(layer_id, %s) FROM unnest(%s::int[]) AS layer_id",
+        (PARTITION_MONTHS_AHEAD, [layer["layer_id"] for layer in layers])
+    ).decode()]
+    for layer in layers:
+        # Expression index matching the view column, so CQL filters on it avoid a seq scan
+        for f in layer["fields"]:
+            if f.get("indexed"):
+                index_sql, index_name = field_index_sql(layer["layer_id"], f["field_name"], f["data_type"])
+                statements.append(index_sql)
+                layer["indexes"].append(index_name)
+
+        # Typed storage: layer_{layer_id} with native columns, synced by trigger and published as a plain table
+        if layer["storage_mode"] == "typed":
+            indexed_fields = {f["field_name"] for f in layer["fields"] if f.get("indexed")}
+            statements += build_typed_table(layer["layer_id"], layer["field_rows"], layer["geom_type"],
+                                            layer["srid"], indexed_fields)
+
+    cur.execute(";\n".join(s.strip().rstrip(";") for s in statements))
+    return workspace
+
+
+def featuretype_xml(layer):
+    """(master, view) featuretype XML of an inserted layer"""
+    name, title, srid = layer["name"], layer["title"], layer["srid"]
+    xml_master = f"""<?xml version="1.0" encoding="UTF-8"?>
+<featureType>
+    <name>{name}</name>
+    <nativeName>measurements</nativeName>
+    <title>{title}</title>
+    <srs>EPSG:{srid}</srs>
+    <enabled>true</enabled>
+</featureType>
+"""
+
+    if layer["storage_mode"] == "typed":
+        xml_view = f"""<?xml version="1.0" encoding="UTF-8"?>
+<featureType>
+    <name>{name}_view</name>
+    <nativeName>{typed_table_name(layer["layer_id"])}</nativeName>
+    <title>{title} (View)</title>
+    <srs>EPSG:{srid}</srs>
+    <enabled>true</enabled>
+</featureType>
+"""
+    else:
+        # Build Virtual View XML
+        xml_view = f"""<?xml version="1.0" encoding="UTF-8"?>
+<featureType>
+    <name>{name}_view</name>
+    <title>{title} (View)</title>
+    <srs>EPSG:{srid}</srs>
+    <enabled>true</enabled>
+    <metadata>
+        <entry key="JDBC_VIRTUAL_TABLE">
+            <virtualTable>
+                <name>{name}_view</name>
+                <sql>{layer["view_sql"]}</sql>
+                <geometry>
+                    <name>geom</name>
+                    <type>{layer["geom_type"].capitalize()}</type>
+                    <srid>{srid}</srid>
+                </geometry>
+            </virtualTable>
+        </entry>
+    </metadata>
+</featureType>
+"""
+    return xml_master, xml_view
+
+
+def publish_featuretype(workspace, datastore_name, xml):
+    """POST a featuretype definition to the layer's datastore"""
+    url = f"/rest/workspaces/{workspace}/datastores/{datastore_name}/featuretypes"
+    headers = {"Content-Type": "application/xml"}
+    return geoserver.post(url, data=xml, headers=headers,
+                          op="POST /rest/workspaces/{workspace}/datastores/{datastore}/featuretypes")
+
+
+def publish_layers(workspace, layers, max_workers=PUBLISH_CONCURRENCY):
+    """Publish master and view featuretypes of every layer, max_workers requests at a time
+
+    Returns one {"master": ..., "view": ...} dict per layer, each value being
+    the GeoServer response or the exception raised by the request.
+    """
+    datastore_name = f"{workspace}_store"
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            {kind: executor.submit(publish_featuretype, workspace, datastore_name, xml)
+             for kind, xml in zip(("master", "view"), featuretype_xml(layer))}
+            for layer in layers
+        ]
+
+    results = []
+    for layer_futures in futures:
+        result = {}
+        for kind, future in layer_futures.items():
+            try:
+                result[kind] = future.result()
+            except Exception as e:
+                result[kind] = e
+        results.append(result)
+    return results
+
+
+def publish_error(result):
+    """Error message of one publish_layers value, None when it was published"""
+    if isinstance(result, Exception):
+        return f"GeoServer request error: {result}"
+    if result.status_code not in PUBLISHED_STATUS_CODES:
+        return f"GeoServer error {result.status_code}: {result.text}"
+    return None
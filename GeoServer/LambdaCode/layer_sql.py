@@ -0,0 +1,180 @@
+"""SQL that projects a layer's JSONB attributes into typed columns.
+
+Shared by createLayer (GeoServer virtual view) and the direct PostGIS read
+path in getFeatures, so both expose exactly the same columns.
+"""
+import hashlib
+
+from field_types import INDEXABLE_TYPES, canonical_type
+
+# PostgreSQL truncates longer identifiers
+MAX_IDENTIFIER_LENGTH = 63
+
+
+# jsonb: view re-parses measurements.attributes on every read (works without a field schema)
+# typed: layer_{layer_id} table with native columns, kept in sync by a trigger on the layer partition
+STORAGE_MODES = ['jsonb', 'typed']
+
+
+def is_array_type(data_type):
+    """Check if data_type is an array type"""
+    data_type_lower = data_type.lower()
+    return data_type_lower.endswith('[]') or data_type_lower.startswith('_')
+
+
+def get_array_element_type(data_type):
+    """Get the element type from array type"""
+    return canonical_type(data_type) or 'text'
+
+
+def generate_field_sql(field_name, data_type):
+    """Generate SQL for extracting field from JSONB attributes"""
+    data_type_lower = data_type.lower()
+    
+    if is_array_type(data_type_lower):
+        # For array types, GeoServer doesn't natively support PostgreSQL arrays
+        # Convert array to comma-separated string for better compatibility
+        element_type = get_array_element_type(data_type_lower)
+        
+        # Option 1: Convert array to comma-separated string (RECOMMENDED for GeoServer)
+        # This makes the field readable as TEXT in GeoServer
+        sql = f"""array_to_string(
+                ARRAY(
+                    SELECT jsonb_array_elements_text(attributes->'{field_name}')
+                ), ', ') AS {field_name}"""
+        
+        # Option 2: Keep as array but cast to text for GeoServer compatibility
+        # Uncomment below if you want to keep array notation like {{val1,val2}}
+        # sql = f"""ARRAY(
+        #     SELECT jsonb_array_elements_text(attributes->'{field_name}')
+        # )::{data_type}::text AS {field_name}"""
+        
+    else:
+        # Non-array types (original logic)
+        sql = f"{field_expression(field_name, data_type)} AS {field_name}"
+    
+    return sql
+
+
+def field_expression(field_name, data_type):
+    """Typed expression of a scalar field, shared by the views and their indexes"""
+    return f"(attributes->>'{field_name}')::{data_type}"
+
+
+def is_indexable_type(data_type):
+    return data_type.lower() in INDEXABLE_TYPES
+
+
+def index_name(table, field_name):
+    """idx_{table}_{field} within the identifier limit
+
+    A name that would be truncated is cut shorter and suffixed with a hash of
+    the full field name, so fields sharing a long prefix get distinct indexes.
+    """
+    name = f"idx_{table}_{field_name.lower()}"
+    if len(name) <= MAX_IDENTIFIER_LENGTH:
+        return name
+    digest = hashlib.md5(field_name.encode()).hexdigest()[:8]
+    return f"{name[:MAX_IDENTIFIER_LENGTH - 9]}_{digest}"
+
+
+def field_index_sql(layer_id, field_name, data_type):
+    """CREATE INDEX on the layer's measurement partition matching the view expression
+
+    The index lives on measurements_l{layer_id}, which holds only that layer's rows,
+    so it is the partitioned equivalent of a partial index WHERE layer_id = N and is
+    inherited by every monthly partition.
+    """
+    name = index_name(f"measurements_l{layer_id}", field_name)
+    return (f"CREATE INDEX IF NOT EXISTS {name} "
+            f"ON measurements_l{layer_id} (({field_expression(field_name, data_type)}));"), name
+
+
+def build_view_select(layer_id, field_rows):
+    """SELECT used for the {layer}_view virtual table of a layer"""
+    field_sql_complete = ",\n           ".join(
+        generate_field_sql(field_name, data_type) for field_name, data_type in field_rows
+    )
+    return f"""
+    SELECT measure_id AS id,
+           {field_sql_complete},
+           geom,
+           timestamp
+    FROM measurements
+    WHERE layer_id = {layer_id}
+    """
+
+
+def typed_table_name(layer_id):
+    return f"layer_{layer_id}"
+
+
+def build_typed_table(layer_id, field_rows, geom_type, srid, indexed_fields=()):
+    """Statements creating the typed table of a layer and the trigger that keeps it in sync
+
+    Columns carry the same names and values as the virtual view (arrays stay the
+    comma-separated text GeoServer can read), so the table can replace the view as is.
+    """
+    table = typed_table_name(layer_id)
+    columns = ",\n        ".join(
+        f"{field_name} {'text' if is_array_type(data_type) else data_type}"
+        for field_name, data_type in field_rows
+    )
+    field_names = [field_name for field_name, _ in field_rows]
+    field_sql = ",\n                   ".join(
+        generate_field_sql(field_name, data_type) for field_name, data_type in field_rows
+    )
+    updates = ",\n                ".join(
+        f"{name} = EXCLUDED.{name}" for name in field_names + ["geom", "timestamp"]
+    )
+
+    statements = [
+        f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        id BIGINT PRIMARY KEY,
+        {columns},
+        geom GEOMETRY({geom_type}, {srid}),
+        timestamp TIMESTAMP NOT NULL
+    )""",
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_geom ON {table} USING GIST (geom)",
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table} (timestamp)",
+    ]
+    statements += [
+        f"CREATE INDEX IF NOT EXISTS {index_name(table, name)} ON {table} ({name})"
+        for name in field_names if name in indexed_fields
+    ]
+    # (SELECT NEW.*) exposes the new row under the measurements column names,
+    # so the projection is exactly the one the view uses
+    statements.append(f"""
+    CREATE OR REPLACE FUNCTION sync_{table}() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM {table} WHERE id = OLD.measure_id;
+            RETURN OLD;
+        END IF;
+        IF TG_OP = 'UPDATE' AND OLD.measure_id <> NEW.measure_id THEN
+            DELETE FROM {table} WHERE id = OLD.measure_id;
+        END IF;
+        INSERT INTO {table} (id, {", ".join(field_names)}, geom, timestamp)
+            SELECT measure_id,
+                   {field_sql},
+                   geom,
+                   timestamp
+            FROM (SELECT NEW.*) AS measurements
+        ON CONFLICT (id) DO UPDATE SET
+                {updates};
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql""")
+    statements += [
+        f"DROP TRIGGER IF EXISTS sync_{table} ON measurements_l{layer_id}",
+        f"""CREATE TRIGGER sync_{table}
+    AFTER INSERT OR UPDATE OR DELETE ON measurements_l{layer_id}
+    FOR EACH ROW EXECUTE FUNCTION sync_{table}()""",
+        # Rows already stored for the layer (converting an existing jsonb layer)
+        f"""
+    INSERT INTO {table} (id, {", ".join(field_names)}, geom, timestamp)
+    {build_view_select(layer_id, field_rows)}
+    ON CONFLICT (id) DO NOTHING""",
+    ]
+    return statements
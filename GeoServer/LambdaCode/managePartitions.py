@@ -0,0 +1,50 @@
+import json
+import os
+
+import db
+
+# Run on a schedule (EventBridge, e.g. daily) so next month's partitions exist before
+# it begins and backfilled months are moved out of the default partitions
+PARTITION_MONTHS_AHEAD = int(os.environ.get('PARTITION_MONTHS_AHEAD', 2))
+
+
+def lambda_handler(event, context):
+    """Ensure measurement partitions for every layer, one short transaction per layer"""
+    try:
+        months_ahead = int((event or {}).get("months_ahead", PARTITION_MONTHS_AHEAD))
+
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT layer_id FROM layers ORDER BY layer_id;")
+                layer_ids = [row[0] for row in cur.fetchall()]
+
+        created = {}
+        errors = {}
+        for layer_id in layer_ids:
+            try:
+                with db.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT maintain_layer_partitions(%s, %s);", (layer_id, months_ahead))
+                        count = cur.fetchone()[0]
+                if count:
+                    created[layer_id] = count
+            except Exception as e:
+                print(f"Partition maintenance failed for layer {layer_id}: {e}")
+                errors[layer_id] = str(e)
+
+        print(f"Partition maintenance: {len(layer_ids)} layers, created {sum(created.values())} partitions, {len(errors)} errors")
+
+        return {
+            "statusCode": 500 if errors else 200,
+            "body": json.dumps({
+                "layers": len(layer_ids),
+                "created": created,
+                "errors": errors
+            })
+        }
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
@@ -0,0 +1,126 @@
+"""COPY writer for measurements, shared by insertFeatures (write_mode "copy") and ingestConsumer.
+
+Rows are (layer_id, attributes, ewkb_hex, record_key, timestamp) and are
+upserted on (layer_id, record_key, timestamp): a resent record updates the
+stored row when its attributes or geometry changed and is skipped otherwise,
+so retries and re-ingests add no duplicates. Rows sent without a record_key
+are keyed by their content (content_key).
+"""
+import csv
+import hashlib
+import io
+import json
+from datetime import datetime, timezone
+
+from psycopg2.extras import execute_values
+
+import response_cache
+
+UPSERT_TABLE = "measurement_upsert"
+
+
+def parse_timestamp(value):
+    """ISO 8601 string to a naive UTC datetime (measurements.timestamp has no time zone)"""
+    if not isinstance(value, str) or not value:
+        raise ValueError("timestamp must be an ISO 8601 string")
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def content_key(layer_id, attributes, ewkb, ts):
+    """record_key of a row sent without one: sha256 of layer, canonical attributes, EWKB and timestamp"""
+    canonical = json.dumps(
+        [int(layer_id), attributes, ewkb.upper() if ewkb else None, ts.isoformat() if ts is not None else None],
+        sort_keys=True, separators=(",", ":")
+    )
+    return "sha256:" + hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _csv(rows, columns):
+    """CSV for COPY of the first columns of each row, attributes as JSON"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        layer_id, attributes, ewkb, record_key, ts = row
+        writer.writerow([layer_id, json.dumps(attributes), ewkb, record_key,
+                         ts.isoformat() if ts is not None else None][:columns])
+    buf.seek(0)
+    return buf
+
+
+def _upsert(cur, rows):
+    """COPY into a session temp table, then one INSERT ... ON CONFLICT into measurements"""
+    cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {UPSERT_TABLE} (
+            seq BIGSERIAL,
+            layer_id INTEGER,
+            attributes TEXT,
+            geom TEXT,
+            record_key TEXT,
+            ts TIMESTAMP
+        ) ON COMMIT DELETE ROWS;
+    """)
+    cur.copy_expert(
+        f"COPY {UPSERT_TABLE} (layer_id, attributes, geom, record_key, ts) FROM STDIN WITH (FORMAT csv)",
+        _csv(rows, 5)
+    )
+    # The same record twice in one batch would hit ON CONFLICT twice, keep the last one sent
+    cur.execute(f"""
+        INSERT INTO measurements (layer_id, attributes, geom, record_key, timestamp)
+        SELECT DISTINCT ON (layer_id, COALESCE(record_key, seq::text), ts)
+               layer_id, attributes::jsonb, geom::geometry, record_key, COALESCE(ts, NOW()::timestamp)
+        FROM {UPSERT_TABLE}
+        ORDER BY layer_id, COALESCE(record_key, seq::text), ts, seq DESC
+        ON CONFLICT (layer_id, record_key, timestamp) DO UPDATE
+            SET attributes = EXCLUDED.attributes, geom = EXCLUDED.geom
+            WHERE measurements.attributes IS DISTINCT FROM EXCLUDED.attributes
+               OR measurements.geom::text IS DISTINCT FROM EXCLUDED.geom::text;
+    """)
+    return cur.rowcount
+
+
+def write_measurements(cur, rows):
+    """Write rows in the caller's transaction, returns how many were inserted or changed
+
+    Bumps data_version (response cache) and marks rollups dirty over the days
+    the rows fall on, only for layers that actually changed.
+    """
+    rows = [tuple(row) + (None,) * (5 - len(row)) for row in rows]
+    if not rows:
+        return 0
+
+    rows = [
+        (layer_id, attributes, ewkb,
+         record_key if record_key is not None else content_key(layer_id, attributes, ewkb, ts), ts)
+        for layer_id, attributes, ewkb, record_key, ts in rows
+    ]
+    written = _upsert(cur, rows)
+    if not written:
+        return 0
+
+    # Per layer: earliest and latest record time, None stands for NOW()
+    ranges = {}
+    for layer_id, _, _, _, ts in rows:
+        lo, hi, untimed = ranges.get(layer_id, (None, None, False))
+        if ts is None:
+            untimed = True
+        else:
+            lo = ts if lo is None or ts < lo else lo
+            hi = ts if hi is None or ts > hi else hi
+        ranges[layer_id] = (lo, hi, untimed)
+
+    dirty = []
+    for layer_id, (lo, hi, untimed) in sorted(ranges.items()):
+        if lo is not None:
+            dirty.append((layer_id, lo, hi))
+        if untimed:
+            dirty.append((layer_id, None, None))
+
+    response_cache.bump_layer_version(cur, sorted(ranges))
+    execute_values(cur, """
+        SELECT mark_rollups_dirty(v.layer_id, v.lo, v.hi)
+        FROM (VALUES %s) AS v(layer_id, lo, hi);
+    """, dirty, template="(%s::int, COALESCE(%s::timestamp, NOW()::timestamp), COALESCE(%s::timestamp, NOW()::timestamp))")
+    return written
@@ -0,0 +1,145 @@
+import os
+import time
+from collections import OrderedDict
+
+import db
+from validators import LayerValidator
+
+# Layer/dataset metadata almost never changes, so it is cached per container
+METADATA_CACHE_TTL = float(os.environ.get('METADATA_CACHE_TTL', 300))
+METADATA_CACHE_SIZE = int(os.environ.get('METADATA_CACHE_SIZE', 256))
+
+# TTLCache.get result for a key that is absent or expired
+MISSING = object()
+
+
+class TTLCache:
+    """Small LRU cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def pop_where(self, predicate):
+        """Drop every entry whose value matches predicate"""
+        for key in [k for k, (_, value) in self._data.items() if predicate(value)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+
+_layers = TTLCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+_datasets = TTLCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+
+LAYER_SQL = """
+    SELECT l.layer_id, l.name, l.geom_type, l.srid, l.dataset_id, d.name,
+           COALESCE(
+               json_agg(json_build_array(f.field_name, f.data_type) ORDER BY f.field_id)
+                   FILTER (WHERE f.field_id IS NOT NULL),
+               '[]'::json
+           )
+    FROM layers l
+    LEFT JOIN datasets d ON d.dataset_id = l.dataset_id
+    LEFT JOIN fields f ON f.layer_id = l.layer_id
+    WHERE l.layer_id = %s
+    GROUP BY l.layer_id, d.name
+"""
+
+
+def load_layer(layer_id):
+    """Read one layer with its dataset name and field schema in a single query"""
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(LAYER_SQL, (layer_id,))
+            row = cur.fetchone()
+    if not row:
+        return None
+    fields = {name: data_type for name, data_type in row[6]}
+    return {
+        "layer_id": row[0],
+        "name": row[1],
+        "geom_type": row[2],
+        "srid": row[3],
+        "dataset_id": row[4],
+        "dataset_name": row[5],
+        "fields": fields,
+        "validator": LayerValidator(row[0], fields),
+    }
+
+
+def get_layer(layer_id):
+    """Layer metadata dict (name, geom_type, srid, dataset_id, dataset_name, fields, validator) or None
+
+    Missing layers are not cached so a freshly created layer is visible immediately.
+    """
+    key = str(layer_id)
+    layer = _layers.get(key)
+    if layer is MISSING:
+        layer = load_layer(layer_id)
+        if layer is not None:
+            _layers.set(key, layer)
+            if layer["dataset_name"] is not None:
+                _datasets.set(str(layer["dataset_id"]), layer["dataset_name"])
+    return layer
+
+
+def get_dataset_name(dataset_id):
+    """Dataset name or None"""
+    key = str(dataset_id)
+    name = _datasets.get(key)
+    if name is MISSING:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT name FROM datasets WHERE dataset_id = %s;", (dataset_id,))
+                row = cur.fetchone()
+        name = row[0] if row else None
+        if name is not None:
+            _datasets.set(key, name)
+    return name
+
+
+def invalidate_layer(layer_id):
+    """Drop a layer from the cache, call after its row or fields change"""
+    _layers.pop(str(layer_id))
+
+
+def invalidate_dataset(dataset_id):
+    """Drop a dataset and every cached layer that belongs to it"""
+    key = str(dataset_id)
+    _datasets.pop(key)
+    _layers.pop_where(lambda layer: str(layer["dataset_id"]) == key)
+
+
+def stats():
+    """Hit/miss counters for the layer and dataset caches"""
+    return {"layers": _layers.stats(), "datasets": _datasets.stats()}
@@ -0,0 +1,46 @@
+import json
+import os
+
+import db
+
+# Run on a schedule (EventBridge, e.g. every 5 minutes) so rollups keep up with ingest
+# without getAggregate recomputing them on the read path
+ROLLUP_REFRESH_BATCH = int(os.environ.get('ROLLUP_REFRESH_BATCH', 50))
+
+# Time kept free before the Lambda timeout
+ROLLUP_SHUTDOWN_MARGIN = float(os.environ.get('ROLLUP_SHUTDOWN_MARGIN', 10))
+
+
+def lambda_handler(event, context):
+    """Refresh dirty rollup days of every layer, most recent first, one short transaction per day"""
+    try:
+        batch = int((event or {}).get("batch", ROLLUP_REFRESH_BATCH))
+
+        refreshed = 0
+        while refreshed < batch:
+            if context and context.get_remaining_time_in_millis() < ROLLUP_SHUTDOWN_MARGIN * 1000:
+                break
+            with db.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT refresh_dirty_rollups(NULL, 1);")
+                    if not cur.fetchone()[0]:
+                        break
+            refreshed += 1
+
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM rollup_dirty;")
+                pending = cur.fetchone()[0]
+
+        print(f"Rollup refresh: {refreshed} day(s) refreshed, {pending} pending")
+
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"refreshed": refreshed, "pending": pending})
+        }
+
+    except Exception as e:
+        return {
+            "statusCode": 500,
+            "body": json.dumps({"error": str(e)})
+        }
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import db
+import metadata_cache
+
+try:
+    import redis
+except ImportError:  # redis is optional, the disk tier is used without it
+    redis = None
+
+# Cached responses are keyed on the layer data_version, so they go stale exactly
+# when insertFeatures / the Glue jobs bump it. The TTL is only a safety net.
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() != 'false'
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+RESPONSE_CACHE_MEMORY_BYTES = int(os.environ.get('RESPONSE_CACHE_MEMORY_BYTES', 32 * 1024 * 1024))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_BYTES', 2 * 1024 * 1024))
+
+# Second tier: Redis when REDIS_URL is set (eviction is the server's maxmemory-policy,
+# use allkeys-lru), otherwise files under /tmp bounded by RESPONSE_CACHE_DISK_BYTES
+REDIS_URL = os.environ.get('REDIS_URL')
+RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR', '/tmp/response-cache')
+RESPONSE_CACHE_DISK_BYTES = int(os.environ.get('RESPONSE_CACHE_DISK_BYTES', 256 * 1024 * 1024))
+REDIS_PREFIX = 'dataapi:response:'
+
+# data_version per layer is cached in process like the layer metadata, so a read
+# skips the version round trip; ingest in another container shows up within this TTL
+LAYER_VERSION_CACHE_TTL = float(os.environ.get('LAYER_VERSION_CACHE_TTL', metadata_cache.METADATA_CACHE_TTL))
+
+
+class MemoryTier:
+    """LRU of encoded responses bounded by total bytes"""
+
+    name = "memory"
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, payload):
+        self._remove(key)
+        self._data[key] = (time.monotonic() + RESPONSE_CACHE_TTL, payload)
+        self.bytes += len(payload)
+        while self.bytes > self.max_bytes and self._data:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[1])
+
+    def stats(self):
+        return {"entries": len(self._data), "bytes": self.bytes, "evictions": self.evictions}
+
+
+class DiskTier:
+    """LRU of encoded responses in a local directory, recency tracked by mtime"""
+
+    name = "disk"
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = None  # measured lazily on first write
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) < time.time() - RESPONSE_CACHE_TTL:
+                return None
+            with open(path, 'rb') as f:
+                payload = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return payload
+
+    def set(self, key, payload):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.bytes is None:
+            self.bytes = sum(size for _, size, _ in self._entries())
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        try:
+            self.bytes -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+        self.bytes += len(payload)
+        if self.bytes > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """Drop least recently used files until under 90% of the budget"""
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(self._entries()):
+            if self.bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {"bytes": self.bytes, "evictions": self.evictions}
+
+
+class RedisTier:
+    """Shared tier on a Redis-compatible server"""
+
+    name = "redis"
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.errors = 0
+
+    def get(self, key):
+        try:
+            return self.client.get(REDIS_PREFIX + key)
+        except redis.RedisError:
+            self.errors += 1
+            return None
+
+    def set(self, key, payload):
+        try:
+            self.client.set(REDIS_PREFIX + key, payload, ex=RESPONSE_CACHE_TTL)
+        except redis.RedisError:
+            self.errors += 1
+
+    def stats(self):
+        return {"errors": self.errors}
+
+
+_memory = MemoryTier(RESPONSE_CACHE_MEMORY_BYTES)
+_shared = RedisTier(REDIS_URL) if REDIS_URL and redis is not None else DiskTier(RESPONSE_CACHE_DIR, RESPONSE_CACHE_DISK_BYTES)
+
+_versions = metadata_cache.TTLCache(metadata_cache.METADATA_CACHE_SIZE, LAYER_VERSION_CACHE_TTL)
+
+_counters = {"hits": 0, "misses": 0, "bytes_saved": 0, "memory_hits": 0, "shared_hits": 0}
+
+
+def layer_version(layer_id):
+    """data_version of a layer (bumped on every ingest), None if the layer is gone
+
+    Missing layers are not cached, same as metadata_cache.get_layer.
+    """
+    key = str(layer_id)
+    version = _versions.get(key)
+    if version is metadata_cache.MISSING:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT data_version FROM layers WHERE layer_id = %s;", (layer_id,))
+                row = cur.fetchone()
+        version = row[0] if row else None
+        if version is not None:
+            _versions.set(key, version)
+    return version
+
+
+def bump_layer_version(cur, layer_ids):
+    """Invalidate cached responses of the given layers, run inside the ingest transaction
+
+    Only this container's cached versions are dropped, others catch up within LAYER_VERSION_CACHE_TTL.
+    """
+    cur.execute(
+        "UPDATE layers SET data_version = data_version + 1 WHERE layer_id = ANY(%s);",
+        ([int(layer_id) for layer_id in layer_ids],)
+    )
+    for layer_id in layer_ids:
+        _versions.pop(str(layer_id))
+
+
+def make_key(kind, layer_id, query, version, encoding):
+    """Cache key for (layer_id, normalized query, layer_version) plus the response encoding"""
+    raw = json.dumps([kind, str(layer_id), query, version, encoding], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _metric(result, tier, size):
+    print(json.dumps({"metric": "response_cache", "result": result, "tier": tier, "bytes": size}))
+
+
+def get(key):
+    """Cached Lambda response for key or None, marked with X-Cache: HIT"""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+
+    tier = _memory.name
+    payload = _memory.get(key)
+    if payload is None:
+        tier = _shared.name
+        payload = _shared.get(key)
+        if payload is not None:
+            _memory.set(key, payload)
+
+    if payload is None:
+        _counters["misses"] += 1
+        _metric("miss", None, 0)
+        return None
+
+    _counters["hits"] += 1
+    _counters["memory_hits" if tier == _memory.name else "shared_hits"] += 1
+    _counters["bytes_saved"] += len(payload)
+    _metric("hit", tier, len(payload))
+
+    response = json.loads(payload)
+    response.setdefault("headers", {})["X-Cache"] = "HIT"
+    return response
+
+
+def put(key, response):
+    """Store a 200 response in both tiers; oversized or non-200 responses are skipped"""
+    response.setdefault("headers", {})["X-Cache"] = "MISS"
+    if not RESPONSE_CACHE_ENABLED or response.get("statusCode") != 200:
+        return response
+
+    payload = json.dumps(response).encode()
+    if len(payload) > RESPONSE_CACHE_MAX_ENTRY_BYTES:
+        return response
+    _memory.set(key, payload)
+    try:
+        _shared.set(key, payload)
+    except OSError as e:
+        print(f"Response cache write failed: {e}")
+    return response
+
+
+def stats():
+    """Hit ratio, bytes saved and per-tier usage for this container"""
+    lookups = _counters["hits"] + _counters["misses"]
+    report = dict(_counters)
+    report["hit_ratio"] = round(_counters["hits"] / lookups, 3) if lookups else None
+    report[_memory.name] = _memory.stats()
+    report[_shared.name] = _shared.stats()
+    report["versions"] = _versions.stats()
+    return report
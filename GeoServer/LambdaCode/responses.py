@@ -0,0 +1,197 @@
+"""Compressed Lambda proxy responses for large bodies (getFeatures, getTiles, getAggregate).
+
+The body is not streamed to the client: API Gateway proxy integrations and the
+Python runtime return one complete response. Chunks are compressed as they
+arrive and only the compressed bytes are buffered (memory, then /tmp). A body
+that is still above MAX_INLINE_BYTES is uploaded to RESULT_BUCKET and answered
+with a 303 to a presigned URL, or a 413 when no bucket is configured.
+"""
+import base64
+import json
+import os
+import tempfile
+import uuid
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Lambda proxy responses are capped at 6 MB and binary bodies are base64 encoded (+33%)
+MAX_INLINE_BYTES = int(os.environ.get('MAX_INLINE_BYTES', 4 * 1024 * 1024))
+
+# Oversized results go to S3 (or an S3-compatible store via RESULT_ENDPOINT_URL)
+RESULT_BUCKET = os.environ.get('RESULT_BUCKET')
+RESULT_PREFIX = os.environ.get('RESULT_PREFIX', 'results/')
+RESULT_ENDPOINT_URL = os.environ.get('RESULT_ENDPOINT_URL')
+RESULT_URL_TTL = int(os.environ.get('RESULT_URL_TTL', 900))
+
+STREAM_CHUNK_SIZE = 64 * 1024
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+_s3 = None
+
+
+def get_header(event, name):
+    """Case-insensitive request header lookup"""
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def negotiate_encoding(event):
+    """Pick 'br', 'gzip' or None from the request Accept-Encoding header"""
+    accept = get_header(event, 'accept-encoding') or ''
+    offered = {}
+    for token in accept.split(','):
+        parts = token.strip().split(';')
+        coding = parts[0].strip().lower()
+        q = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if coding:
+            offered[coding] = q
+
+    def accepted(coding):
+        return offered.get(coding, offered.get('*', 0.0)) > 0
+
+    if brotli is not None and accepted('br'):
+        return 'br'
+    if accepted('gzip'):
+        return 'gzip'
+    return None
+
+
+class StreamCompressor:
+    """Incremental compressor for one response body"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31 = gzip container
+        else:
+            self._compressor = None
+
+    def compress(self, chunk):
+        if self._compressor is None:
+            return chunk
+        if self.encoding == 'br':
+            return self._compressor.process(chunk)
+        return self._compressor.compress(chunk)
+
+    def flush(self):
+        if self._compressor is None:
+            return b''
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def encode_stream(chunks, encoding):
+    """Compress an iterable of byte chunks into a spooled temp file
+
+    Only the compressed output is held, in memory up to MAX_INLINE_BYTES and
+    on /tmp beyond that. Returns (file positioned at 0, compressed size, raw size).
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=MAX_INLINE_BYTES)
+    compressor = StreamCompressor(encoding)
+    raw_size = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        raw_size += len(chunk)
+        body.write(compressor.compress(chunk))
+    body.write(compressor.flush())
+    size = body.tell()
+    body.seek(0)
+    return body, size, raw_size
+
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        import boto3
+        _s3 = boto3.client('s3', endpoint_url=RESULT_ENDPOINT_URL)
+    return _s3
+
+
+def store_result(body, content_type, encoding):
+    """Upload an encoded body and return a presigned GET URL for it"""
+    key = f"{RESULT_PREFIX}{uuid.uuid4().hex}"
+    extra_args = {"ContentType": content_type}
+    if encoding:
+        extra_args["ContentEncoding"] = encoding
+    get_s3().upload_fileobj(body, RESULT_BUCKET, key, ExtraArgs=extra_args)
+    return get_s3().generate_presigned_url(
+        'get_object',
+        Params={"Bucket": RESULT_BUCKET, "Key": key},
+        ExpiresIn=RESULT_URL_TTL
+    )
+
+
+def build_response(event, chunks, content_type='application/json', status_code=200, headers=None):
+    """Lambda proxy response for a chunked body, compressed per Accept-Encoding and buffered
+
+    Bodies still larger than MAX_INLINE_BYTES after compression are stored via
+    store_result and answered with a 303 pointing at the presigned URL.
+    """
+    encoding = negotiate_encoding(event)
+    body, size, raw_size = encode_stream(chunks, encoding)
+    print(f"Response body: {raw_size} bytes raw, {size} bytes encoded ({encoding or 'identity'})")
+
+    response_headers = {"Content-Type": content_type, "Vary": "Accept-Encoding"}
+    response_headers.update(headers or {})
+
+    try:
+        if size > MAX_INLINE_BYTES:
+            if not RESULT_BUCKET:
+                return {
+                    "statusCode": 413,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": json.dumps({"error": f"Result is {size} bytes, above the {MAX_INLINE_BYTES} byte response limit; narrow the query or page through it"})
+                }
+            url = store_result(body, content_type, encoding)
+            response_headers.update({"Content-Type": "application/json", "Location": url})
+            return {
+                "statusCode": 303,
+                "headers": response_headers,
+                "body": json.dumps({"url": url, "expires_in": RESULT_URL_TTL, "size": size})
+            }
+
+        data = body.read()
+    finally:
+        body.close()
+
+    if encoding:
+        response_headers["Content-Encoding"] = encoding
+        return {
+            "statusCode": status_code,
+            "headers": response_headers,
+            "isBase64Encoded": True,
+            "body": base64.b64encode(data).decode('ascii')
+        }
+
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        return {
+            "statusCode": status_code,
+            "headers": response_headers,
+            "isBase64Encoded": True,
+            "body": base64.b64encode(data).decode('ascii')
+        }
+    return {"statusCode": status_code, "headers": response_headers, "body": text}
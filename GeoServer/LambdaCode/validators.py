@@ -0,0 +1,124 @@
+"""Attribute validation against a layer's field schema.
+
+The field schema from the fields table is compiled once into a
+LayerValidator (cached with the layer metadata), so validating a feature is
+a dict lookup plus one specialised check per key.
+"""
+from field_types import ARRAY_ELEMENT_TYPE_MAP, DATA_TYPE_MAP, canonical_type
+
+# Element types accepted without a per-element check (None = NULL element)
+_NONE_TYPE = type(None)
+FAST_ELEMENT_TYPES = {
+    int: frozenset((int, bool, _NONE_TYPE)),
+    float: frozenset((int, float, bool, _NONE_TYPE)),
+    str: frozenset((str, _NONE_TYPE)),
+}
+
+
+def is_array_type(data_type):
+    """Check if data_type is an array type"""
+    data_type_lower = data_type.lower()
+    return data_type_lower.endswith('[]') or data_type_lower.startswith('_')
+
+def validate_array_elements(array_value, element_type, field_name):
+    """Validate all elements in array match expected type"""
+    errors = []
+    if not isinstance(array_value, list):
+        errors.append(f"Field '{field_name}' expects array (list), got {type(array_value).__name__}")
+        return errors
+
+    for idx, elem in enumerate(array_value):
+        if elem is None:
+            continue  # NULL values allowed in arrays
+
+        if element_type == int:
+            if not isinstance(elem, int):
+                # Allow float
+                if isinstance(elem, float) and elem.is_integer():
+                    continue
+                errors.append(f"Field '{field_name}[{idx}]' expects int, got {type(elem).__name__}: {elem}")
+        elif element_type == float:
+            if not isinstance(elem, (int, float)):
+                errors.append(f"Field '{field_name}[{idx}]' expects number, got {type(elem).__name__}: {elem}")
+        elif element_type == str:
+            if not isinstance(elem, str):
+                errors.append(f"Field '{field_name}[{idx}]' expects string, got {type(elem).__name__}: {elem}")
+        else:
+            if not isinstance(elem, element_type):
+                errors.append(f"Field '{field_name}[{idx}]' expects {element_type.__name__}, got {type(elem).__name__}: {elem}")
+
+    return errors
+
+
+def compile_field(field_name, data_type):
+    """Build a check(value, errors) function specialised for one field"""
+    expected_type = data_type.lower()
+
+    if is_array_type(expected_type):
+        if not DATA_TYPE_MAP.get(expected_type):
+            unknown = f"Unknown array type '{expected_type}' for field '{field_name}'"
+            return lambda value, errors: errors.append(unknown)
+
+        element_type = ARRAY_ELEMENT_TYPE_MAP.get(expected_type)
+        fast_types = FAST_ELEMENT_TYPES.get(element_type)
+
+        def check_array(value, errors):
+            if not isinstance(value, list):
+                errors.append(f"Field '{field_name}' expects array (list), got {type(value).__name__}")
+                return
+            if element_type is None:
+                return
+            # Whole-array type check runs in C; per-element messages only when it fails
+            if fast_types is not None and fast_types.issuperset(map(type, value)):
+                return
+            errors.extend(validate_array_elements(value, element_type, field_name))
+        return check_array
+
+    py_type = DATA_TYPE_MAP.get(expected_type)
+    if not py_type:
+        unknown = f"Unknown DB type '{expected_type}' for field '{field_name}'"
+        return lambda value, errors: errors.append(unknown)
+
+    if canonical_type(expected_type) == "numeric":
+        # numeric accept int or float
+        def check_numeric(value, errors):
+            if not isinstance(value, (int, float)):
+                errors.append(f"Field '{field_name}' expects {expected_type}, got {type(value).__name__}")
+        return check_numeric
+
+    if py_type == int:
+        # allow float with integer value for int fields
+        def check_int(value, errors):
+            if not isinstance(value, int) and not (isinstance(value, float) and value.is_integer()):
+                errors.append(f"Field '{field_name}' expects {expected_type}, got {type(value).__name__}")
+        return check_int
+
+    def check_type(value, errors):
+        if not isinstance(value, py_type):
+            errors.append(f"Field '{field_name}' expects {expected_type}, got {type(value).__name__}")
+    return check_type
+
+
+class LayerValidator:
+    """Attribute checks for one layer, compiled once from its {field_name: data_type} schema"""
+
+    def __init__(self, layer_id, fields):
+        self.layer_id = layer_id
+        self._checks = {name: compile_field(name, data_type) for name, data_type in fields.items()}
+
+    def validate(self, data):
+        """Return the list of error messages for one feature's attributes"""
+        errors = []
+        checks = self._checks
+        for key, value in data.items():
+            check = checks.get(key)
+            if check is None:
+                errors.append(f"Field '{key}' not defined for layer {self.layer_id}")
+            else:
+                check(value, errors)
+        return errors
+
+    def validate_many(self, items):
+        """Validate a batch of attribute dicts, one error list per item"""
+        validate = self.validate
+        return [validate(data) for data in items]
@@ -31,7 +31,9 @@ CREATE TABLE layers (
     geom_type TEXT CHECK (geom_type IN ('POINT','LINESTRING','POLYGON','MULTIPOINT','MULTILINESTRING','MULTIPOLYGON')),
     srid INTEGER DEFAULT 4326,
     description TEXT,
-    created_at TIMESTAMP DEFAULT NOW()
+    created_at TIMESTAMP DEFAULT NOW(),
+    data_version BIGINT NOT NULL DEFAULT 0,  -- bump ทุกครั้งที่มี measurement ใหม่ (ใช้ invalidate response cache)
+    storage_mode TEXT NOT NULL DEFAULT 'jsonb' CHECK (storage_mode IN ('jsonb','typed'))  -- typed = ตาราง layer_{layer_id}
 );
 
 --  5. Fields Table (อธิบาย schema ของ layer)
@@ -41,18 +43,25 @@ CREATE TABLE fields (
     field_name TEXT NOT NULL,
     data_type TEXT,
     unit TEXT,
-    description TEXT
+    description TEXT,
+    indexed BOOLEAN NOT NULL DEFAULT FALSE  -- createLayer สร้าง expression index ให้ field นี้
 );
 
 --  6. Measurements Table (เก็บข้อมูลจริง)
+--  Partitioned by layer (LIST) and then by month (RANGE), so the "WHERE layer_id = N"
+--  of every layer view and any time filter only touch the matching partitions
 CREATE TABLE measurements (
-    measure_id BIGSERIAL PRIMARY KEY,
-    layer_id INTEGER REFERENCES layers(layer_id) ON DELETE CASCADE,
+    measure_id BIGSERIAL,
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
     attributes JSONB,  -- flexible schema per dataset
     geom GEOMETRY,
-    timestamp TIMESTAMP DEFAULT NOW(),
-    created_by INTEGER REFERENCES users(user_id)
-);
+    timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
+    created_by INTEGER REFERENCES users(user_id),
+    record_key TEXT,  -- source record identity (Glue: device + timestamp hash, insertFeatures: record_id)
+    PRIMARY KEY (measure_id, layer_id, timestamp)  -- must contain the partition keys
+) PARTITION BY LIST (layer_id);
+
+CREATE TABLE measurements_default PARTITION OF measurements DEFAULT;
 
 --  7. Metadata Records (รายละเอียดเสริม)
 CREATE TABLE metadata_records (
@@ -66,6 +75,281 @@ CREATE TABLE metadata_records (
 CREATE INDEX idx_measurements_geom ON measurements USING GIST (geom);
 CREATE INDEX idx_measurements_layer ON measurements (layer_id);
 CREATE INDEX idx_measurements_time ON measurements (timestamp);
+--  Dedup key for upserts (ON CONFLICT (layer_id, record_key, timestamp)); rows without a
+--  record_key never conflict. timestamp is part of it because unique indexes on a
+--  partitioned table must contain the partition keys, so it has to come from the record
+CREATE UNIQUE INDEX idx_measurements_record_key ON measurements (layer_id, record_key, timestamp);
+
+--  9. Partition management: measurements -> measurements_l{layer_id} -> measurements_l{layer_id}_yYYYYmMM
+--  Rows without a matching partition land in a default partition and are moved out
+--  when the partition is created (createLayer, managePartitions Lambda)
+CREATE OR REPLACE FUNCTION ensure_layer_partition(p_layer_id INTEGER)
+RETURNS BOOLEAN AS $$
+DECLARE
+    layer_part TEXT := format('measurements_l%s', p_layer_id);
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(layer_part));
+    IF to_regclass(layer_part) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    LOCK TABLE measurements_default IN SHARE ROW EXCLUSIVE MODE;
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE measurements INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)',
+        layer_part);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', layer_part || '_default', layer_part);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM measurements_default WHERE layer_id = %s RETURNING *)
+         INSERT INTO %I SELECT * FROM moved',
+        p_layer_id, layer_part);
+    EXECUTE format('ALTER TABLE measurements ATTACH PARTITION %I FOR VALUES IN (%s)', layer_part, p_layer_id);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_measurement_partition(p_layer_id INTEGER, p_month DATE)
+RETURNS BOOLEAN AS $$
+DECLARE
+    layer_part TEXT := format('measurements_l%s', p_layer_id);
+    month_start DATE := date_trunc('month', p_month)::date;
+    month_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+    part TEXT := format('measurements_l%s_%s', p_layer_id, to_char(p_month, '"y"YYYY"m"MM'));
+    sync_trigger TEXT := format('sync_layer_%s', p_layer_id);
+    has_sync BOOLEAN;
+BEGIN
+    PERFORM ensure_layer_partition(p_layer_id);
+    PERFORM pg_advisory_xact_lock(hashtext(part));
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    EXECUTE format('LOCK TABLE %I IN SHARE ROW EXCLUSIVE MODE', layer_part || '_default');
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', part, layer_part);
+    -- Typed layers: the move must not fire the sync trigger, its DELETE would drop the
+    -- layer_{id} rows and the new partition has no trigger yet to put them back
+    has_sync := EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgrelid = (layer_part || '_default')::regclass AND tgname = sync_trigger);
+    IF has_sync THEN
+        EXECUTE format('ALTER TABLE %I DISABLE TRIGGER %I', layer_part || '_default', sync_trigger);
+    END IF;
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM %I WHERE timestamp >= %L AND timestamp < %L RETURNING *)
+         INSERT INTO %I SELECT * FROM moved',
+        layer_part || '_default', month_start, month_end, part);
+    IF has_sync THEN
+        EXECUTE format('ALTER TABLE %I ENABLE TRIGGER %I', layer_part || '_default', sync_trigger);
+    END IF;
+    EXECUTE format(
+        'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        layer_part, part, month_start, month_end);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Current month + p_months_ahead, plus every month that already has rows in the layer default partition
+CREATE OR REPLACE FUNCTION maintain_layer_partitions(p_layer_id INTEGER, p_months_ahead INTEGER DEFAULT 2)
+RETURNS INTEGER AS $$
+DECLARE
+    months DATE[];
+    backfill DATE[];
+    month DATE;
+    created INTEGER := 0;
+    stored BIGINT;
+    typed BIGINT;
+BEGIN
+    PERFORM ensure_layer_partition(p_layer_id);
+
+    -- Months are collected up front, the loop below alters the partitions being read
+    months := ARRAY(
+        SELECT generate_series(
+            date_trunc('month', NOW()),
+            date_trunc('month', NOW()) + make_interval(months => p_months_ahead),
+            INTERVAL '1 month')::date
+    );
+    EXECUTE format(
+        'SELECT array_agg(DISTINCT date_trunc(''month'', timestamp)::date) FROM %I',
+        format('measurements_l%s_default', p_layer_id))
+    INTO backfill;
+
+    FOREACH month IN ARRAY months || COALESCE(backfill, '{}'::date[]) LOOP
+        IF ensure_measurement_partition(p_layer_id, month) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+
+    -- A typed layer must still mirror its partition after rows were moved
+    IF created > 0 AND to_regclass(format('layer_%s', p_layer_id)) IS NOT NULL THEN
+        EXECUTE format('SELECT count(*) FROM measurements_l%s', p_layer_id) INTO stored;
+        EXECUTE format('SELECT count(*) FROM layer_%s', p_layer_id) INTO typed;
+        IF stored <> typed THEN
+            RAISE EXCEPTION 'layer_% has % rows, measurements_l% has %', p_layer_id, typed, p_layer_id, stored;
+        END IF;
+    END IF;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+--  10. Rollups: per-layer aggregates of numeric fields per grid cell and hour/day bucket
+--  Ingest marks the touched days dirty (rollup_dirty); refresh_dirty_rollups recomputes
+--  only those days, from refreshRollups on a schedule, a few at a time from getAggregate
+--  and from the Glue jobs after a merge
+CREATE TABLE measurement_rollups (
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
+    resolution TEXT NOT NULL CHECK (resolution IN ('hour','day')),
+    bucket_start TIMESTAMP NOT NULL,
+    cell_size DOUBLE PRECISION NOT NULL,  -- grid size in units of the layer SRID
+    cell_x BIGINT NOT NULL,               -- floor(x / cell_size), projected CRSs exceed INTEGER
+    cell_y BIGINT NOT NULL,
+    count BIGINT NOT NULL,
+    stats JSONB NOT NULL,                 -- {"field": {"count","min","max","mean","p50","p90","p95"}}
+    PRIMARY KEY (layer_id, resolution, cell_size, bucket_start, cell_x, cell_y)
+);
+
+CREATE TABLE rollup_dirty (
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    PRIMARY KEY (layer_id, day)
+);
+
+CREATE OR REPLACE FUNCTION mark_rollups_dirty(p_layer_id INTEGER, p_from TIMESTAMP, p_to TIMESTAMP)
+RETURNS VOID AS $$
+    INSERT INTO rollup_dirty (layer_id, day)
+    SELECT p_layer_id, generate_series(p_from::date, p_to::date, INTERVAL '1 day')::date
+    ON CONFLICT DO NOTHING;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION refresh_layer_rollups(
+    p_layer_id INTEGER,
+    p_day DATE,
+    p_cell_sizes DOUBLE PRECISION[] DEFAULT '{0.001,0.01,0.1}'
+)
+RETURNS INTEGER AS $$
+DECLARE
+    stats_sql TEXT;
+    cell_size DOUBLE PRECISION;
+    inserted INTEGER;
+    total INTEGER := 0;
+BEGIN
+    -- A BIGINT cell index holds |x| / cell_size up to 9.2e18; 1e-9 keeps every CRS extent (< 9.2e9 units) in range
+    IF EXISTS (SELECT 1 FROM unnest(p_cell_sizes) AS s(size) WHERE size IS NULL OR size < 1e-9) THEN
+        RAISE EXCEPTION 'rollup cell sizes must be at least 1e-9 layer CRS units, got %', p_cell_sizes;
+    END IF;
+
+    -- One refresh per layer/day at a time, the DELETE + INSERT below is not idempotent under concurrency
+    PERFORM pg_advisory_xact_lock(p_layer_id, p_day - DATE '2000-01-01');
+
+    -- Non-numeric values (e.g. unvalidated Glue rows) are skipped instead of failing the cast
+    SELECT string_agg(format(
+        $f$jsonb_build_object(%1$L, jsonb_build_object(
+            'count', count(%2$s), 'min', min(%2$s), 'max', max(%2$s), 'mean', avg(%2$s),
+            'p50', percentile_cont(0.5) WITHIN GROUP (ORDER BY %2$s),
+            'p90', percentile_cont(0.9) WITHIN GROUP (ORDER BY %2$s),
+            'p95', percentile_cont(0.95) WITHIN GROUP (ORDER BY %2$s)))$f$,
+        field_name,
+        format('(CASE WHEN jsonb_typeof(attributes->%1$L) = %2$L THEN (attributes->>%1$L)::double precision END)',
+               field_name, 'number')
+    ), ' || ' ORDER BY field_id)
+    INTO stats_sql
+    FROM fields
+    WHERE layer_id = p_layer_id
+      -- field_types.NUMERIC_TYPES (LambdaCode)
+      AND lower(data_type) IN ('integer','int','int4','bigint','int8','smallint','int2',
+                               'numeric','decimal','real','float4','double precision','float8');
+
+    DELETE FROM measurement_rollups
+    WHERE layer_id = p_layer_id
+      AND bucket_start >= p_day AND bucket_start < p_day + 1;
+
+    -- One scan per cell size, hour and day buckets from the same scan via GROUPING SETS
+    FOREACH cell_size IN ARRAY p_cell_sizes LOOP
+        EXECUTE format($q$
+            INSERT INTO measurement_rollups
+                (layer_id, resolution, bucket_start, cell_size, cell_x, cell_y, count, stats)
+            SELECT %1$s,
+                   CASE WHEN GROUPING(hour) = 0 THEN 'hour' ELSE 'day' END,
+                   COALESCE(hour, day),
+                   %2$s,
+                   cell_x,
+                   cell_y,
+                   count(*),
+                   %3$s
+            FROM (
+                SELECT attributes,
+                       date_trunc('hour', timestamp) AS hour,
+                       date_trunc('day', timestamp) AS day,
+                       floor(ST_X(ST_PointOnSurface(geom)) / %2$s)::bigint AS cell_x,
+                       floor(ST_Y(ST_PointOnSurface(geom)) / %2$s)::bigint AS cell_y
+                FROM measurements
+                WHERE layer_id = %1$s
+                  AND timestamp >= %4$L AND timestamp < %5$L
+                  AND geom IS NOT NULL
+            ) m
+            GROUP BY GROUPING SETS ((hour, cell_x, cell_y), (day, cell_x, cell_y))
+        $q$, p_layer_id, cell_size, COALESCE(stats_sql, $j$'{}'::jsonb$j$), p_day, p_day + 1);
+        GET DIAGNOSTICS inserted = ROW_COUNT;
+        total := total + inserted;
+    END LOOP;
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Refresh dirty days, most recent first (of one layer, or of all layers when p_layer_id is NULL)
+-- p_limit bounds the days of one call; days another session is refreshing are skipped
+CREATE OR REPLACE FUNCTION refresh_dirty_rollups(p_layer_id INTEGER DEFAULT NULL, p_limit INTEGER DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    dirty RECORD;
+    refreshed INTEGER := 0;
+BEGIN
+    FOR dirty IN
+        DELETE FROM rollup_dirty
+        WHERE (layer_id, day) IN (
+            SELECT layer_id, day FROM rollup_dirty
+            WHERE p_layer_id IS NULL OR layer_id = p_layer_id
+            ORDER BY day DESC
+            LIMIT p_limit
+            FOR UPDATE SKIP LOCKED)
+        RETURNING layer_id, day
+    LOOP
+        PERFORM refresh_layer_rollups(dirty.layer_id, dirty.day);
+        refreshed := refreshed + 1;
+    END LOOP;
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
+
+--  11. Async ingest tickets (insertFeatures write_mode "async" -> queue -> ingestConsumer)
+--  The consumer adds to inserted/failed in the same transaction as the COPY, so a
+--  ticket is done exactly when inserted + failed = accepted
+CREATE TABLE ingest_tickets (
+    ticket_id UUID PRIMARY KEY,
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
+    accepted INTEGER NOT NULL,           -- features that passed validation and were queued
+    inserted INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,                          -- last consumer error, if any
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX idx_ingest_tickets_created ON ingest_tickets(created_at);
+
+-- Queue messages (parts of a ticket) already applied, claimed in the write transaction
+-- so a redelivered message is neither written nor counted twice
+CREATE TABLE ingest_ticket_parts (
+    ticket_id UUID NOT NULL REFERENCES ingest_tickets(ticket_id) ON DELETE CASCADE,
+    part INTEGER NOT NULL,
+    PRIMARY KEY (ticket_id, part)
+);
+
+--  12. Glue export watermarks: last DynamoDB export day each incremental job has merged.
+--  Written in the transaction of the last merge chunk, so it never runs ahead of the data
+CREATE TABLE ingest_watermarks (
+    job_name TEXT PRIMARY KEY,
+    watermark DATE NOT NULL,             -- last export day merged
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
 
 --  Example Data (Optional Seed)
 INSERT INTO users (username, email) VALUES ('admin', 'admin@example.com');
@@ -82,6 +366,8 @@ VALUES
   (1, 'duration', 'numeric', 'seconds', 'Recording duration'),
   (1, 'device_model', 'text', NULL, 'Smartphone model');
 
+SELECT maintain_layer_partitions(1);
+
 --  Example Measurement
 INSERT INTO measurements (layer_id, attributes, geom)
 VALUES (
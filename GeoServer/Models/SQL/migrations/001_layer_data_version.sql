@@ -0,0 +1,3 @@
+--  001. Per-layer data version used to invalidate the Lambda response cache
+--  insertFeatures and the Glue ingest jobs increment it whenever new measurements arrive
+ALTER TABLE layers ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;
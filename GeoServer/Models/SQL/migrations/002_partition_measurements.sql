@@ -0,0 +1,162 @@
+--  002. Partition measurements by layer_id (LIST) then timestamp (RANGE, monthly)
+--  The old heap table is renamed to measurements_legacy and copied into the new
+--  partitioned table inside one transaction. Run during a write pause (stop the
+--  Glue jobs), check the counts, then DROP TABLE measurements_legacy.
+--  Rows with a NULL layer_id cannot be partitioned and stay in measurements_legacy.
+
+BEGIN;
+
+ALTER TABLE measurements RENAME TO measurements_legacy;
+ALTER TABLE measurements_legacy RENAME CONSTRAINT measurements_pkey TO measurements_legacy_pkey;
+ALTER INDEX idx_measurements_geom RENAME TO idx_measurements_legacy_geom;
+ALTER INDEX idx_measurements_layer RENAME TO idx_measurements_legacy_layer;
+ALTER INDEX idx_measurements_time RENAME TO idx_measurements_legacy_time;
+
+CREATE TABLE measurements (
+    measure_id BIGINT NOT NULL DEFAULT nextval('measurements_measure_id_seq'),
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
+    attributes JSONB,
+    geom GEOMETRY,
+    timestamp TIMESTAMP NOT NULL DEFAULT NOW(),
+    created_by INTEGER REFERENCES users(user_id),
+    PRIMARY KEY (measure_id, layer_id, timestamp)
+) PARTITION BY LIST (layer_id);
+
+-- Keep the id sequence when measurements_legacy is dropped
+ALTER SEQUENCE measurements_measure_id_seq OWNED BY measurements.measure_id;
+
+CREATE TABLE measurements_default PARTITION OF measurements DEFAULT;
+
+CREATE INDEX idx_measurements_geom ON measurements USING GIST (geom);
+CREATE INDEX idx_measurements_layer ON measurements (layer_id);
+CREATE INDEX idx_measurements_time ON measurements (timestamp);
+
+--  Partition management: measurements -> measurements_l{layer_id} -> measurements_l{layer_id}_yYYYYmMM
+--  Rows without a matching partition land in a default partition and are moved out
+--  when the partition is created (createLayer, managePartitions Lambda)
+CREATE OR REPLACE FUNCTION ensure_layer_partition(p_layer_id INTEGER)
+RETURNS BOOLEAN AS $$
+DECLARE
+    layer_part TEXT := format('measurements_l%s', p_layer_id);
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(layer_part));
+    IF to_regclass(layer_part) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    LOCK TABLE measurements_default IN SHARE ROW EXCLUSIVE MODE;
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE measurements INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)',
+        layer_part);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', layer_part || '_default', layer_part);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM measurements_default WHERE layer_id = %s RETURNING *)
+         INSERT INTO %I SELECT * FROM moved',
+        p_layer_id, layer_part);
+    EXECUTE format('ALTER TABLE measurements ATTACH PARTITION %I FOR VALUES IN (%s)', layer_part, p_layer_id);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_measurement_partition(p_layer_id INTEGER, p_month DATE)
+RETURNS BOOLEAN AS $$
+DECLARE
+    layer_part TEXT := format('measurements_l%s', p_layer_id);
+    month_start DATE := date_trunc('month', p_month)::date;
+    month_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+    part TEXT := format('measurements_l%s_%s', p_layer_id, to_char(p_month, '"y"YYYY"m"MM'));
+    sync_trigger TEXT := format('sync_layer_%s', p_layer_id);
+    has_sync BOOLEAN;
+BEGIN
+    PERFORM ensure_layer_partition(p_layer_id);
+    PERFORM pg_advisory_xact_lock(hashtext(part));
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    EXECUTE format('LOCK TABLE %I IN SHARE ROW EXCLUSIVE MODE', layer_part || '_default');
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', part, layer_part);
+    -- Typed layers: the move must not fire the sync trigger, its DELETE would drop the
+    -- layer_{id} rows and the new partition has no trigger yet to put them back
+    has_sync := EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgrelid = (layer_part || '_default')::regclass AND tgname = sync_trigger);
+    IF has_sync THEN
+        EXECUTE format('ALTER TABLE %I DISABLE TRIGGER %I', layer_part || '_default', sync_trigger);
+    END IF;
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM %I WHERE timestamp >= %L AND timestamp < %L RETURNING *)
+         INSERT INTO %I SELECT * FROM moved',
+        layer_part || '_default', month_start, month_end, part);
+    IF has_sync THEN
+        EXECUTE format('ALTER TABLE %I ENABLE TRIGGER %I', layer_part || '_default', sync_trigger);
+    END IF;
+    EXECUTE format(
+        'ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        layer_part, part, month_start, month_end);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Current month + p_months_ahead, plus every month that already has rows in the layer default partition
+CREATE OR REPLACE FUNCTION maintain_layer_partitions(p_layer_id INTEGER, p_months_ahead INTEGER DEFAULT 2)
+RETURNS INTEGER AS $$
+DECLARE
+    months DATE[];
+    backfill DATE[];
+    month DATE;
+    created INTEGER := 0;
+    stored BIGINT;
+    typed BIGINT;
+BEGIN
+    PERFORM ensure_layer_partition(p_layer_id);
+
+    -- Months are collected up front, the loop below alters the partitions being read
+    months := ARRAY(
+        SELECT generate_series(
+            date_trunc('month', NOW()),
+            date_trunc('month', NOW()) + make_interval(months => p_months_ahead),
+            INTERVAL '1 month')::date
+    );
+    EXECUTE format(
+        'SELECT array_agg(DISTINCT date_trunc(''month'', timestamp)::date) FROM %I',
+        format('measurements_l%s_default', p_layer_id))
+    INTO backfill;
+
+    FOREACH month IN ARRAY months || COALESCE(backfill, '{}'::date[]) LOOP
+        IF ensure_measurement_partition(p_layer_id, month) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+
+    -- A typed layer must still mirror its partition after rows were moved
+    IF created > 0 AND to_regclass(format('layer_%s', p_layer_id)) IS NOT NULL THEN
+        EXECUTE format('SELECT count(*) FROM measurements_l%s', p_layer_id) INTO stored;
+        EXECUTE format('SELECT count(*) FROM layer_%s', p_layer_id) INTO typed;
+        IF stored <> typed THEN
+            RAISE EXCEPTION 'layer_% has % rows, measurements_l% has %', p_layer_id, typed, p_layer_id, stored;
+        END IF;
+    END IF;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create every partition first so the copy routes rows straight to their final place
+SELECT maintain_layer_partitions(layer_id) FROM layers;
+SELECT ensure_measurement_partition(layer_id, month)
+FROM (
+    SELECT DISTINCT layer_id, date_trunc('month', COALESCE(timestamp, NOW()))::date AS month
+    FROM measurements_legacy
+    WHERE layer_id IS NOT NULL
+) legacy_months;
+
+INSERT INTO measurements (measure_id, layer_id, attributes, geom, timestamp, created_by)
+SELECT measure_id, layer_id, attributes, geom, COALESCE(timestamp, NOW()), created_by
+FROM measurements_legacy
+WHERE layer_id IS NOT NULL;
+
+DELETE FROM measurements_legacy WHERE layer_id IS NOT NULL;
+
+ANALYZE measurements;
+
+COMMIT;
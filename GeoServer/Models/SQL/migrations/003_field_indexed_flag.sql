@@ -0,0 +1,3 @@
+--  003. Fields flagged "indexed": true in the createLayer payload get an expression index
+--  on measurements_l{layer_id}; the flag records which ones
+ALTER TABLE fields ADD COLUMN IF NOT EXISTS indexed BOOLEAN NOT NULL DEFAULT FALSE;
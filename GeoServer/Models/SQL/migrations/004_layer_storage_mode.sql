@@ -0,0 +1,4 @@
+--  004. Per-layer storage mode: 'jsonb' publishes the JSONB-extracting virtual view,
+--  'typed' a layer_{layer_id} table with native columns kept in sync by trigger
+ALTER TABLE layers ADD COLUMN IF NOT EXISTS storage_mode TEXT NOT NULL DEFAULT 'jsonb'
+    CHECK (storage_mode IN ('jsonb','typed'));
@@ -0,0 +1,129 @@
+--  005. Rollups: per-layer aggregates of numeric fields per grid cell and hour/day bucket
+--  Ingest marks the touched days dirty (rollup_dirty); refresh_dirty_rollups recomputes
+--  only those days. Backfill existing data with:
+--    SELECT mark_rollups_dirty(layer_id, min(timestamp), max(timestamp)) FROM measurements GROUP BY layer_id;
+--    SELECT refresh_dirty_rollups();
+CREATE TABLE measurement_rollups (
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
+    resolution TEXT NOT NULL CHECK (resolution IN ('hour','day')),
+    bucket_start TIMESTAMP NOT NULL,
+    cell_size DOUBLE PRECISION NOT NULL,  -- grid size in units of the layer SRID
+    cell_x BIGINT NOT NULL,               -- floor(x / cell_size), projected CRSs exceed INTEGER
+    cell_y BIGINT NOT NULL,
+    count BIGINT NOT NULL,
+    stats JSONB NOT NULL,                 -- {"field": {"count","min","max","mean","p50","p90","p95"}}
+    PRIMARY KEY (layer_id, resolution, cell_size, bucket_start, cell_x, cell_y)
+);
+
+CREATE TABLE rollup_dirty (
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    PRIMARY KEY (layer_id, day)
+);
+
+CREATE OR REPLACE FUNCTION mark_rollups_dirty(p_layer_id INTEGER, p_from TIMESTAMP, p_to TIMESTAMP)
+RETURNS VOID AS $$
+    INSERT INTO rollup_dirty (layer_id, day)
+    SELECT p_layer_id, generate_series(p_from::date, p_to::date, INTERVAL '1 day')::date
+    ON CONFLICT DO NOTHING;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION refresh_layer_rollups(
+    p_layer_id INTEGER,
+    p_day DATE,
+    p_cell_sizes DOUBLE PRECISION[] DEFAULT '{0.001,0.01,0.1}'
+)
+RETURNS INTEGER AS $$
+DECLARE
+    stats_sql TEXT;
+    cell_size DOUBLE PRECISION;
+    inserted INTEGER;
+    total INTEGER := 0;
+BEGIN
+    -- A BIGINT cell index holds |x| / cell_size up to 9.2e18; 1e-9 keeps every CRS extent (< 9.2e9 units) in range
+    IF EXISTS (SELECT 1 FROM unnest(p_cell_sizes) AS s(size) WHERE size IS NULL OR size < 1e-9) THEN
+        RAISE EXCEPTION 'rollup cell sizes must be at least 1e-9 layer CRS units, got %', p_cell_sizes;
+    END IF;
+
+    -- One refresh per layer/day at a time, the DELETE + INSERT below is not idempotent under concurrency
+    PERFORM pg_advisory_xact_lock(p_layer_id, p_day - DATE '2000-01-01');
+
+    -- Non-numeric values (e.g. unvalidated Glue rows) are skipped instead of failing the cast
+    SELECT string_agg(format(
+        $f$jsonb_build_object(%1$L, jsonb_build_object(
+            'count', count(%2$s), 'min', min(%2$s), 'max', max(%2$s), 'mean', avg(%2$s),
+            'p50', percentile_cont(0.5) WITHIN GROUP (ORDER BY %2$s),
+            'p90', percentile_cont(0.9) WITHIN GROUP (ORDER BY %2$s),
+            'p95', percentile_cont(0.95) WITHIN GROUP (ORDER BY %2$s)))$f$,
+        field_name,
+        format('(CASE WHEN jsonb_typeof(attributes->%1$L) = %2$L THEN (attributes->>%1$L)::double precision END)',
+               field_name, 'number')
+    ), ' || ' ORDER BY field_id)
+    INTO stats_sql
+    FROM fields
+    WHERE layer_id = p_layer_id
+      -- field_types.NUMERIC_TYPES (LambdaCode)
+      AND lower(data_type) IN ('integer','int','int4','bigint','int8','smallint','int2',
+                               'numeric','decimal','real','float4','double precision','float8');
+
+    DELETE FROM measurement_rollups
+    WHERE layer_id = p_layer_id
+      AND bucket_start >= p_day AND bucket_start < p_day + 1;
+
+    -- One scan per cell size, hour and day buckets from the same scan via GROUPING SETS
+    FOREACH cell_size IN ARRAY p_cell_sizes LOOP
+        EXECUTE format($q$
+            INSERT INTO measurement_rollups
+                (layer_id, resolution, bucket_start, cell_size, cell_x, cell_y, count, stats)
+            SELECT %1$s,
+                   CASE WHEN GROUPING(hour) = 0 THEN 'hour' ELSE 'day' END,
+                   COALESCE(hour, day),
+                   %2$s,
+                   cell_x,
+                   cell_y,
+                   count(*),
+                   %3$s
+            FROM (
+                SELECT attributes,
+                       date_trunc('hour', timestamp) AS hour,
+                       date_trunc('day', timestamp) AS day,
+                       floor(ST_X(ST_PointOnSurface(geom)) / %2$s)::bigint AS cell_x,
+                       floor(ST_Y(ST_PointOnSurface(geom)) / %2$s)::bigint AS cell_y
+                FROM measurements
+                WHERE layer_id = %1$s
+                  AND timestamp >= %4$L AND timestamp < %5$L
+                  AND geom IS NOT NULL
+            ) m
+            GROUP BY GROUPING SETS ((hour, cell_x, cell_y), (day, cell_x, cell_y))
+        $q$, p_layer_id, cell_size, COALESCE(stats_sql, $j$'{}'::jsonb$j$), p_day, p_day + 1);
+        GET DIAGNOSTICS inserted = ROW_COUNT;
+        total := total + inserted;
+    END LOOP;
+    RETURN total;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Refresh dirty days, most recent first (of one layer, or of all layers when p_layer_id is NULL)
+-- p_limit bounds the days of one call; days another session is refreshing are skipped
+CREATE OR REPLACE FUNCTION refresh_dirty_rollups(p_layer_id INTEGER DEFAULT NULL, p_limit INTEGER DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    dirty RECORD;
+    refreshed INTEGER := 0;
+BEGIN
+    FOR dirty IN
+        DELETE FROM rollup_dirty
+        WHERE (layer_id, day) IN (
+            SELECT layer_id, day FROM rollup_dirty
+            WHERE p_layer_id IS NULL OR layer_id = p_layer_id
+            ORDER BY day DESC
+            LIMIT p_limit
+            FOR UPDATE SKIP LOCKED)
+        RETURNING layer_id, day
+    LOOP
+        PERFORM refresh_layer_rollups(dirty.layer_id, dirty.day);
+        refreshed := refreshed + 1;
+    END LOOP;
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,23 @@
+--  006. Async ingest tickets (insertFeatures write_mode "async" -> queue -> ingestConsumer)
+--  The consumer adds to inserted/failed in the same transaction as the COPY, so a
+--  ticket is done exactly when inserted + failed = accepted
+CREATE TABLE IF NOT EXISTS ingest_tickets (
+    ticket_id UUID PRIMARY KEY,
+    layer_id INTEGER NOT NULL REFERENCES layers(layer_id) ON DELETE CASCADE,
+    accepted INTEGER NOT NULL,           -- features that passed validation and were queued
+    inserted INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,                          -- last consumer error, if any
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_tickets_created ON ingest_tickets(created_at);
+
+-- Queue messages (parts of a ticket) already applied, claimed in the write transaction
+-- so a redelivered message is neither written nor counted twice
+CREATE TABLE IF NOT EXISTS ingest_ticket_parts (
+    ticket_id UUID NOT NULL REFERENCES ingest_tickets(ticket_id) ON DELETE CASCADE,
+    part INTEGER NOT NULL,
+    PRIMARY KEY (ticket_id, part)
+);
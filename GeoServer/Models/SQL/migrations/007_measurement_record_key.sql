@@ -0,0 +1,6 @@
+--  007. Dedup key for measurements: re-ingesting the same source record updates it in place
+--  instead of adding a copy. Rows without a record_key (older data) never conflict.
+--  The unique index is built on every partition, run it outside peak hours.
+ALTER TABLE measurements ADD COLUMN IF NOT EXISTS record_key TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_measurements_record_key ON measurements (layer_id, record_key, timestamp);
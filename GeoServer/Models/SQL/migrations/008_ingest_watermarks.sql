@@ -0,0 +1,7 @@
+--  008. Glue export watermarks: last DynamoDB export day each incremental job has merged.
+--  Written in the transaction of the last merge chunk, so it never runs ahead of the data
+CREATE TABLE IF NOT EXISTS ingest_watermarks (
+    job_name TEXT PRIMARY KEY,
+    watermark DATE NOT NULL,             -- last export day merged
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
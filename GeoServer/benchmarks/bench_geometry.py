@@ -0,0 +1,67 @@
+"""Micro-benchmark for LambdaCode/geometry.py
+
+    python GeoServer/benchmarks/bench_geometry.py [vertices ...]
+
+Times GML/WKT/WKB encoding of a polygon with one hole and of a multipolygon,
+against the string-concatenation encoder insertFeatures used before.
+"""
+import math
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "LambdaCode"))
+
+import geometry  # noqa: E402
+
+
+def ring(n, radius, cx=100.5, cy=13.7):
+    points = [[cx + radius * math.cos(2 * math.pi * i / n), cy + radius * math.sin(2 * math.pi * i / n)]
+              for i in range(n)]
+    return points + [points[0]]
+
+
+def legacy_multipolygon_gml(coords, srid):
+    """The previous generate_gml MULTIPOLYGON branch (without its prints)"""
+    gml_data = f'<gml:MultiPolygon srsName="EPSG:{srid}">\n'
+    for polygon in coords:
+        for ring_coords in polygon:
+            coord_str = ""
+            for x, y in ring_coords:
+                coord_str += f"{x},{y} "
+            gml_data += f"""
+                <gml:polygonMember>
+                    <gml:Polygon>
+                        <gml:outerBoundaryIs>
+                            <gml:LinearRing>
+                                <gml:coordinates>{coord_str.strip()}</gml:coordinates>
+                            </gml:LinearRing>
+                        </gml:outerBoundaryIs>
+                    </gml:Polygon>
+                </gml:polygonMember>
+                """
+    gml_data += "</gml:MultiPolygon>"
+    return gml_data
+
+
+def bench(label, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print(f"  {label:<28} {seconds * 1000:9.3f} ms")
+
+
+def main(sizes):
+    print(f"numpy: {'yes' if geometry.np is not None else 'no (array module)'}")
+    for n in sizes:
+        polygon = [ring(n, 0.1), ring(max(4, n // 10), 0.01)]
+        multipolygon = [polygon] * 10
+        number = max(1, 200000 // n)
+        print(f"\n{n} vertices per exterior ring (multipolygon: 10 polygons)")
+        bench("polygon to_gml", lambda: geometry.to_gml("POLYGON", polygon, 4326), number)
+        bench("polygon to_wkt", lambda: geometry.to_wkt("POLYGON", polygon), number)
+        bench("polygon to_ewkb_hex", lambda: geometry.to_ewkb_hex("POLYGON", polygon, 4326), number)
+        bench("multipolygon to_gml", lambda: geometry.to_gml("MULTIPOLYGON", multipolygon, 4326), number)
+        bench("multipolygon legacy gml", lambda: legacy_multipolygon_gml(multipolygon, 4326), number)
+
+
+if __name__ == "__main__":
+    main([int(v) for v in sys.argv[1:]] or [100, 1000, 10000, 100000])